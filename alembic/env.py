@@ -12,6 +12,7 @@ from skaben.models.base import Base as app_base
 from skaben.config import get_settings
 from skaben.models import (
     device,
+    state,
 )
 
 target_metadata = app_base.metadata
@@ -0,0 +1,36 @@
+"""alertcounter rollup
+
+Revision ID: b52e9d17c4a0
+Revises: 3d7e0b5f9a12
+Create Date: 2026-10-18 14:05:12.381920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b52e9d17c4a0'
+down_revision = '3d7e0b5f9a12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'alertcounterrollup',
+        sa.Column('start', sa.DateTime(), nullable=False),
+        sa.Column('min', sa.Integer(), nullable=False),
+        sa.Column('max', sa.Integer(), nullable=False),
+        sa.Column('last', sa.Integer(), nullable=False),
+        sa.Column('last_timestamp', sa.DateTime(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('uuid', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.PrimaryKeyConstraint('uuid'),
+        sa.UniqueConstraint('start'),
+    )
+
+
+def downgrade():
+    op.drop_table('alertcounterrollup')
@@ -0,0 +1,28 @@
+"""alertcounter timestamp index
+
+Revision ID: f316236c7852
+Revises: 5c1fe753b520
+Create Date: 2026-10-18 10:14:03.518402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f316236c7852'
+down_revision = '5c1fe753b520'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_alertcounter_timestamp_uuid',
+        'alertcounter',
+        [sa.text('timestamp DESC'), sa.text('uuid DESC')],
+    )
+
+
+def downgrade():
+    op.drop_index('ix_alertcounter_timestamp_uuid', table_name='alertcounter')
@@ -0,0 +1,60 @@
+"""initial
+
+Revision ID: 5c1fe753b520
+Revises:
+Create Date: 2026-10-18 10:12:41.105236
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '5c1fe753b520'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'state',
+        sa.Column('name', sa.String(length=32), nullable=False),
+        sa.Column('order', sa.Integer(), nullable=False),
+        sa.Column('info', sa.String(length=256), nullable=True),
+        sa.Column('threshold', sa.Integer(), nullable=True),
+        sa.Column('current', sa.Boolean(), nullable=True),
+        sa.Column('counter_mod', sa.Integer(), nullable=True),
+        sa.Column('uuid', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.PrimaryKeyConstraint('uuid'),
+        sa.UniqueConstraint('name'),
+        sa.UniqueConstraint('order'),
+    )
+    op.create_table(
+        'alertcounter',
+        sa.Column('value', sa.Integer(), nullable=True),
+        sa.Column('comment', sa.String(length=256), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+        sa.Column('uuid', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.PrimaryKeyConstraint('uuid'),
+    )
+    op.create_table(
+        'lock',
+        sa.Column('name', sa.String(length=256), nullable=True),
+        sa.Column('device_type', sa.String(length=128), nullable=False),
+        sa.Column('device_addr', postgresql.MACADDR(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+        sa.Column('ignored', sa.Boolean(), nullable=True),
+        sa.Column('closed', sa.Boolean(), nullable=True),
+        sa.Column('blocked', sa.Boolean(), nullable=True),
+        sa.Column('sound', sa.Boolean(), nullable=True),
+        sa.Column('timer', sa.Integer(), nullable=True),
+        sa.Column('uuid', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.PrimaryKeyConstraint('uuid'),
+    )
+
+
+def downgrade():
+    op.drop_table('lock')
+    op.drop_table('alertcounter')
+    op.drop_table('state')
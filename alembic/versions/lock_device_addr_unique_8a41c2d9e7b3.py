@@ -0,0 +1,28 @@
+"""lock device_addr unique
+
+Revision ID: 8a41c2d9e7b3
+Revises: f316236c7852
+Create Date: 2026-10-18 11:02:47.120934
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8a41c2d9e7b3'
+down_revision = 'f316236c7852'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # оставляем самую свежую запись каждого устройства
+    op.execute(
+        'DELETE FROM lock a USING lock b '
+        'WHERE a.device_addr = b.device_addr AND (a.timestamp, a.uuid) < (b.timestamp, b.uuid)'
+    )
+    op.create_unique_constraint('lock_device_addr_key', 'lock', ['device_addr'])
+
+
+def downgrade():
+    op.drop_constraint('lock_device_addr_key', 'lock', type_='unique')
@@ -0,0 +1,34 @@
+"""simpleconfig
+
+Revision ID: 3d7e0b5f9a12
+Revises: 8a41c2d9e7b3
+Create Date: 2026-10-18 12:20:31.504117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3d7e0b5f9a12'
+down_revision = '8a41c2d9e7b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'simpleconfig',
+        sa.Column('device_type', sa.String(length=128), nullable=False),
+        sa.Column('state_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('config', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column('uuid', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.ForeignKeyConstraint(['state_id'], ['state.uuid'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('uuid'),
+        sa.UniqueConstraint('device_type', 'state_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('simpleconfig')
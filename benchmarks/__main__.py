@@ -0,0 +1,105 @@
+"""Run benchmark suite and store results as JSON
+
+   python -m benchmarks                          # all bench_* modules
+   python -m benchmarks pipeline dispatch        # selected ones
+   python -m benchmarks --compare benchmarks/results/<previous>.json
+
+   result file keeps environment (python, platform, git commit, json codec) next to
+   records of every benchmark, `--compare` prints rate change against previous run
+   and exits with 1 if any benchmark got slower than `--threshold` percent
+"""
+import argparse
+import importlib
+import json
+import pkgutil
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import benchmarks
+from benchmarks.common import report
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+
+
+def discover() -> list[str]:
+    return sorted(m.name[len('bench_'):] for m in pkgutil.iter_modules(benchmarks.__path__)
+                  if m.name.startswith('bench_'))
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    from skaben.modules.mq import codec
+
+    return {
+        'created': datetime.utcnow().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'codec': codec.BACKEND,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """print rate change of benchmarks present in both runs, returns names of regressions"""
+    previous = {(module, r['name']): r for module, results in baseline['benchmarks'].items() for r in results}
+    regressions = []
+    print(f"\ncompared to {baseline['environment'].get('commit')} ({baseline['environment'].get('created')}):")
+    for module, results in current['benchmarks'].items():
+        for r in results:
+            old = previous.get((module, r['name']))
+            if not old or not old['rate']:
+                continue
+            change = (r['rate'] - old['rate']) / old['rate'] * 100
+            mark = ''
+            if change < -threshold:
+                mark = '  <-- regression'
+                regressions.append(r['name'])
+            print(f"{r['name']:<48} {old['rate']:>12.1f} -> {r['rate']:>12.1f} /s {change:>+7.1f}%{mark}")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='run SKABEN benchmarks')
+    parser.add_argument('names', nargs='*', help=f'benchmarks to run, default: all ({", ".join(discover())})')
+    parser.add_argument('--output', type=Path, help='result file, default: benchmarks/results/<time>.json')
+    parser.add_argument('--compare', type=Path, help='previous result file to compare with')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed rate drop, percent')
+    args = parser.parse_args(argv)
+
+    names = args.names or discover()
+    unknown = set(names) - set(discover())
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+
+    document = {'environment': environment(), 'benchmarks': {}}
+    for name in names:
+        print(f'[+] {name}')
+        module = importlib.import_module(f'benchmarks.bench_{name}')
+        results = module.run()
+        report(results)
+        document['benchmarks'][name] = results
+
+    output = args.output or RESULTS_DIR / f"{datetime.utcnow():%Y%m%dT%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(document, indent=2))
+    print(f'[+] results saved to {output}')
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if compare(document, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""48 hours of alert counter as a chart: client-side aggregation vs /alert/counter/aggregate
+
+   needs the database from settings, tables are recreated.
+   baseline downloads the whole history with `?stream=true` and buckets it in Python
+
+   python -m benchmarks.bench_aggregate
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from httpx import AsyncClient
+
+from benchmarks.common import report, summarize
+from skaben.database import async_session, engine
+from skaben.main import app
+from skaben.models.base import Base
+from skaben.models.state import AlertCounter
+
+HOURS = 48
+# запись счетчика каждые 5 секунд
+STEP = 5
+INTERVAL = 300
+REPEAT = 20
+
+
+async def reset_db(until: datetime):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    started = until - timedelta(hours=HOURS)
+    rows = HOURS * 3600 // STEP
+    async with async_session() as session:
+        session.add_all(AlertCounter(value=i % 500, timestamp=started + timedelta(seconds=i * STEP))
+                        for i in range(rows))
+        await session.commit()
+
+
+def aggregate(lines: list[str]) -> dict:
+    buckets = {}
+    for line in lines:
+        row = json.loads(line)
+        bucket = int(datetime.fromisoformat(row['timestamp']).replace(tzinfo=timezone.utc).timestamp()) // INTERVAL
+        # история отдается от новых к старым - первое значение интервала последнее по времени
+        item = buckets.setdefault(bucket, {'min': row['value'], 'max': row['value'], 'last': row['value'], 'count': 0})
+        item['min'] = min(item['min'], row['value'])
+        item['max'] = max(item['max'], row['value'])
+        item['count'] += 1
+    return buckets
+
+
+async def measure(name: str, request) -> dict:
+    latencies = []
+    points = 0
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        t = time.perf_counter()
+        points = await request()
+        latencies.append(time.perf_counter() - t)
+    return summarize(name, REPEAT, time.perf_counter() - started, latencies, points=points)
+
+
+async def main() -> list[dict]:
+    try:
+        async with engine.connect():
+            pass
+    except (OSError, ConnectionError) as e:
+        logging.error(f'database is not available, skipping: {e}')
+        return []
+    until = datetime.utcnow().replace(microsecond=0)
+    await reset_db(until)
+    since = (until - timedelta(hours=HOURS)).isoformat()
+
+    async with AsyncClient(app=app, base_url='http://testserver') as client:
+        async def client_side():
+            response = await client.get('/alert/counter', params={'stream': True, 'since': since})
+            return len(aggregate(response.text.splitlines()))
+
+        async def server_side():
+            response = await client.get('/alert/counter/aggregate',
+                                        params={'interval': INTERVAL, 'since': since, 'until': until.isoformat()})
+            return len(response.json())
+
+        results = [await measure('48h chart: stream history + aggregate', client_side),
+                   await measure('48h chart: /counter/aggregate', server_side)]
+    await engine.dispose()
+    return results
+
+
+def run() -> list[dict]:
+    return asyncio.run(main())
+
+
+if __name__ == '__main__':
+    report(run())
@@ -0,0 +1,55 @@
+"""MQ JSON codec: stdlib json (kombu default) vs registered codec
+
+   samples are shaped as real device traffic: smart devices send datahold
+   as JSON string inside JSON, so the legacy path parses every message twice.
+
+   python -m benchmarks.bench_codec
+"""
+import json
+import time
+
+from kombu.utils import json as kombu_json
+
+from benchmarks.common import report, timeit
+from skaben.modules.mq import codec
+
+MESSAGES = 50000
+
+
+def sample_payloads() -> list:
+    now = int(time.time())
+    lock_sup = json.dumps({'timestamp': now, 'task_id': 'lock-4821', 'hash': '5d41402abc4b2a76b9719d911017c592',
+                           'datahold': json.dumps({'closed': True, 'blocked': False, 'sound': True, 'timer': 10})})
+    terminal_cup = json.dumps({'timestamp': now, 'task_id': 'terminal-0a1b', 'hash': '',
+                               'datahold': json.dumps({'powered': True, 'blocked': False, 'hacked': False,
+                                                       'menu_items': [f'item-{i}' for i in range(20)],
+                                                       'header': 'SKABEN TERMINAL v2', 'hack_attempts': 3})})
+    pong = json.dumps({'timestamp': now, 'datahold': {}})
+    samples = (lock_sup.encode(), terminal_cup.encode(), pong.encode())
+    return [samples[i % len(samples)] for i in range(MESSAGES)]
+
+
+def legacy_decode(body) -> dict:
+    """parse_json + parse_smart before the codec: stdlib json, nested datahold parsed again"""
+    data = json.loads(body)
+    datahold = data.get('datahold', {})
+    if not isinstance(datahold, dict):
+        datahold = json.loads(datahold) if datahold else {}
+    return {'timestamp': int(data.get('timestamp', 0)), 'task_id': data.get('task_id', 0),
+            'hash': data.get('hash', ''), 'datahold': datahold}
+
+
+def run() -> list[dict]:
+    payloads = sample_payloads()
+    assert all(legacy_decode(p)['datahold'] == codec.decode_ask(p)['datahold'] for p in payloads[:3])
+    outgoing = [codec.decode_ask(p) for p in payloads]
+    return [
+        timeit('decode ask payload: stdlib json', legacy_decode, payloads),
+        timeit(f'decode ask payload: codec ({codec.BACKEND})', codec.decode_ask, payloads),
+        timeit('encode CUP payload: kombu json', kombu_json.dumps, outgoing),
+        timeit(f'encode CUP payload: codec ({codec.BACKEND})', codec.dumps, outgoing),
+    ]
+
+
+if __name__ == '__main__':
+    report(run())
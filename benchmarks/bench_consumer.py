@@ -0,0 +1,66 @@
+"""AsyncConsumer throughput over the in-memory broker
+
+   python -m benchmarks.bench_consumer
+"""
+import asyncio
+import json
+import time
+
+from kombu import Exchange
+
+from benchmarks.common import report, summarize
+from skaben.modules.mq.broker import MemoryBroker
+from skaben.modules.mq.config import TRANSPORT_QUEUES, MQFactory
+from skaben.modules.mq.consumer import AsyncConsumer
+from skaben.modules.mq.handlers import MessageHandler
+
+MESSAGES = 20000
+
+
+def sample_messages(count: int):
+    payload = json.dumps({'timestamp': int(time.time()), 'task_id': 'lock-1', 'hash': 'abc',
+                          'datahold': {'closed': True, 'blocked': False}})
+    return [(f'ask.lock.{i % 500:012x}.{TRANSPORT_QUEUES[i % 3]}', payload) for i in range(count)]
+
+
+async def consume(count: int, concurrency: int, prefetch: int, io_delay: float) -> dict:
+    exchange = Exchange('ask', type='topic')
+    broker = MemoryBroker()
+    handler = MessageHandler(config=None)
+    latencies = []
+    done = asyncio.Event()
+
+    async def on_message(delivery):
+        handler.handle_message(delivery.body['payload'], delivery)
+        if io_delay:
+            await asyncio.sleep(io_delay)  # эмулируем запрос к БД
+        latencies.append(time.perf_counter() - delivery.body['sent'])
+        if len(latencies) == count:
+            done.set()
+
+    queues = [MQFactory.create_queue(name, exchange) for name in TRANSPORT_QUEUES]
+    consumer = AsyncConsumer(broker, on_message, queues, prefetch=prefetch, concurrency=concurrency)
+    await consumer.start()
+    started = time.perf_counter()
+    for routing_key, payload in sample_messages(count):
+        broker.publish({'payload': payload, 'sent': time.perf_counter()}, 'ask', routing_key)
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    await consumer.stop()
+    return summarize(f'consumer c={concurrency} prefetch={prefetch} io={io_delay * 1000:g}ms',
+                     count, elapsed, latencies)
+
+
+def run() -> list[dict]:
+    results = []
+    for count, concurrency, prefetch, io_delay in ((MESSAGES, 1, 1, 0),
+                                                   (MESSAGES, 32, 64, 0),
+                                                   (MESSAGES // 10, 1, 1, 0.0005),
+                                                   (MESSAGES, 32, 64, 0.0005),
+                                                   (MESSAGES, 128, 256, 0.0005)):
+        results.append(asyncio.run(consume(count, concurrency, prefetch, io_delay)))
+    return results
+
+
+if __name__ == '__main__':
+    report(run())
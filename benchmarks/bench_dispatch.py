@@ -0,0 +1,82 @@
+"""Routing key dispatch: legacy dict parsing vs precompiled DispatchTable
+
+   python -m benchmarks.bench_dispatch
+"""
+import json
+import time
+
+from benchmarks.common import report, timeit
+from skaben.modules.core.devices import SmartDeviceEnum
+from skaben.modules.mq.broker import Delivery
+from skaben.modules.mq.codec import parse_json
+from skaben.modules.mq.handlers import MessageHandler
+
+MESSAGES = 50000
+
+
+def parse_basic(routing_key: list) -> dict:
+    """get device parameters from topic name (routing key)"""
+    device_type, device_uid, command = routing_key
+    return dict(device_type=device_type, device_uid=device_uid, command=command)
+
+
+def parse_smart(data: dict) -> dict:
+    """get additional data-fields from smart device"""
+    parsed = {'datahold': f'{data}'}
+    if isinstance(data, dict):
+        parsed = dict(
+            timestamp=int(data.get('timestamp', 0)),
+            task_id=data.get('task_id', 0),
+            datahold=parse_json(data.get('datahold', {})),
+            hash=data.get('hash', '')
+        )
+    return parsed
+
+
+def legacy_handle_message(body, message) -> dict:
+    """MessageHandler.handle_message before dispatch table was introduced"""
+    rk = message.delivery_info.get('routing_key').split('.')
+    if rk[0] == 'ask':
+        rk = rk[1:]
+        parsed = parse_basic(rk)
+        data = parse_json(body)
+        if parsed.get("device_type") in [e.value for e in SmartDeviceEnum]:
+            parsed.update(parse_smart(data))
+        else:
+            parsed.update(**data)
+            if not parsed.get('timestamp'):
+                parsed['timestamp'] = data.get('datahold', {}).get('timestamp', 1)
+        return parsed
+    return body
+
+
+def sample_deliveries(count: int, devices: int = 3000) -> list:
+    now = int(time.time())
+    smart = json.dumps({'timestamp': now, 'task_id': 'lock-0001', 'hash': '5d41402abc4b2a76b9719d911017c592',
+                        'datahold': {'closed': True, 'blocked': False, 'sound': True, 'timer': 10}})
+    simple = json.dumps({'timestamp': now, 'datahold': {'level': 3}})
+    kinds = (('lock', 'sup', smart), ('terminal', 'cup', smart), ('lock', 'pong', smart),
+             ('pwr', 'pong', simple), ('rgb', 'pong', simple), ('scl', 'sup', simple))
+    deliveries = []
+    for i in range(count):
+        device_type, command, body = kinds[i % len(kinds)]
+        routing_key = f'ask.{device_type}.{i % devices:012x}.{command}'
+        deliveries.append(Delivery(body, routing_key, lambda ok, requeue: None))
+    return deliveries
+
+
+def run() -> list[dict]:
+    handler = MessageHandler(config=None)
+    deliveries = sample_deliveries(MESSAGES)
+    return [
+        timeit('handle_message legacy (dict chain)',
+               lambda d: legacy_handle_message(d.body, d), deliveries),
+        timeit('handle_message dispatch table',
+               lambda d: handler.handle_message(d.body, d), deliveries),
+        timeit('dispatch resolve',
+               handler.dispatch.resolve, [handler.handle_message(d.body, d) for d in deliveries]),
+    ]
+
+
+if __name__ == '__main__':
+    report(run())
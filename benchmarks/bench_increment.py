@@ -0,0 +1,92 @@
+"""PATCH /alert/counter under concurrent requests: read-modify-write vs atomic increment
+
+   needs the database from settings, tables are recreated.
+   `lost` is the number of increments missing from the final counter value.
+
+   python -m benchmarks.bench_increment
+"""
+import asyncio
+import logging
+import time
+
+from httpx import AsyncClient
+
+from benchmarks.common import report, summarize
+from skaben.database import async_session, engine
+from skaben.main import app
+from skaben.models.base import Base
+from skaben.models.state import AlertCounter, State
+from skaben.modules.state import methods
+from skaben.modules.state.cache import get_state_cache
+from skaben.schema.state import AlertCounterSchema
+
+REQUESTS = 2000
+CONCURRENCY = 50
+
+
+async def legacy_change_counter(session, counter):
+    """change_counter before the atomic path: read last value, compute, insert"""
+    last_counter = await methods.get_last_counter(session)
+    new_value = last_counter.value + counter.value if counter.increase else last_counter.value - counter.value
+    payload = counter.dict()
+    payload.update(value=new_value)
+    return await methods.create_counter(session, AlertCounterSchema(**payload))
+
+
+async def reset_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_session() as session:
+        session.add_all([State(name='green', order=1, threshold=0, current=True), AlertCounter(value=0)])
+        await session.commit()
+    get_state_cache().invalidate(broadcast=False)
+
+
+async def hammer(name: str) -> dict:
+    await reset_db()
+    latencies = []
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async with AsyncClient(app=app, base_url='http://testserver') as client:
+        async def request():
+            async with semaphore:
+                t = time.perf_counter()
+                response = await client.patch('/alert/counter', json={'value': 1, 'increase': True})
+                latencies.append(time.perf_counter() - t)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(REQUESTS)))
+        elapsed = time.perf_counter() - started
+
+    async with async_session() as session:
+        get_state_cache().invalidate(broadcast=False)
+        last = await methods.get_last_counter(session)
+    return summarize(name, REQUESTS, elapsed, latencies, lost=REQUESTS - last.value)
+
+
+async def main() -> list[dict]:
+    try:
+        async with engine.connect():
+            pass
+    except (OSError, ConnectionError) as e:
+        logging.error(f'database is not available, skipping: {e}')
+        return []
+    atomic = methods.change_counter
+    methods.change_counter = legacy_change_counter
+    try:
+        results = [await hammer('PATCH /alert/counter: read-modify-write')]
+    finally:
+        methods.change_counter = atomic
+    results.append(await hammer('PATCH /alert/counter: atomic increment'))
+    await engine.dispose()
+    return results
+
+
+def run() -> list[dict]:
+    return asyncio.run(main())
+
+
+if __name__ == '__main__':
+    report(run())
@@ -0,0 +1,77 @@
+"""Ingress rate limit and sup coalescing with one flooding device
+
+   a second of traffic of a healthy fleet (sup + cup of every device) mixed
+   with a broken device sending hundreds of sup/cup, handled by MessageHandler
+   whose dispatch handler burns `WORK_US` of CPU (config push, save).
+   `healthy_done_ms` is when the last message of healthy devices was handled:
+   without ingress it waits behind the whole flood.
+
+   python -m benchmarks.bench_ingress
+"""
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from benchmarks.common import report, summarize, timeit
+from skaben.modules.mq.broker import Delivery
+from skaben.modules.mq.dispatch import DeviceMessage, DispatchTable
+from skaben.modules.mq.handlers import MessageHandler
+from skaben.modules.mq.ingress import Ingress
+
+DEVICES = 2000
+FLOOD = 8000
+WORK_US = 50
+BROKEN = 'badbadbadbad'
+
+
+def traffic() -> list[Delivery]:
+    body = json.dumps({'timestamp': 1, 'task_id': 0, 'hash': 'h', 'datahold': {'closed': True}})
+    healthy = [f'ask.lock.{i:012x}.{command}' for i in range(DEVICES) for command in ('sup', 'cup')]
+    # поток сломанного устройства равномерно перемешан с остальными
+    per_message = FLOOD // len(healthy)
+    mixed = []
+    for routing_key in healthy:
+        mixed.append(routing_key)
+        mixed.extend(f'ask.lock.{BROKEN}.{"sup" if i % 4 else "cup"}' for i in range(per_message))
+    return [Delivery(body, routing_key, lambda ok, requeue: None) for routing_key in mixed]
+
+
+async def handle_all(name: str, ingress: Ingress | None) -> dict:
+    forwarded = 0
+
+    async def work(parsed: DeviceMessage, delivery: Delivery):
+        nonlocal forwarded
+        forwarded += 1
+        deadline = time.perf_counter() + WORK_US / 1e6
+        while time.perf_counter() < deadline:
+            pass
+
+    dispatch = DispatchTable()
+    dispatch.register(['lock'], ['sup', 'cup'], work)
+    handler = MessageHandler(SimpleNamespace(exchanges={}), dispatch=dispatch, ingress=ingress)
+    deliveries = traffic()
+    healthy_done = 0.0
+    started = time.perf_counter()
+    for delivery in deliveries:
+        await handler.handle(delivery)
+        if BROKEN not in delivery.routing_key:
+            healthy_done = time.perf_counter() - started
+    await handler.drain()
+    elapsed = time.perf_counter() - started
+    return summarize(name, len(deliveries), elapsed, forwarded=forwarded,
+                     healthy_done_ms=round(healthy_done * 1000, 1))
+
+
+def run() -> list[dict]:
+    ingress = Ingress(rate=20, burst=40, window=1.0)
+    messages = [DeviceMessage('lock', f'{i % DEVICES:012x}', ('sup', 'cup', 'info')[i % 3]) for i in range(50000)]
+    return [
+        timeit('Ingress.admit', lambda message: ingress.admit(message, None), messages),
+        asyncio.run(handle_all('handle: no ingress', None)),
+        asyncio.run(handle_all('handle: rate limit + coalescing', Ingress(rate=20, burst=40, window=1.0))),
+    ]
+
+
+if __name__ == '__main__':
+    report(run())
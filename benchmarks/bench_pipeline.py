@@ -0,0 +1,140 @@
+"""MQ hot path over kombu memory:// transport
+
+   realistic traffic mix of lock, terminal, pwr, rgb and scl devices:
+   MessageHandler.handle_message, MQInterface._publish and
+   full publish -> consume round trips (BatchPublisher -> KombuBroker -> AsyncConsumer)
+
+   python -m benchmarks.bench_pipeline
+"""
+import asyncio
+import json
+import random
+import time
+from types import SimpleNamespace
+
+from kombu import Connection, Exchange
+
+from benchmarks.common import report, summarize, timeit
+from skaben.modules.mq.broker import Delivery, KombuBroker
+from skaben.modules.mq.config import TRANSPORT_QUEUES, MQFactory
+from skaben.modules.mq.consumer import AsyncConsumer
+from skaben.modules.mq.handlers import MessageHandler
+from skaben.modules.mq.interface import MQInterface
+from skaben.modules.mq.publisher import BatchPublisher
+
+MESSAGES = 20000
+ROUND_TRIPS = 5000
+DEVICES = 500
+
+# доли трафика: пинги всех устройств, состояние замков и терминалов, запросы конфигурации
+TRAFFIC = (
+    ('lock', 'pong', 20), ('lock', 'sup', 15), ('lock', 'cup', 3),
+    ('terminal', 'pong', 10), ('terminal', 'sup', 5), ('terminal', 'cup', 2),
+    ('pwr', 'pong', 10), ('rgb', 'pong', 25), ('scl', 'pong', 5), ('scl', 'sup', 5),
+)
+
+
+def device_body(device_type: str, now: int) -> str:
+    if device_type == 'lock':
+        datahold = {'closed': True, 'blocked': False, 'sound': True, 'timer': 10}
+    elif device_type == 'terminal':
+        datahold = {'powered': True, 'blocked': False, 'hacked': False, 'menu_items': ['log', 'door', 'alert']}
+    else:
+        return json.dumps({'timestamp': now, 'datahold': {'level': 3}})
+    return json.dumps({'timestamp': now, 'task_id': f'{device_type}-0001', 'hash': '5d41402abc4b2a76b9719d911017c592',
+                       'datahold': json.dumps(datahold)})
+
+
+def traffic_mix(count: int, seed: int = 42) -> list[tuple[str, str]]:
+    """(routing_key, body) pairs in fixed proportions, shuffled with fixed seed"""
+    rnd = random.Random(seed)
+    now = int(time.time())
+    kinds = [(device_type, command) for device_type, command, weight in TRAFFIC for _ in range(weight)]
+    bodies = {device_type: device_body(device_type, now) for device_type, _, _ in TRAFFIC}
+    result = []
+    for _ in range(count):
+        device_type, command = rnd.choice(kinds)
+        result.append((f'ask.{device_type}.{rnd.randrange(DEVICES):012x}.{command}', bodies[device_type]))
+    return result
+
+
+def memory_connection() -> Connection:
+    return Connection('memory://', transport_options={'polling_interval': 0.001})
+
+
+def bench_publish(count: int) -> dict:
+    """_publish enqueue cost and time until every message is written to memory transport"""
+    exchange = Exchange('mqtt', type='topic')
+    with memory_connection() as conn:
+        exchange(conn.default_channel).declare()
+    publisher = BatchPublisher(memory_connection(), max_batch=100, flush_interval=0.005)
+    interface = MQInterface(SimpleNamespace(exchanges={'mqtt': exchange}), publisher=publisher)
+    body = {'timestamp': int(time.time()), 'task_id': 'simple', 'datahold': {'level': 3}}
+    latencies = []
+    futures = []
+    started = time.perf_counter()
+    for i in range(count):
+        t = time.perf_counter()
+        futures.append(interface._publish(body, exchange=exchange, routing_key=f'rgb.{i % DEVICES:012x}.cup'))
+        latencies.append(time.perf_counter() - t)
+    for future in futures:
+        future.result(timeout=30)
+    elapsed = time.perf_counter() - started
+    publisher.close()
+    return summarize('MQInterface._publish (memory://, confirmed)', count, elapsed, latencies)
+
+
+async def wait_declared(queues: list):
+    """queues are declared by consumer drain thread, wait for them before publishing"""
+    with memory_connection() as conn:
+        for queue in queues:
+            while True:
+                try:
+                    conn.default_channel.queue_declare(queue.name, passive=True)
+                    break
+                except conn.channel_errors:
+                    await asyncio.sleep(0.01)
+
+
+async def round_trip(count: int, concurrency: int = 32, prefetch: int = 64) -> dict:
+    """device message published to `ask` exchange until handler parsed it, whole mix sent as one burst"""
+    exchange = Exchange('ask', type='topic')
+    handler = MessageHandler(config=None)
+    latencies = []
+    done = asyncio.Event()
+
+    async def on_message(delivery: Delivery):
+        handler.handle_message(delivery.body['payload'], delivery)
+        latencies.append(time.perf_counter() - delivery.body['sent'])
+        if len(latencies) == count:
+            done.set()
+
+    queues = [MQFactory.create_queue(name, exchange, prefix='ask.') for name in TRANSPORT_QUEUES]
+    broker = KombuBroker(memory_connection(), poll_interval=0.001)
+    consumer = AsyncConsumer(broker, on_message, queues, prefetch=prefetch, concurrency=concurrency)
+    await consumer.start()
+    await wait_declared(queues)
+    publisher = BatchPublisher(memory_connection(), max_batch=100, flush_interval=0.001)
+    started = time.perf_counter()
+    for routing_key, body in traffic_mix(count):
+        publisher.publish({'payload': body, 'sent': time.perf_counter()}, exchange, routing_key)
+    await asyncio.wait_for(done.wait(), timeout=120)
+    elapsed = time.perf_counter() - started
+    publisher.close()
+    await consumer.stop()
+    return summarize(f'round trip burst c={concurrency} prefetch={prefetch}', count, elapsed, latencies)
+
+
+def run() -> list[dict]:
+    handler = MessageHandler(config=None)
+    mix = traffic_mix(MESSAGES)
+    deliveries = [Delivery(body, routing_key, lambda ok, requeue: None) for routing_key, body in mix]
+    return [
+        timeit('handle_message (device mix)', lambda d: handler.handle_message(d.body, d), deliveries),
+        bench_publish(MESSAGES),
+        asyncio.run(round_trip(ROUND_TRIPS)),
+    ]
+
+
+if __name__ == '__main__':
+    report(run())
@@ -0,0 +1,89 @@
+"""Bulk device provisioning: parsing and validation, batched upsert vs one `save()` per row
+
+   parsing runs without database. Import into DB needs the database from settings,
+   tables are recreated; baseline is `Base.save`, one commit per device
+
+   python -m benchmarks.bench_provisioning
+"""
+import asyncio
+import logging
+import time
+
+from benchmarks.common import report, summarize
+from skaben.database import async_session, engine
+from skaben.models.base import Base
+from skaben.models.device import Lock
+from skaben.modules.core.provisioning import DeviceImporter, import_devices, read_rows
+
+DEVICES = 5000
+# для построчного сохранения - медленно
+SAVE_DEVICES = 500
+
+
+def venue(count: int) -> bytes:
+    lines = ['device_addr,name,closed,blocked,sound,timer']
+    lines += [f'aa:bb:cc:{i // 65536:02x}:{i // 256 % 256:02x}:{i % 256:02x},door {i},true,false,true,{i % 60}'
+              for i in range(count)]
+    return '\n'.join(lines).encode()
+
+
+async def chunks(data: bytes, size: int = 65536):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def parse(data: bytes) -> dict:
+    async def upsert(session, model, rows):
+        return len(rows)
+
+    started = time.perf_counter()
+    importer = DeviceImporter(None, 'lock', upsert=upsert)
+    result = await importer.run(read_rows(chunks(data), 'csv'))
+    return summarize('parse + validate CSV', result.total, time.perf_counter() - started)
+
+
+async def reset_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+
+async def save_rows(count: int) -> dict:
+    await reset_db()
+    started = time.perf_counter()
+    async with async_session() as session:
+        for i in range(count):
+            await Lock(device_type='lock', device_addr=f'aabbcc{i:06x}', name=f'door {i}', timer=i % 60).save(session)
+    return summarize('Lock.save() per row', count, time.perf_counter() - started)
+
+
+async def import_rows(data: bytes, name: str) -> dict:
+    started = time.perf_counter()
+    async with async_session() as session:
+        result = await import_devices(session, 'lock', chunks(data), 'csv')
+    return summarize(name, result.imported, time.perf_counter() - started, failed=result.failed)
+
+
+async def main() -> list[dict]:
+    data = venue(DEVICES)
+    results = [await parse(data)]
+    try:
+        async with engine.connect():
+            pass
+    except (OSError, ConnectionError) as e:
+        logging.error(f'database is not available, skipping import: {e}')
+        return results
+    results.append(await save_rows(SAVE_DEVICES))
+    await reset_db()
+    results.append(await import_rows(data, 'import (insert)'))
+    results.append(await import_rows(data, 'import (update existing)'))
+    await engine.dispose()
+    return results
+
+
+def run() -> list[dict]:
+    return asyncio.run(main())
+
+
+if __name__ == '__main__':
+    report(run())
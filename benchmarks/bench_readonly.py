@@ -0,0 +1,84 @@
+"""GET endpoints of /alert with committing session vs read-only session
+
+   needs the database from settings, tables are recreated.
+   baseline runs the same requests with read-only dependencies overridden by `get_db`
+
+   python -m benchmarks.bench_readonly
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from httpx import AsyncClient
+
+from benchmarks.common import report, summarize
+from skaben.database import async_session, engine, get_db, get_db_readonly, get_db_replica
+from skaben.main import app
+from skaben.models.base import Base
+from skaben.models.state import AlertCounter, State
+from skaben.modules.state.cache import get_state_cache
+
+REQUESTS = 3000
+CONCURRENCY = 20
+COUNTERS = 2000
+ENDPOINTS = ('/alert/counter?limit=50', '/alert/state', '/alert/state?name=red')
+
+
+async def reset_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    started = datetime.utcnow() - timedelta(hours=1)
+    async with async_session() as session:
+        session.add_all([State(name='green', order=1, threshold=0, current=True),
+                         State(name='red', order=2, threshold=100)])
+        session.add_all(AlertCounter(value=i % 100, timestamp=started + timedelta(seconds=i)) for i in range(COUNTERS))
+        await session.commit()
+    get_state_cache().invalidate(broadcast=False)
+
+
+async def hammer(name: str, path: str) -> dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async with AsyncClient(app=app, base_url='http://testserver') as client:
+        async def request():
+            async with semaphore:
+                t = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - t)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(REQUESTS)))
+        elapsed = time.perf_counter() - started
+    return summarize(f'GET {path}: {name}', REQUESTS, elapsed, latencies)
+
+
+async def main() -> list[dict]:
+    try:
+        async with engine.connect():
+            pass
+    except (OSError, ConnectionError) as e:
+        logging.error(f'database is not available, skipping: {e}')
+        return []
+    await reset_db()
+    results = []
+    for path in ENDPOINTS:
+        app.dependency_overrides = {get_db_readonly: get_db, get_db_replica: get_db}
+        try:
+            results.append(await hammer('get_db (commit)', path))
+        finally:
+            app.dependency_overrides = {}
+        results.append(await hammer('read-only', path))
+    await engine.dispose()
+    return results
+
+
+def run() -> list[dict]:
+    return asyncio.run(main())
+
+
+if __name__ == '__main__':
+    report(run())
@@ -0,0 +1,106 @@
+"""Alert counter queries before and after compaction of old history
+
+   needs the database from settings, tables are recreated. A long game worth of
+   counter rows is generated, then everything older than `RETENTION_HOURS` is moved
+   to the rollup table; last counter, history page and 48h aggregate are measured
+   on both tables, compaction itself is reported as rows per second
+
+   python -m benchmarks.bench_retention
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+
+from benchmarks.common import report, summarize
+from skaben.database import async_session, engine
+from skaben.models.base import Base
+from skaben.models.state import AlertCounter
+from skaben.modules.state import methods
+from skaben.modules.state.retention import compact_counters
+
+DAYS = 14
+# запись счетчика каждые 5 секунд
+STEP = 5
+RETENTION_HOURS = 48
+REPEAT = 200
+
+
+async def reset_db(until: datetime):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    started = until - timedelta(days=DAYS)
+    rows = [{'value': i % 500, 'comment': 'bench', 'timestamp': started + timedelta(seconds=i * STEP)}
+            for i in range(DAYS * 86400 // STEP)]
+    async with async_session() as session:
+        for chunk in range(0, len(rows), 10000):
+            await session.execute(insert(AlertCounter), rows[chunk:chunk + 10000])
+        await session.commit()
+    async with engine.execution_options(isolation_level='AUTOCOMMIT').connect() as conn:
+        await conn.exec_driver_sql('ANALYZE alertcounter')
+
+
+async def queries(until: datetime, label: str) -> list[dict]:
+    since = until - timedelta(hours=48)
+    # последнее значение без кэша - запрос из get_last_counter
+    last = select(AlertCounter).order_by(AlertCounter.timestamp.desc()).limit(1)
+    history = select(AlertCounter).order_by(AlertCounter.timestamp.desc(), AlertCounter.uuid.desc()).limit(500)
+
+    async def measure(name: str, run) -> dict:
+        latencies = []
+        async with async_session() as session:
+            started = time.perf_counter()
+            for _ in range(REPEAT):
+                t = time.perf_counter()
+                await run(session)
+                latencies.append(time.perf_counter() - t)
+            elapsed = time.perf_counter() - started
+        return summarize(f'{name}: {label}', REPEAT, elapsed, latencies)
+
+    async def last_counter(session):
+        (await session.execute(last)).scalars().first()
+
+    async def history_page(session):
+        (await session.execute(history)).scalars().all()
+
+    async def aggregate(session):
+        await methods.get_counter_buckets(session, 300, since, until)
+
+    return [await measure('last counter', last_counter),
+            await measure('history page (500)', history_page),
+            await measure('48h aggregate (300s)', aggregate)]
+
+
+async def main() -> list[dict]:
+    try:
+        async with engine.connect():
+            pass
+    except (OSError, ConnectionError) as e:
+        logging.error(f'database is not available, skipping: {e}')
+        return []
+    until = datetime.utcnow().replace(microsecond=0)
+    await reset_db(until)
+    results = await queries(until, f'{DAYS}d hot table')
+
+    horizon = until - timedelta(hours=RETENTION_HOURS)
+    started = time.perf_counter()
+    moved = await compact_counters(async_session, horizon, interval=60, batch=5000)
+    results.append(summarize('compaction', moved, time.perf_counter() - started))
+    # VACUUM не выполняется в транзакции
+    async with engine.execution_options(isolation_level='AUTOCOMMIT').connect() as conn:
+        await conn.exec_driver_sql('VACUUM ANALYZE alertcounter')
+
+    results += await queries(until, f'{RETENTION_HOURS}h hot + rollup')
+    await engine.dispose()
+    return results
+
+
+def run() -> list[dict]:
+    return asyncio.run(main())
+
+
+if __name__ == '__main__':
+    report(run())
@@ -0,0 +1,79 @@
+"""Sharding of device messages across worker processes
+
+   HashRing lookups, router shard choice, keys moved when a shard is added
+   and handle_message throughput of 1..N processes, each parsing its own shard
+   of the traffic mix. Scaling is bounded by CPU count of the machine (`cpus`).
+
+   end-to-end with RabbitMQ: `cli.py mq workers --shards N` and `cli.py mq loadgen`
+
+   python -m benchmarks.bench_shards
+"""
+import multiprocessing
+import os
+import time
+
+from benchmarks.bench_pipeline import traffic_mix
+from benchmarks.common import report, summarize, timeit
+from skaben.modules.mq.dispatch import split_routing_key
+from skaben.modules.mq.workers import HashRing
+
+MESSAGES = 40000
+REPEAT = 5
+KEYS = 20000
+
+
+def parse_shard(items: list[tuple[str, str]]) -> int:
+    from skaben.modules.mq.broker import Delivery
+    from skaben.modules.mq.handlers import MessageHandler
+
+    handler = MessageHandler(config=None)
+    deliveries = [Delivery(body, routing_key, lambda ok, requeue: None) for routing_key, body in items]
+    for _ in range(REPEAT):
+        for delivery in deliveries:
+            handler.handle_message(delivery.body, delivery)
+    return len(deliveries) * REPEAT
+
+
+def warm_up(_):
+    import skaben.modules.mq.handlers  # noqa
+
+
+def scaling(mix: list[tuple[str, str]], processes: int, baseline: float | None) -> dict:
+    ring = HashRing(range(processes))
+    shards = [[] for _ in range(processes)]
+    for routing_key, body in mix:
+        shards[ring.get(split_routing_key(routing_key)[1])].append((routing_key, body))
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        pool.map(warm_up, range(processes))
+        started = time.perf_counter()
+        count = sum(pool.map(parse_shard, shards))
+        elapsed = time.perf_counter() - started
+    rate = count / elapsed
+    return summarize(f'handle_message x {processes} processes', count, elapsed,
+                     speedup=round(rate / baseline, 2) if baseline else 1.0,
+                     largest_shard=round(max(map(len, shards)) / len(mix), 3),
+                     cpus=os.cpu_count())
+
+
+def run() -> list[dict]:
+    keys = [f'{i:012x}' for i in range(KEYS)]
+    ring, grown = HashRing(range(4)), HashRing(range(5))
+    moved = sum(ring.get(key) != grown.get(key) for key in keys) / len(keys)
+    results = [
+        timeit('HashRing.get (uncached, 4 shards)', ring._get, keys),
+        timeit('HashRing.get (cached uid)', ring.get, keys, moved_on_4_to_5=round(moved, 3)),
+    ]
+
+    mix = traffic_mix(MESSAGES)
+    results.append(timeit('route: split key + ring lookup', lambda key: ring.get(split_routing_key(key)[1]),
+                          [routing_key for routing_key, _ in mix]))
+    baseline = None
+    for processes in sorted({1, 2, 4, os.cpu_count() or 1}):
+        result = scaling(mix, processes, baseline)
+        baseline = baseline or result['rate']
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    report(run())
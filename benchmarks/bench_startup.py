@@ -0,0 +1,52 @@
+"""Cold start of CLI and FastAPI app in a fresh interpreter
+
+   broker and DB point to closed ports: nothing should connect until a command needs it
+
+   python -m benchmarks.bench_startup
+"""
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.common import report, summarize
+
+ROOT = Path(__file__).parent.parent
+REPEAT = 5
+
+COMMANDS = (
+    ('cli --help', ['skaben/cli.py', '--help']),
+    ('cli show', ['skaben/cli.py', 'show']),
+    ('cli mq ping --help', ['skaben/cli.py', 'mq', 'ping', '--help']),
+    ('import skaben.main (app)', ['-c', 'import skaben.main']),
+)
+
+
+def environment() -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(ROOT), os.environ.get('PYTHONPATH')])))
+    # закрытые порты: соединение при импорте превратится в ошибку, а не в ожидание
+    env.update(AMQP_HOST='127.0.0.1', AMQP_PORT='1', DB_HOST='127.0.0.1')
+    for name in ('AMQP_USER', 'AMQP_PASSWORD', 'POSTGRES_USER', 'POSTGRES_PASSWORD', 'POSTGRES_DB'):
+        env.setdefault(name, 'skaben')
+    return env
+
+
+def start(name: str, args: list[str], env: dict) -> dict:
+    latencies = []
+    failed = 0
+    for _ in range(REPEAT):
+        t = time.perf_counter()
+        process = subprocess.run([sys.executable, *args], cwd=ROOT, env=env, capture_output=True, timeout=60)
+        latencies.append(time.perf_counter() - t)
+        failed += process.returncode != 0
+    return summarize(f'start: {name}', REPEAT, sum(latencies), latencies, failed=failed)
+
+
+def run() -> list[dict]:
+    env = environment()
+    return [start(name, args, env) for name, args in COMMANDS]
+
+
+if __name__ == '__main__':
+    report(run())
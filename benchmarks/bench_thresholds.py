@@ -0,0 +1,48 @@
+"""Counter -> state resolution: ordered scan (what the SQL query does) vs bisect index
+
+   lookups arrive in bursts, like counter updates during an active game.
+   the DB round trip the old path paid on top of the scan is not included.
+
+   python -m benchmarks.bench_thresholds
+"""
+import random
+
+from benchmarks.common import report, timeit
+from skaben.models.state import State
+from skaben.modules.state.thresholds import ThresholdIndex
+
+BURST = 10000
+
+
+def sample_states() -> list[State]:
+    names = ['white', 'green', 'blue', 'yellow', 'orange', 'red', 'black']
+    thresholds = [-1, 0, 150, 300, 500, 750, -1]
+    return [State(name=name, order=order, threshold=threshold)
+            for order, (name, threshold) in enumerate(zip(names, thresholds))]
+
+
+def scan_lookup(states: list[State], value: int):
+    """WHERE threshold <= :value ORDER BY threshold DESC LIMIT 1"""
+    matched = sorted((s for s in states if s.threshold <= value), key=lambda s: s.threshold, reverse=True)
+    return matched[0] if matched else None
+
+
+def run() -> list[dict]:
+    states = sample_states()
+    index = ThresholdIndex(states)
+    burst = [random.randint(-50, 1000) for _ in range(BURST)]
+
+    # состояния с одинаковым порогом (-1) взаимозаменяемы, сравниваем пороги
+    def threshold(state):
+        return state.threshold if state else None
+
+    assert all(threshold(scan_lookup(states, v)) == threshold(index.lookup(v)) for v in burst)
+    return [
+        timeit('state by counter: ordered scan', lambda v: scan_lookup(states, v), burst),
+        timeit('state by counter: bisect index', index.lookup, burst),
+        timeit('index rebuild', lambda _: ThresholdIndex(states), range(1000)),
+    ]
+
+
+if __name__ == '__main__':
+    report(run())
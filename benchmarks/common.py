@@ -0,0 +1,59 @@
+"""Helpers shared by benchmark scripts
+
+   every benchmark module exposes `run() -> list[dict]`,
+   results are built with `summarize` and printed with `report`
+"""
+import time
+from typing import Callable, Sequence
+
+
+def percentile(samples: Sequence[float], q: float) -> float:
+    """q-th percentile (0..100) of samples, nearest-rank"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def summarize(name: str, count: int, elapsed: float, latencies: Sequence[float] | None = None, **extra) -> dict:
+    """build result record, latencies are in seconds, reported in microseconds"""
+    result = {
+        'name': name,
+        'count': count,
+        'elapsed': round(elapsed, 6),
+        'rate': round(count / elapsed, 1) if elapsed else 0.0,
+    }
+    if latencies:
+        result.update(p50_us=round(percentile(latencies, 50) * 1e6, 2),
+                      p99_us=round(percentile(latencies, 99) * 1e6, 2))
+    result.update(extra)
+    return result
+
+
+def timeit(name: str, func: Callable, items: Sequence, repeat: int = 3, **extra) -> dict:
+    """call `func(item)` for every item, best of `repeat` runs"""
+    best = None
+    latencies = []
+    for _ in range(repeat):
+        latencies = []
+        started = time.perf_counter()
+        for item in items:
+            t = time.perf_counter()
+            func(item)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return summarize(name, len(items), best, latencies, **extra)
+
+
+def report(results: list[dict]):
+    """print results as a table"""
+    for r in results:
+        line = f"{r['name']:<48} {r['count']:>9} msgs {r['rate']:>12.1f} /s"
+        if 'p50_us' in r:
+            line += f"   p50 {r['p50_us']:>9.2f}us   p99 {r['p99_us']:>9.2f}us"
+        extra = {k: v for k, v in r.items() if k not in ('name', 'count', 'elapsed', 'rate', 'p50_us', 'p99_us')}
+        if extra:
+            line += '   ' + ' '.join(f'{k}={v}' for k, v in extra.items())
+        print(line)
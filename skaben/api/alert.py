@@ -1,17 +1,24 @@
+import json
+from datetime import datetime, timedelta, timezone
 from typing import List
+from uuid import UUID
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Response
 from fastapi.exceptions import HTTPException
-from skaben.database import get_db
-from sqlalchemy import select, delete
+from fastapi.responses import StreamingResponse
+from skaben.config import get_settings
+from skaben.database import get_db, get_db_readonly, get_db_replica
+from sqlalchemy import select, delete, or_, tuple_
 from sqlalchemy.exc import NoResultFound
 
 from skaben.models.state import State, AlertCounter
 from skaben.schema.state import (
     StateSchema, ResponseStateSchema, StateUpdateSchema,
-    AlertCounterSchema, AlertCounterRelativeSchema
+    AlertCounterSchema, AlertCounterRelativeSchema, AlertCounterBucketSchema
 )
 from skaben.modules.state import methods
+from skaben.modules.state.cache import STATE, STATES, get_state_cache
+from skaben.modules.state.events import get_event_hub, stream_events
 
 router = APIRouter(
     prefix="/alert",
@@ -20,16 +27,116 @@ router = APIRouter(
 )
 
 
+# размер страницы истории счетчика по умолчанию
+PAGE_SIZE = 500
+# размер пачки строк при потоковой выгрузке истории
+STREAM_CHUNK = 1000
+# максимальное число интервалов в ответе агрегатов счетчика
+MAX_BUCKETS = 5000
+
+
+def encode_cursor(timestamp: datetime | None, uuid: UUID) -> str:
+    return f'{timestamp.isoformat() if timestamp else ""}_{uuid}'
+
+
+def decode_cursor(cursor: str) -> tuple[datetime | None, UUID]:
+    try:
+        timestamp, _, uuid = cursor.rpartition('_')
+        return datetime.fromisoformat(timestamp) if timestamp else None, UUID(uuid)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f'Invalid cursor {cursor}')
+
+
+def naive_utc(value: datetime | None) -> datetime | None:
+    """метки счетчика хранятся в UTC без зоны, время с зоной приводится к ним"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def counters_query(cursor: str | None, since: datetime | None, until: datetime | None, *columns):
+    """история счетчика от новых к старым, keyset по (timestamp, uuid)"""
+    stmt = select(*columns).order_by(AlertCounter.timestamp.desc(), AlertCounter.uuid.desc())
+    since, until = naive_utc(since), naive_utc(until)
+    if cursor:
+        timestamp, uuid = decode_cursor(cursor)
+        if timestamp is None:
+            # записи без времени идут первыми (NULLS FIRST при DESC)
+            stmt = stmt.where(or_(AlertCounter.timestamp.isnot(None), AlertCounter.uuid < uuid))
+        else:
+            stmt = stmt.where(tuple_(AlertCounter.timestamp, AlertCounter.uuid) < (timestamp, uuid))
+    if since:
+        stmt = stmt.where(AlertCounter.timestamp >= since)
+    if until:
+        stmt = stmt.where(AlertCounter.timestamp < until)
+    return stmt
+
+
+async def stream_counters(session, stmt):
+    """строки истории в NDJSON без создания ORM-объектов
+
+       uuid отдается, чтобы продолжить выгрузку с курсором из последней строки
+    """
+    result = await session.stream(stmt.execution_options(yield_per=STREAM_CHUNK))
+    async for rows in result.partitions(STREAM_CHUNK):
+        yield ''.join(json.dumps({'uuid': str(uuid),
+                                  'value': value,
+                                  'comment': comment,
+                                  'timestamp': timestamp.isoformat() if timestamp else None}) + '\n'
+                      for uuid, value, comment, timestamp in rows)
+
+
 @router.get('/counter', response_model=List[AlertCounterSchema])
-async def get_counters(session = Depends(get_db)):
-    """Возвращает список счетчиков тревоги"""
-    stmt = select(AlertCounter).order_by(AlertCounter.timestamp.desc())
+async def get_counters(response: Response,
+                       limit: int | None = Query(None, ge=1, le=5000),
+                       cursor: str | None = None,
+                       since: datetime | None = None,
+                       until: datetime | None = None,
+                       stream: bool = False,
+                       session = Depends(get_db_replica)):
+    """Возвращает историю счетчика тревоги
+
+       страница отдается от новых записей к старым, курсор следующей страницы
+       возвращается в заголовке X-Next-Cursor (по умолчанию 500 записей).
+       `stream` выгружает выборку в NDJSON, без `limit` - целиком
+    """
+    if stream:
+        stmt = counters_query(cursor, since, until,
+                              AlertCounter.uuid, AlertCounter.value, AlertCounter.comment, AlertCounter.timestamp)
+        if limit:
+            stmt = stmt.limit(limit)
+        # сессия зависимости закрывается после отправки ответа
+        return StreamingResponse(stream_counters(session, stmt), media_type='application/x-ndjson')
+    limit = limit or PAGE_SIZE
+    stmt = counters_query(cursor, since, until, AlertCounter).limit(limit)
     result = await session.execute(stmt)
-    return result.scalars().all()
+    counters = result.scalars().all()
+    if len(counters) == limit:
+        last = counters[-1]
+        response.headers['X-Next-Cursor'] = encode_cursor(last.timestamp, last.uuid)
+    return counters
+
+
+@router.get('/counter/aggregate', response_model=List[AlertCounterBucketSchema])
+async def get_counter_aggregate(interval: int = Query(300, ge=1, description='длина интервала, сек'),
+                                since: datetime | None = None,
+                                until: datetime | None = None,
+                                session = Depends(get_db_replica)):
+    """Возвращает min/max/последнее значение и число записей счетчика по интервалам
+
+       по умолчанию - последние 48 часов. Интервалы без записей не возвращаются
+    """
+    until = naive_utc(until) or datetime.utcnow()
+    since = naive_utc(since) or until - timedelta(hours=48)
+    if since >= until:
+        raise HTTPException(status_code=400, detail='`since` should be earlier than `until`')
+    if (until - since).total_seconds() / interval > MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f'Too many buckets, max is {MAX_BUCKETS}, increase `interval`')
+    return await methods.get_counter_buckets(session, interval, since, until)
 
 
 @router.get('/counter/last', response_model=AlertCounterSchema)
-async def get_counter_last(session = Depends(get_db)):
+async def get_counter_last(session = Depends(get_db_readonly)):
     """Возвращает последнее значение счетчика"""
     return await methods.get_last_counter(session)
 
@@ -37,22 +144,39 @@ async def get_counter_last(session = Depends(get_db)):
 @router.post('/counter', response_model=AlertCounterSchema)
 async def create_counter(counter: AlertCounterSchema, session = Depends(get_db)):
     """Создает запись счетчика уровня тревоги"""
-    counter_instance = AlertCounter(**counter.dict())
-    await counter_instance.save(session)
-    return counter_instance
+    return await methods.create_counter(session, counter, auto=False)
 
 
-@router.patch('/counter', response_model=AlertCounterRelativeSchema)
+@router.patch('/counter', response_model=AlertCounterSchema)
 async def change_counter(counter: AlertCounterRelativeSchema, session = Depends(get_db)):
+    """Изменяет счетчик тревоги относительно последнего значения"""
     return await methods.change_counter(session, counter)
 
 
+@router.get('/events')
+async def get_events():
+    """Поток изменений счетчика и текущего состояния тревоги (Server-Sent Events)
+
+       первыми приходят текущие значения, затем события `counter` и `state` после каждой записи.
+       все подписчики процесса получают события из одного источника
+    """
+    stream = stream_events(get_event_hub(), get_settings().app.events_keepalive)
+    return StreamingResponse(stream, media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @router.get('/state', response_model=List[StateSchema])
 async def get_states(name: str | None = None,
                      order: int | None = None,
                      current: bool | None = None,
-                     session = Depends(get_db)):
+                     session = Depends(get_db_readonly)):
     """Получение списка всех глобальных состояний игры"""
+    if current and not name and not order:
+        # текущее состояние отдается из кэша
+        try:
+            return [await methods.get_current_state(session)]
+        except ValueError:
+            return []
     stmt = select(State)
     if name:
         stmt = stmt.where(State.name == name)
@@ -65,12 +189,9 @@ async def get_states(name: str | None = None,
 
 
 @router.get('/state/{counter}')
-async def get_state_by_counter(counter: int, session = Depends(get_db)):
+async def get_state_by_counter(counter: int, session = Depends(get_db_readonly)):
     """Получение состояния по значению счетчика тревоги"""
-    stmt = select(State).where(State.threshold <= counter)\
-                              .order_by(State.threshold.desc())
-    result = await session.execute(stmt)
-    return result.scalars().first()
+    return await methods.get_state_by_counter(session, counter)
 
 
 @router.post('/state/', response_model=ResponseStateSchema)
@@ -78,6 +199,7 @@ async def create_state(state: StateSchema, session = Depends(get_db)):
     """Создание нового глобального состояния игры"""
     state_instance = State(**state.dict())
     await state_instance.save(session)
+    get_state_cache().invalidate(STATE, STATES)
     return state_instance
 
 
@@ -94,4 +216,6 @@ async def update_state(name: str, state: StateUpdateSchema, session = Depends(ge
 async def delete_state(uuid: str, session = Depends(get_db)):
     stmt = delete(State).where(State.uuid == uuid)
     await session.execute(stmt)
+    await session.commit()
+    get_state_cache().invalidate(STATE, STATES)
     return f'{uuid} deleted'
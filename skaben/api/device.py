@@ -0,0 +1,49 @@
+from typing import Dict
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.exceptions import HTTPException
+
+from skaben.config import get_settings
+from skaben.database import get_db, get_db_readonly
+from skaben.modules.core.presence import get_presence_index, load_presence
+from skaben.modules.core.provisioning import FORMATS, import_devices
+from skaben.schemas.device import DeviceImportReportSchema, DevicePresenceSchema
+
+router = APIRouter(
+    prefix="/device",
+    tags=["device"],
+    responses={404: {"description": "Device not found"}},
+)
+
+
+@router.get('/presence', response_model=Dict[str, DevicePresenceSchema])
+async def get_presence(device_type: str | None = None, session = Depends(get_db_readonly)):
+    """Возвращает устройства в сети и не в сети по типам
+
+       с потребителем MQ в этом процессе (APP_CONSUME) - из его индекса присутствия,
+       иначе по времени ответа устройств, которое потребители сохраняют в БД
+       (только типы устройств с моделью, с задержкой до APP_PRESENCE_FLUSH)
+    """
+    settings = get_settings().app
+    if not settings.consume:
+        return await load_presence(session, settings.presence_ttl + settings.presence_flush, device_type)
+    index = get_presence_index()
+    index.expire()
+    return index.snapshot(device_type)
+
+
+@router.post('/import/{device_type}', response_model=DeviceImportReportSchema)
+async def import_device_list(device_type: str, request: Request, format: str | None = None, session = Depends(get_db)):
+    """Загружает или обновляет устройства из CSV (с заголовком) или NDJSON в теле запроса
+
+       формат берется из `format` или Content-Type (text/csv, application/x-ndjson).
+       устройства обновляются по device_addr, строки с ошибками не мешают загрузке остальных
+    """
+    fmt = format or ('csv' if 'csv' in request.headers.get('content-type', '') else 'ndjson')
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f'Unknown format {fmt}, supported: {", ".join(FORMATS)}')
+    try:
+        report = await import_devices(session, device_type, request.stream(), fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return report.dict()
@@ -1,9 +1,11 @@
+import asyncio
+from datetime import datetime, timedelta
+from pathlib import Path
+
 import typer
 from skaben.modules.mq.recurrent import mq_app
 from skaben.config import get_settings
 
-settings = get_settings()
-
 app = typer.Typer()
 app.add_typer(mq_app, name="mq")
 
@@ -11,7 +13,65 @@ app.add_typer(mq_app, name="mq")
 @app.command()
 def show():
     """show config"""
-    typer.echo(f'{settings}')
+    typer.echo(f'{get_settings()}')
+
+
+@app.command()
+def compact(hours: float = typer.Option(None, help="compact counter history older than N hours, default from settings"),
+            interval: int = typer.Option(None, help="rollup interval, seconds"),
+            batch: int = typer.Option(None, help="rows moved in one transaction")):
+    """move old alert counter history to rollup table"""
+    from skaben.database import async_session, get_engine
+    from skaben.modules.state.retention import compact_counters
+
+    settings = get_settings().app
+    hours = settings.counter_retention if hours is None else hours
+    if hours <= 0:
+        raise typer.BadParameter('set --hours or APP_COUNTER_RETENTION')
+    horizon = datetime.utcnow() - timedelta(hours=hours)
+
+    async def run():
+        try:
+            return await compact_counters(async_session, horizon, interval or settings.compact_interval,
+                                          batch or settings.compact_batch)
+        finally:
+            await get_engine().dispose()
+
+    typer.echo(f'[+] {asyncio.run(run())} rows older than {horizon} compacted')
+
+
+@app.command(name="import")
+def import_device_list(path: Path = typer.Argument(..., exists=True, dir_okay=False, help="CSV or NDJSON file"),
+                       device_type: str = typer.Option(..., "--type", help="device type, e.g. lock"),
+                       fmt: str = typer.Option(None, "--format", help="csv or ndjson, default by file extension"),
+                       batch: int = typer.Option(1000, help="rows validated and written in one statement")):
+    """create or update devices from file, devices are matched by device_addr"""
+    from skaben.database import async_session, get_engine
+    from skaben.modules.core.provisioning import import_devices
+
+    fmt = fmt or ('csv' if path.suffix.lower() == '.csv' else 'ndjson')
+
+    async def chunks():
+        with path.open('rb') as f:
+            while chunk := f.read(65536):
+                yield chunk
+
+    async def run():
+        try:
+            async with async_session() as session:
+                return await import_devices(session, device_type, chunks(), fmt, batch)
+        finally:
+            await get_engine().dispose()
+
+    try:
+        report = asyncio.run(run())
+    except ValueError as e:
+        raise typer.BadParameter(str(e))
+    for error in report.errors:
+        typer.echo(f"line {error['line']}: {error['error']}", err=True)
+    typer.echo(f'[+] {report.imported} of {report.total} devices imported, {report.failed} failed')
+    if report.failed:
+        raise typer.Exit(1)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,7 @@
 import os
 from functools import lru_cache
 
-from pydantic import BaseSettings
+from pydantic import BaseSettings, Field, root_validator
 
 from skaben.utils import get_logger
 
@@ -12,6 +12,45 @@ class AppSettings(BaseSettings):
     """SKABEN app settings"""
 
     timeout: int = os.getenv('TIMEOUT', 5)
+    # запускать потребителя MQ в event loop приложения
+    consume: bool = os.getenv('CONSUME', False)
+    # порт метрик процессов `mq consume` и `mq workers` (обработчик N - порт + 1 + N), 0 - не слушать
+    metrics_port: int = os.getenv('METRICS_PORT', 0)
+    # разброс интервала пинга, доля от интервала
+    ping_jitter: float = os.getenv('PING_JITTER', 0.1)
+    # через сколько секунд без ответа устройство считается не в сети
+    presence_ttl: int = os.getenv('PRESENCE_TTL', 30)
+    # как часто сохранять время последнего ответа устройств в БД (сек)
+    presence_flush: int = os.getenv('PRESENCE_FLUSH', 10)
+    # через сколько секунд не в сети устройство забывается индексом присутствия, 0 - помнить всегда
+    presence_forget: int = os.getenv('PRESENCE_FORGET', 86400)
+    # окно накопления конфигураций устройств из очереди save (сек)
+    save_flush: float = os.getenv('SAVE_FLUSH', 1.0)
+    # сколько сообщений save ждут записи, прежде чем окно закроется досрочно
+    save_batch: int = os.getenv('SAVE_BATCH', 32)
+    # сколько секунд помнить сообщения умных устройств для отсева повторов, 0 - не отсеивать
+    dedup_ttl: float = os.getenv('DEDUP_TTL', 10.0)
+    # сколько последних сообщений помнить
+    dedup_size: int = os.getenv('DEDUP_SIZE', 65536)
+    # сколько сообщений в секунду принимается от одного устройства и запас на всплеск, 0 - без ограничения
+    ingress_rate: float = os.getenv('INGRESS_RATE', 20.0)
+    ingress_burst: float = os.getenv('INGRESS_BURST', 40.0)
+    # sup/info устройства пересылаются не чаще раза в окно (сек), из накопленных - последний
+    coalesce_window: float = os.getenv('COALESCE_WINDOW', 1.0)
+    # для скольких устройств хранить состояние ограничителя
+    ingress_devices: int = os.getenv('INGRESS_DEVICES', 65536)
+    # сколько событий тревоги ждут медленного подписчика, старые отбрасываются
+    events_buffer: int = os.getenv('EVENTS_BUFFER', 100)
+    # интервал пустых сообщений в потоке событий (сек), чтобы прокси не закрывали соединение
+    events_keepalive: float = os.getenv('EVENTS_KEEPALIVE', 15.0)
+    # история счетчика тревоги старше стольких часов сжимается в интервалы, 0 - хранить все
+    counter_retention: float = os.getenv('COUNTER_RETENTION', 0)
+    # длина интервала сжатой истории (сек), строк за одну транзакцию и период запуска сжатия (сек)
+    compact_interval: int = os.getenv('COMPACT_INTERVAL', 60)
+    compact_batch: int = os.getenv('COMPACT_BATCH', 5000)
+    compact_every: int = os.getenv('COMPACT_EVERY', 600)
+    # сколько секунд кэш состояния живет без сброса, на случай потерянной рассылки сброса, 0 - без срока
+    state_cache_ttl: float = os.getenv('STATE_CACHE_TTL', 5.0)
 
     class Config:
         env_prefix = "APP_"
@@ -26,11 +65,41 @@ class AMQPSettings(BaseSettings):
     port: int = os.getenv('PORT', 5672)
     timeout: int = os.getenv('TIMEOUT', 10)
     limited: bool = os.getenv('LIMITED', False)
+    # сколько неподтвержденных сообщений брокер отдает потребителю
+    prefetch: int = os.getenv('PREFETCH', 64)
+    # сколько обработчиков сообщений выполняется одновременно
+    concurrency: int = os.getenv('CONCURRENCY', 32)
+    # сколько секунд ждать завершения обработчиков при остановке
+    drain_timeout: int = os.getenv('DRAIN_TIMEOUT', 10)
+    # размер пачки исходящих сообщений и максимальное время ее накопления (сек)
+    publish_batch: int = os.getenv('PUBLISH_BATCH', 100)
+    publish_interval: float = os.getenv('PUBLISH_INTERVAL', 0.01)
+    # число процессов-обработчиков `mq workers`, 0 - по числу ядер
+    shards: int = os.getenv('SHARDS', 0)
 
     class Config:
         env_prefix = "AMQP_"
 
 
+class DBSettings(BaseSettings):
+    """DB connection pool settings"""
+
+    # постоянные соединения пула и сколько можно открыть сверх них под нагрузкой
+    pool_size: int = os.getenv('POOL_SIZE', 10)
+    max_overflow: int = os.getenv('MAX_OVERFLOW', 10)
+    # сколько секунд ждать свободного соединения из пула
+    pool_timeout: float = os.getenv('POOL_TIMEOUT', 30)
+    # через сколько секунд пересоздавать соединение, -1 - никогда
+    pool_recycle: int = os.getenv('POOL_RECYCLE', -1)
+    # кэш подготовленных выражений asyncpg на соединение, 0 - за pgbouncer в режиме transaction
+    statement_cache_size: int = os.getenv('STATEMENT_CACHE_SIZE', 100)
+    # хост реплики для read-only запросов, пусто - читать с основного
+    replica_host: str = os.getenv('REPLICA_HOST', '')
+
+    class Config:
+        env_prefix = "DB_"
+
+
 class Settings(BaseSettings):
     """
 
@@ -59,11 +128,27 @@ class Settings(BaseSettings):
     jwt_algorithm: str = os.getenv("ALGORITHM", "")
     jwt_access_toke_expire_minutes: int = os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 1)
 
-    amqp: AMQPSettings = AMQPSettings()
-    app: AppSettings = AppSettings()
-
-    amqp_uri: str = f'pyamqp://{amqp.user}:{amqp.password}@{amqp.host}:{amqp.port}'
-    asyncpg_url: str = f"postgresql+asyncpg://{pg_user}:{pg_pass}@{pg_host}:5432/{pg_database}"
+    # вложенные настройки читаются из окружения при создании Settings, а не при импорте модуля
+    amqp: AMQPSettings = Field(default_factory=AMQPSettings)
+    app: AppSettings = Field(default_factory=AppSettings)
+    db: DBSettings = Field(default_factory=DBSettings)
+
+    amqp_uri: str = ''
+    asyncpg_url: str = ''
+    asyncpg_replica_url: str = ''
+
+    @root_validator(skip_on_failure=True)
+    def build_urls(cls, values: dict) -> dict:
+        """connection urls from parts, unless set explicitly"""
+        amqp, db = values['amqp'], values['db']
+        pg = f"{values['pg_user']}:{values['pg_pass']}"
+        if not values['amqp_uri']:
+            values['amqp_uri'] = f'pyamqp://{amqp.user}:{amqp.password}@{amqp.host}:{amqp.port}'
+        if not values['asyncpg_url']:
+            values['asyncpg_url'] = f"postgresql+asyncpg://{pg}@{values['pg_host']}:5432/{values['pg_database']}"
+        if not values['asyncpg_replica_url'] and db.replica_host:
+            values['asyncpg_replica_url'] = f"postgresql+asyncpg://{pg}@{db.replica_host}:5432/{values['pg_database']}"
+        return values
 
 
 @lru_cache()
@@ -1,21 +1,115 @@
+import time
+from functools import lru_cache
 from typing import AsyncGenerator
 
 from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
-from skaben import config
+from skaben import config, metrics
 
-global_settings = config.get_settings()
-url = global_settings.asyncpg_url
 
-engine = create_async_engine(
-    url,
-    future=True,
-)
+def engine_options(db: config.DBSettings) -> dict:
+    """create_async_engine arguments from pool settings"""
+    return dict(
+        future=True,
+        pool_size=db.pool_size,
+        max_overflow=db.max_overflow,
+        pool_timeout=db.pool_timeout,
+        pool_recycle=db.pool_recycle,
+        connect_args={
+            # кэш выражений SQLAlchemy поверх asyncpg и собственный кэш asyncpg
+            'prepared_statement_cache_size': db.statement_cache_size,
+            'statement_cache_size': db.statement_cache_size,
+        },
+    )
 
-async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+QUERY_SECONDS = metrics.histogram('skaben_db_query_seconds', 'DB statement execution time', ('operation',))
+QUERY_ERRORS = metrics.counter('skaben_db_query_errors', 'failed DB statements', ('operation',))
+OPERATIONS = frozenset(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'))
+
+
+def query_operation(statement: str) -> str:
+    """first keyword of statement, anything unusual is OTHER to keep label set small"""
+    keyword = statement.lstrip()[:7].split(None, 1)[:1]
+    operation = keyword[0].upper() if keyword else ''
+    return operation if operation in OPERATIONS else 'OTHER'
+
+
+def track_queries(sync_engine: Engine):
+    """observe statement time through engine events (AsyncEngine exposes them on `sync_engine`)"""
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        QUERY_SECONDS.labels(query_operation(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def handle_error(context):
+        started = context.connection.info.get('query_started') if context.connection else None
+        if started:
+            started.pop()
+        QUERY_ERRORS.labels(query_operation(context.statement or '')).inc()
+
+
+@lru_cache()
+def get_engine() -> AsyncEngine:
+    """primary engine, created on first use so imports don't need settings or DB"""
+    settings = config.get_settings()
+    engine = create_async_engine(settings.asyncpg_url, **engine_options(settings.db))
+    track_queries(engine.sync_engine)
+    return engine
+
+
+@lru_cache()
+def get_readonly_engine() -> AsyncEngine:
+    # read-only транзакции на основной базе: данные, которые попадают в кэш состояния, не должны отставать
+    return get_engine().execution_options(postgresql_readonly=True)
+
+
+@lru_cache()
+def get_replica_engine() -> AsyncEngine:
+    settings = config.get_settings()
+    if not settings.asyncpg_replica_url:
+        return get_readonly_engine()
+    engine = create_async_engine(settings.asyncpg_replica_url, **engine_options(settings.db))
+    track_queries(engine.sync_engine)
+    return engine.execution_options(postgresql_readonly=True)
+
+
+ENGINES = {'engine': get_engine, 'readonly_engine': get_readonly_engine, 'replica_engine': get_replica_engine}
+
+
+@lru_cache()
+def get_sessionmaker(engine: str = 'engine') -> sessionmaker:
+    return sessionmaker(ENGINES[engine](), expire_on_commit=False, class_=AsyncSession)
+
+
+def async_session(**kwargs) -> AsyncSession:
+    return get_sessionmaker()(**kwargs)
+
+
+def readonly_session(**kwargs) -> AsyncSession:
+    return get_sessionmaker('readonly_engine')(**kwargs)
+
+
+def replica_session(**kwargs) -> AsyncSession:
+    return get_sessionmaker('replica_engine')(**kwargs)
+
+
+def __getattr__(name: str):
+    # `from skaben.database import engine` создает engine только там, где он действительно нужен
+    if name in ENGINES:
+        return ENGINES[name]()
+    raise AttributeError(f'module {__name__} has no attribute {name}')
 
 
 async def get_db() -> AsyncGenerator:
@@ -31,3 +125,18 @@ async def get_db() -> AsyncGenerator:
             raise http_ex
         finally:
             await session.close()
+
+
+async def get_db_readonly() -> AsyncGenerator:
+    """session for GET endpoints: read-only transaction, rolled back on close instead of commit"""
+    async with readonly_session() as session:
+        yield session
+
+
+async def get_db_replica() -> AsyncGenerator:
+    """read-only session on replica (primary if replica is not configured)
+
+       replica may lag behind, use it for history and listings, not for data cached by state cache
+    """
+    async with replica_session() as session:
+        yield session
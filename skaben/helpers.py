@@ -1,5 +1,7 @@
+import re
 from random import randint
 from datetime import datetime
+from typing import Optional
 
 
 def new_task_id(name='task'):
@@ -7,3 +9,19 @@ def new_task_id(name='task'):
     dt = datetime.now()
     num = ''.join([str(randint(0, 9)) for _ in range(10)])
     return f'{name}-{num}{dt.microsecond}'
+
+
+def convert_to_optional(schema):
+    """ annotations of pydantic schema with every field optional """
+    return {k: Optional[v] for k, v in schema.__annotations__.items()}
+
+
+MAC = re.compile(r'^[0-9a-f]{12}$')
+
+
+def normalize_mac(value) -> str:
+    """ aa:bb:cc:dd:ee:ff, aa-bb-.. и aabbccddeeff - один адрес, как uid в топиках MQ """
+    addr = re.sub(r'[:\-.]', '', str(value)).lower()
+    if not MAC.match(addr):
+        raise ValueError(f'not a MAC address: {value}')
+    return addr
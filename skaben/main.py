@@ -1,23 +1,60 @@
 import os
 import sys
-from fastapi import FastAPI
+import asyncio
+from fastapi import FastAPI, Response
 
-from skaben.database import engine
+from skaben.database import get_engine
 from skaben.models.base import Base
+from skaben import metrics
 from skaben.utils import get_logger
 from skaben.config import get_settings
+from skaben.api.alert import router as alert_router
+from skaben.api.device import router as device_router
+from skaben.modules.state.cache import get_state_cache
 
 logger = get_logger(__name__)
 app = FastAPI(title="SKABEN API", version="0.1")
 
-#app.include_router(stuff_router)
-#app.include_router(nonsense_router)
+app.add_middleware(metrics.MetricsMiddleware)
+
+app.include_router(alert_router)
+app.include_router(device_router)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """metrics in Prometheus text format"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 # async def start_db():
-#     async with engine.begin() as conn:
+#     async with get_engine().begin() as conn:
 #         await conn.run_sync(Base.metadata.create_all)
-#     await engine.dispose()
+#     await get_engine().dispose()
+
+
+async def start_consumer():
+    """run MQ consumer in the app event loop, the same stack as `mq consume`"""
+    from skaben.modules.mq.config import get_mq_config
+    from skaben.modules.mq.workers import build_server
+
+    mq_config = get_mq_config()
+    # сброс кэша от других процессов приложение уже слушает (start_cache_sync)
+    app.state.consumer, background = build_server(mq_config, mq_config.queues.values(), cache_sync=False)
+    await app.state.consumer.start()
+    app.state.background = [asyncio.create_task(job) for job in background]
+
+
+async def start_cache_sync():
+    """receive alert state cache invalidations from other workers"""
+    from skaben.modules.mq.broadcast import CacheBroadcast
+    from skaben.modules.mq.config import get_mq_config
+
+    try:
+        app.state.cache_sync = CacheBroadcast(get_mq_config(), get_state_cache())
+        await app.state.cache_sync.start()
+    except Exception as e:
+        logger.error(f"cache invalidation broadcast is disabled: {e}")
 
 
 @app.on_event("startup")
@@ -25,8 +62,21 @@ async def startup_event():
     settings = get_settings()
     logger.info("Starting up...")
     # await start_db()
+    await start_cache_sync()
+    if settings.app.consume:
+        await start_consumer()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down...")
+    consumer = getattr(app.state, 'consumer', None)
+    if consumer:
+        await consumer.stop()
+    for task in getattr(app.state, 'background', []):
+        task.cancel()
+    cache_sync = getattr(app.state, 'cache_sync', None)
+    if cache_sync:
+        await cache_sync.stop()
+    if get_engine.cache_info().currsize:
+        await get_engine().dispose()
@@ -0,0 +1,287 @@
+"""In-process metrics in Prometheus text format
+
+   counters and histograms are plain python objects updated in place, labelled
+   series are created on first use and cached, so hot path pays for one dict
+   lookup, bisect and a short lock (histograms are also observed from publisher thread).
+
+       HANDLED = metrics.histogram('skaben_mq_handle_seconds', 'message handling time', ('device_type', 'command'))
+       HANDLED.labels('lock', 'sup').observe(0.002)
+"""
+import asyncio
+import bisect
+import threading
+import time
+from typing import Iterable
+
+# кодировку добавляет starlette
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+# границы корзин по умолчанию (сек): от долей миллисекунды до таймаутов брокера
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}, got {values}')
+            with self._lock:
+                series = self._series.setdefault(values, self._new())
+        return series
+
+    def _new(self):
+        raise NotImplementedError
+
+    def _default(self):
+        if self.labelnames:
+            raise ValueError(f'{self.name} is labelled, use .labels()')
+        return self.labels()
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {_escape(self.documentation)}', f'# TYPE {self.name} {self.kind}']
+        for values, series in sorted(self._series.items()):
+            lines.extend(self._samples(values, series))
+        return lines
+
+    def _samples(self, values: tuple, series) -> list[str]:
+        raise NotImplementedError
+
+
+class _CounterValue:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Monotonic counter, rendered with `_total` suffix"""
+
+    kind = 'counter'
+
+    def _new(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    @property
+    def value(self) -> float:
+        return self._default().value
+
+    def _samples(self, values: tuple, series: _CounterValue) -> list[str]:
+        return [f'{self.name}_total{_labels(self.labelnames, values)} {_number(series.value)}']
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> '_Timer':
+        """context manager observing time spent in the block"""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ('series', 'started')
+
+    def __init__(self, series: _HistogramValue):
+        self.series = series
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.series.observe(time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+    """Histogram with fixed buckets (upper bounds, inclusive)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self) -> _Timer:
+        return self._default().time()
+
+    def _samples(self, values: tuple, series: _HistogramValue) -> list[str]:
+        with series._lock:
+            counts, total, count = list(series.counts), series.sum, series.count
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket
+            le = f'le="{_number(bound)}"'
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}')
+        lines.append(f'{self.name}_count{_labels(self.labelnames, values)} {count}')
+        return lines
+
+
+class Registry:
+    """Named metrics of the process"""
+
+    def __init__(self):
+        self.metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """returns already registered metric with the same name and type, so modules can be reloaded"""
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is None:
+                self.metrics[metric.name] = existing = metric
+            elif type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                raise ValueError(f'metric {metric.name} is already registered with other type or labels')
+        return existing
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(self.metrics[name].render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name: str,
+              documentation: str,
+              labelnames: Iterable[str] = (),
+              buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+async def start_server(port: int, host: str = '0.0.0.0') -> asyncio.AbstractServer:
+    """minimal HTTP listener answering `GET /metrics`, for MQ consumer processes running without the API"""
+    async def respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readline()
+            # заголовки запроса не нужны
+            while await reader.readline() not in (b'\r\n', b'\n', b''):
+                pass
+            if request.split(b' ')[:2] == [b'GET', b'/metrics']:
+                status, content_type, body = '200 OK', f'{CONTENT_TYPE}; charset=utf-8', render().encode()
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain; charset=utf-8', b'not found\n'
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(respond, host, port)
+
+
+async def serve(port: int):
+    """metrics listener as a background job, until cancelled"""
+    server = await start_server(port)
+    async with server:
+        await server.serve_forever()
+
+
+HTTP_SECONDS = histogram('skaben_http_request_seconds', 'HTTP request handling time',
+                         ('method', 'route', 'status'))
+
+
+class MetricsMiddleware:
+    """ASGI middleware observing request time per route template (`/alert/state/{state_id}`)
+
+       unmatched paths are collapsed into one series, so scanners can't blow up label cardinality
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: dict | None = None
+
+    def route_path(self, scope: dict) -> str:
+        if self._routes is None:
+            routes = getattr(scope.get('app'), 'routes', [])
+            self._routes = {route.endpoint: route.path for route in routes if hasattr(route, 'endpoint')}
+        return self._routes.get(scope.get('endpoint'), '<unmatched>')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_SECONDS.labels(scope['method'], self.route_path(scope), status).observe(time.perf_counter() - started)
@@ -1,6 +1,9 @@
-from sqlalchemy import Column, Integer, Boolean
+from sqlalchemy import Column, ForeignKey, Integer, Boolean, String, UniqueConstraint
+from sqlalchemy.dialects import postgresql
 from skaben.models import Base
 from skaben.models.mixins import DeviceMixin
+from skaben.models.state import State
+from skaben.modules.core.devices import SmartDeviceEnum
 
 
 class Lock(DeviceMixin, Base):
@@ -10,3 +13,21 @@ class Lock(DeviceMixin, Base):
     blocked = Column(Boolean, default=False)
     sound = Column(Boolean, default=True)
     timer = Column(Integer, default=10)
+
+
+class SimpleConfig(Base):
+    """Конфигурация простых устройств (pwr, rgb) для уровня тревоги"""
+
+    device_type = Column(String(128), nullable=False)
+    state_id = Column(postgresql.UUID(as_uuid=True), ForeignKey(State.uuid, ondelete='CASCADE'), nullable=False)
+    config = Column(postgresql.JSONB, nullable=False, default=dict)
+
+    __table_args__ = (
+        UniqueConstraint('device_type', 'state_id'),
+    )
+
+
+# модели устройств по типу из топика MQ
+DEVICE_MODELS = {
+    SmartDeviceEnum.LOCK.value: Lock,
+}
@@ -11,7 +11,7 @@ class DeviceMixin(object):
     # тип устройства
     device_type = Column(String(128), nullable=False)
     # MAC-адрес устройства в сети
-    device_addr = Column(postgresql.MACADDR, nullable=True)
+    device_addr = Column(postgresql.MACADDR, nullable=True, unique=True)
     # время последней регистрации
     timestamp = Column(DateTime(), server_default=func.now())
     # исключение из общей рассылки управляющих сообщений
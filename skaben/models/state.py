@@ -1,6 +1,6 @@
 from skaben.models.base import Base
 from sqlalchemy import func
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Index, Integer, String, DateTime, Boolean
 
 
 class AlertCounter(Base):
@@ -14,6 +14,24 @@ class AlertCounter(Base):
         return f'{self.value} {self.comment} at {self.timestamp}'
 
 
+# keyset-пагинация истории и поиск последнего значения
+Index('ix_alertcounter_timestamp_uuid', AlertCounter.timestamp.desc(), AlertCounter.uuid.desc())
+
+
+class AlertCounterRollup(Base):
+    """Сжатая история счетчика тревоги старше горизонта хранения, запись на интервал"""
+
+    start = Column(DateTime(timezone=False), nullable=False, unique=True)
+    min = Column(Integer, nullable=False)
+    max = Column(Integer, nullable=False)
+    last = Column(Integer, nullable=False)
+    last_timestamp = Column(DateTime(timezone=False), nullable=False)
+    count = Column(Integer, nullable=False)
+
+    def __str__(self):
+        return f'{self.start}: {self.min}..{self.max} last {self.last} of {self.count}'
+
+
 class State(Base):
     """Глобальный уровень состояния системы"""
 
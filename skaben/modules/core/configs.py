@@ -0,0 +1,101 @@
+import hashlib
+import json
+import logging
+from functools import lru_cache
+
+from sqlalchemy import select
+
+from skaben.database import async_session
+from skaben.models.device import DEVICE_MODELS
+from skaben.modules.state.cache import DEVICES, STATE, StateCache
+from skaben.schemas.device import DEVICE_SCHEMAS
+
+
+def config_hash(datahold: dict) -> str:
+    """md5 of datahold serialized with sorted keys, stable between processes"""
+    dumped = json.dumps(datahold, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.md5(dumped.encode()).hexdigest()
+
+
+class ConfigEntry:
+    """Serialized device config with precomputed hash
+
+       hash is sent inside datahold, device returns it with next CUP/SUP
+    """
+
+    __slots__ = ('datahold', 'hash')
+
+    def __init__(self, config: dict):
+        self.hash = config_hash(config)
+        self.datahold = {**config, 'hash': self.hash}
+
+    def __repr__(self):
+        return f'<ConfigEntry {self.hash}>'
+
+
+class DeviceConfigCache:
+    """Configs of smart devices by (device_type, device_uid)
+
+       CUP from device with matching hash is answered without DB query or serialization.
+       Missing devices are cached too, so unknown device asking for config
+       does not hit the DB on every reconnect. Entry is dropped when device is saved
+       (`invalidate`), whole cache - when alert state or devices are changed elsewhere
+    """
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.entries: dict[tuple, ConfigEntry | None] = {}
+        self.hits = 0
+        self.misses = 0
+        self._generation = 0
+
+    def attach(self, state_cache: StateCache):
+        """clear cache on alert state and device changes, including ones from other workers"""
+        state_cache.listeners.append(self.on_state_invalidated)
+
+    def on_state_invalidated(self, scopes: tuple):
+        if STATE in scopes or DEVICES in scopes:
+            self.clear()
+
+    async def get(self, device_type: str, device_uid: str) -> ConfigEntry | None:
+        key = (device_type, device_uid)
+        if key in self.entries:
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        generation = self._generation
+        entry = await self.load(device_type, device_uid)
+        # конфигурацию могли изменить, пока шел запрос - такой результат не кэшируем
+        if generation == self._generation:
+            self.entries[key] = entry
+        return entry
+
+    async def load(self, device_type: str, device_uid: str) -> ConfigEntry | None:
+        model = DEVICE_MODELS.get(device_type)
+        schema = DEVICE_SCHEMAS.get(device_type)
+        if not model or not schema:
+            return
+        async with self.session_factory() as session:
+            result = await session.execute(select(model).where(model.device_addr == device_uid))
+            instance = result.scalars().first()
+        if not instance:
+            logging.debug(f'config requested by unknown device {device_type} {device_uid}')
+            return
+        return ConfigEntry(schema.from_orm(instance).dict())
+
+    def invalidate(self, *keys: tuple):
+        for key in keys:
+            self.entries.pop(key, None)
+        self._generation += 1
+
+    def clear(self):
+        self.entries.clear()
+        self._generation += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+
+@lru_cache()
+def get_config_cache() -> DeviceConfigCache:
+    return DeviceConfigCache(async_session)
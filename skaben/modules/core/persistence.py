@@ -0,0 +1,236 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+from pydantic import ValidationError
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+from skaben.config import get_settings
+from skaben.helpers import normalize_mac
+from skaben.models.device import DEVICE_MODELS
+from skaben.modules.core.configs import DeviceConfigCache
+from skaben.modules.mq.broker import Delivery
+from skaben.schemas.device import DEVICE_SCHEMAS
+
+# колонки, которые не берутся из конфигурации устройства
+KEY_COLUMNS = frozenset(('uuid', 'device_addr', 'device_type'))
+
+
+def device_row(model, payload: dict) -> dict:
+    """columns of device model from `save` message payload"""
+    datahold = payload.get('datahold') or {}
+    row = {key: value for key, value in datahold.items()
+           if key in model.__table__.columns and key not in KEY_COLUMNS}
+    timestamp = payload.get('timestamp') or datahold.get('timestamp')
+    if timestamp:
+        row['timestamp'] = datetime.utcfromtimestamp(int(timestamp))
+    row.update(device_type=payload['device_type'], device_addr=payload['device_uid'])
+    return row
+
+
+def validate_payload(payload: dict) -> dict:
+    """`save` payload with MAC uid and datahold checked by the device schema, ValueError if it is broken
+
+       only fields that came in the message are kept, so partial report does not reset the rest
+    """
+    datahold = payload.get('datahold') or {}
+    if not isinstance(datahold, dict):
+        raise ValueError(f'datahold is not an object: {datahold!r}')
+    schema = DEVICE_SCHEMAS.get(payload['device_type'])
+    validated = schema(**datahold).dict(exclude_unset=True) if schema else {}
+    timestamp = payload.get('timestamp') or datahold.get('timestamp')
+    if timestamp:
+        try:
+            datetime.utcfromtimestamp(int(timestamp))
+        except (TypeError, ValueError, OverflowError, OSError):
+            raise ValueError(f'invalid timestamp {timestamp!r}')
+    return {'device_type': payload['device_type'],
+            'device_uid': normalize_mac(payload.get('device_uid')),
+            'timestamp': int(timestamp) if timestamp else None,
+            'datahold': validated}
+
+
+async def upsert_devices(session, model, rows: list[dict]) -> int:
+    """bulk INSERT .. ON CONFLICT (device_addr) DO UPDATE, one statement per set of columns
+
+       partial updates (e.g. timestamp only) must not reset other columns to defaults,
+       so rows are grouped by the columns they actually carry
+    """
+    groups = defaultdict(list)
+    for row in rows:
+        groups[frozenset(row)].append(row)
+    table = model.__table__
+    for columns, group in groups.items():
+        stmt = insert(table).values(group)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.device_addr],
+            set_={name: stmt.excluded[name] for name in columns if name != 'device_addr'},
+        )
+        await session.execute(stmt)
+    await session.commit()
+    return len(rows)
+
+
+class SaveBuffer:
+    """Latest configuration of every device received within the flush window
+
+       payloads of the same device are merged, so later values win and
+       a timestamp-only update does not drop config received before it.
+       deliveries are kept to be acked after the batch is committed
+    """
+
+    def __init__(self):
+        self.latest: dict[tuple, dict] = {}
+        self.deliveries: dict[tuple, list[Delivery]] = defaultdict(list)
+        self.pending = 0
+
+    def add(self, payload: dict, delivery: Delivery | None = None):
+        key = (payload['device_type'], payload['device_uid'])
+        merged = self.latest.setdefault(key, {'device_type': key[0], 'device_uid': key[1], 'datahold': {}})
+        merged['datahold'].update(payload.get('datahold') or {})
+        if payload.get('timestamp'):
+            merged['timestamp'] = payload['timestamp']
+        if delivery:
+            self.deliveries[key].append(delivery)
+            self.pending += 1
+
+    def restore(self, key: tuple, payload: dict, deliveries: list[Delivery]):
+        """return not saved config back, keeping values received after it"""
+        newer = self.latest.pop(key, None)
+        self.latest[key] = payload
+        if newer:
+            payload['datahold'].update(newer['datahold'])
+            payload['timestamp'] = newer.get('timestamp', payload.get('timestamp'))
+        self.deliveries[key][:0] = deliveries
+        self.pending += len(deliveries)
+
+    def drain(self) -> tuple[dict, dict]:
+        latest, deliveries = self.latest, self.deliveries
+        self.latest, self.deliveries, self.pending = {}, defaultdict(list), 0
+        return latest, deliveries
+
+    def __len__(self):
+        return len(self.latest)
+
+
+class WriteBehindSaver:
+    """Persists device configs from `save` queue in batches
+
+       messages are deferred by handler and settled only after their batch is
+       committed: acked on success, kept for the next window on connection errors.
+       Malformed messages are rejected before buffering; if DB refuses a batch, its rows
+       are written one by one and only refused ones are rejected. Every deferred message holds AMQP prefetch slot,
+       so batch is flushed early when `max_pending` messages are waiting.
+       Cached configs of saved devices are dropped from `configs`
+    """
+
+    def __init__(self,
+                 session_factory,
+                 flush_interval: float | None = None,
+                 max_pending: int | None = None,
+                 configs: DeviceConfigCache | None = None):
+        self.session_factory = session_factory
+        self.configs = configs
+        settings = get_settings()
+        self.flush_interval = flush_interval or settings.app.save_flush
+        self.max_pending = max_pending or min(settings.app.save_batch, settings.amqp.prefetch // 2 or 1)
+        self.buffer = SaveBuffer()
+        self.received = 0
+        self.written = 0
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    async def handle(self, payload: dict, delivery: Delivery | None = None):
+        """buffer `save` message, delivery is settled after flush"""
+        if payload.get('device_type') not in DEVICE_MODELS:
+            logging.debug(f'no model for device type {payload.get("device_type")}, skip saving')
+            return
+        try:
+            payload = validate_payload(payload)
+        except (ValueError, ValidationError) as e:
+            logging.error(f'invalid {payload.get("device_type")} config of {payload.get("device_uid")}, dropped: {e}')
+            if delivery:
+                delivery.reject()
+            return
+        if delivery:
+            delivery.defer()
+        self.received += 1
+        self.buffer.add(payload, delivery)
+        if self.buffer.pending >= self.max_pending:
+            self._full.set()
+
+    async def write(self, model, keys: list[tuple], latest: dict) -> tuple[list, list, list]:
+        """upsert configs of one model: (saved, refused, to retry) keys
+
+           as in DeviceImporter.write, batch refused by DB is written row by row,
+           so one broken device does not drop configs of the others
+        """
+        async with self.session_factory() as session:
+            try:
+                await upsert_devices(session, model, [device_row(model, latest[key]) for key in keys])
+                return keys, [], []
+            except (OperationalError, OSError) as e:
+                logging.error(f'cannot save {len(keys)} {model.__name__} configs, will retry: {e}')
+                return [], [], keys
+            except SQLAlchemyError as e:
+                await session.rollback()
+                logging.warning(f'{model.__name__} batch of {len(keys)} refused, saving one by one: {e}')
+            saved, refused = [], []
+            for i, key in enumerate(keys):
+                try:
+                    await upsert_devices(session, model, [device_row(model, latest[key])])
+                    saved.append(key)
+                except (OperationalError, OSError) as e:
+                    logging.error(f'cannot save {len(keys) - i} {model.__name__} configs, will retry: {e}')
+                    return saved, refused, keys[i:]
+                except SQLAlchemyError as e:
+                    await session.rollback()
+                    logging.error(f'cannot save {model.__name__} config of {key[1]}, dropped: {e}')
+                    refused.append(key)
+            return saved, refused, []
+
+    async def flush(self) -> int:
+        """write buffered configs, one transaction per device model"""
+        async with self._lock:
+            latest, deliveries = self.buffer.drain()
+            by_model = defaultdict(list)
+            for key, payload in latest.items():
+                by_model[DEVICE_MODELS[key[0]]].append(key)
+            written = 0
+            for model, keys in by_model.items():
+                try:
+                    saved, refused, retry = await self.write(model, keys, latest)
+                except Exception as e:
+                    logging.error(f'cannot save {len(keys)} {model.__name__} configs, dropped: {e}')
+                    saved, refused, retry = [], keys, []
+                for key in retry:
+                    self.buffer.restore(key, latest[key], deliveries[key])
+                for key in refused:
+                    for delivery in deliveries[key]:
+                        delivery.reject()
+                for key in saved:
+                    for delivery in deliveries[key]:
+                        delivery.ack()
+                if saved and self.configs is not None:
+                    # обновление только времени конфигурацию не меняет
+                    self.configs.invalidate(*(key for key in saved if set(latest[key]['datahold']) - {'timestamp'}))
+                written += len(saved)
+            self.written += written
+            return written
+
+    async def run(self):
+        """flush every `flush_interval` or when too many messages are waiting, until cancelled"""
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._full.clear()
+                if self.buffer:
+                    await self.flush()
+        finally:
+            if self.buffer:
+                await self.flush()
@@ -0,0 +1,185 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+from skaben.config import get_settings
+from skaben.helpers import normalize_mac
+from skaben.models.device import DEVICE_MODELS
+
+# команды, которыми устройство подтверждает, что оно в сети
+PRESENCE_COMMANDS = frozenset(('pong', 'sup', 'cup'))
+
+
+@lru_cache(maxsize=65536)
+def presence_uid(device_uid: str) -> str:
+    """uid в форме MAC, как device_addr в БД (см. normalize_mac), ValueError если это не MAC"""
+    return normalize_mac(device_uid)
+
+
+class PresenceIndex:
+    """In-process index of devices seen by consumer
+
+       every online device has exactly one entry in the expiry heap, so expiring
+       stale devices costs O(log n) per expired device instead of a full scan.
+       last seen timestamps are collected for periodic bulk DB update.
+       devices offline for more than `forget` seconds are dropped from the index
+    """
+
+    def __init__(self, ttl: float, forget: float = 0):
+        self.ttl = ttl
+        self.forget = forget
+        self.last_seen: dict[tuple, float] = {}
+        self.online: set = set()
+        self._heap: list[tuple[float, tuple]] = []
+        self._offline: list[tuple[float, tuple]] = []
+        self._dirty: dict[tuple, float] = {}
+
+    def touch(self, device_type: str, device_uid: str, seen_at: float | None = None):
+        key = (device_type, device_uid)
+        seen_at = seen_at or time.time()
+        self.last_seen[key] = seen_at
+        self._dirty[key] = seen_at
+        if key not in self.online:
+            self.online.add(key)
+            heapq.heappush(self._heap, (seen_at + self.ttl, key))
+
+    def expire(self, now: float | None = None) -> list[tuple]:
+        """mark devices not seen for `ttl` seconds as offline, returns their keys"""
+        now = now or time.time()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, key = heapq.heappop(self._heap)
+            deadline = self.last_seen[key] + self.ttl
+            if deadline > now:
+                # устройство отвечало после постановки в очередь - переносим срок
+                heapq.heappush(self._heap, (deadline, key))
+                continue
+            self.online.discard(key)
+            expired.append(key)
+            if self.forget > 0:
+                heapq.heappush(self._offline, (deadline + self.forget, key))
+        self._prune(now)
+        return expired
+
+    def _prune(self, now: float):
+        while self._offline and self._offline[0][0] <= now:
+            _, key = heapq.heappop(self._offline)
+            # вернувшееся в сеть устройство снова попадет в очередь, когда пропадет
+            if key in self.online or self.last_seen[key] + self.ttl + self.forget > now:
+                continue
+            del self.last_seen[key]
+
+    def snapshot(self, device_type: str | None = None) -> dict:
+        """online/offline device uids grouped by device type"""
+        result = defaultdict(lambda: {'online': [], 'offline': []})
+        for key in self.last_seen:
+            if device_type and key[0] != device_type:
+                continue
+            result[key[0]]['online' if key in self.online else 'offline'].append(key[1])
+        return dict(result)
+
+    def drain_dirty(self) -> dict[tuple, float]:
+        dirty, self._dirty = self._dirty, {}
+        return dirty
+
+    def restore_dirty(self, dirty: dict[tuple, float]):
+        """return not flushed timestamps back, keeping the newest ones"""
+        for key, seen_at in dirty.items():
+            if self._dirty.get(key, 0) < seen_at:
+                self._dirty[key] = seen_at
+
+
+async def flush_timestamps(session, seen: dict[tuple, float]) -> int:
+    """bulk update of device timestamps, one executemany per device model"""
+    params = defaultdict(list)
+    for (device_type, device_uid), seen_at in seen.items():
+        model = DEVICE_MODELS.get(device_type)
+        if model:
+            params[model].append({'b_addr': device_uid, 'b_ts': datetime.utcfromtimestamp(seen_at)})
+    for model, rows in params.items():
+        table = model.__table__
+        stmt = update(table).where(table.c.device_addr == bindparam('b_addr')).values(timestamp=bindparam('b_ts'))
+        await session.execute(stmt, rows)
+    await session.commit()
+    return sum(len(rows) for rows in params.values())
+
+
+async def load_presence(session, ttl: float, device_type: str | None = None) -> dict:
+    """online/offline devices by timestamps flushed to DB, shaped as `PresenceIndex.snapshot`
+
+       for processes without consumer: only device types with a model are known,
+       device is online if it was seen within `ttl` seconds
+    """
+    since = datetime.utcnow() - timedelta(seconds=ttl)
+    result = {}
+    for name, model in DEVICE_MODELS.items():
+        if device_type and name != device_type:
+            continue
+        group = result.setdefault(name, {'online': [], 'offline': []})
+        rows = await session.execute(select(model.device_addr, model.timestamp).where(model.device_addr.isnot(None)))
+        for addr, timestamp in rows:
+            # uid в топиках MQ - MAC без разделителей
+            group['online' if timestamp and timestamp >= since else 'offline'].append(str(addr).replace(':', ''))
+    return result
+
+
+async def save_presence(index: PresenceIndex, session_factory):
+    """flush last seen timestamps of the index
+
+       on connection errors timestamps are kept for the next flush, if DB refused
+       the batch, it is written row by row and refused devices are dropped
+    """
+    dirty = index.drain_dirty()
+    if not dirty:
+        return
+    try:
+        async with session_factory() as session:
+            await flush_timestamps(session, dirty)
+        return
+    except (OperationalError, OSError) as e:
+        logging.error(f'cannot flush device timestamps, will retry: {e}')
+        index.restore_dirty(dirty)
+        return
+    except SQLAlchemyError as e:
+        logging.warning(f'device timestamps refused, flushing one by one: {e}')
+    items = list(dirty.items())
+    async with session_factory() as session:
+        for i, (key, seen_at) in enumerate(items):
+            try:
+                await flush_timestamps(session, {key: seen_at})
+            except (OperationalError, OSError) as e:
+                logging.error(f'cannot flush device timestamps, will retry: {e}')
+                index.restore_dirty(dict(items[i:]))
+                return
+            except SQLAlchemyError as e:
+                await session.rollback()
+                logging.error(f'cannot save last seen of {key[0]} {key[1]}, dropped: {e}')
+
+
+async def run_presence(index: PresenceIndex, session_factory, flush_interval: float, expire_interval: float = 1.0):
+    """expire stale devices and periodically flush last seen timestamps to DB"""
+    next_flush = time.monotonic() + flush_interval
+    while True:
+        await asyncio.sleep(expire_interval)
+        for device_type, device_uid in index.expire():
+            logging.info(f'device {device_type} {device_uid} went offline')
+        if time.monotonic() < next_flush:
+            continue
+        next_flush = time.monotonic() + flush_interval
+        try:
+            await save_presence(index, session_factory)
+        except Exception as e:
+            logging.error(f'cannot flush device timestamps: {e}')
+
+
+@lru_cache()
+def get_presence_index() -> PresenceIndex:
+    settings = get_settings().app
+    return PresenceIndex(ttl=settings.presence_ttl, forget=settings.presence_forget)
@@ -0,0 +1,193 @@
+import csv
+import json
+from functools import lru_cache
+from typing import AsyncIterable, AsyncIterator
+
+from pydantic import BaseModel, ValidationError, validator
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+from skaben.helpers import normalize_mac
+from skaben.models.device import DEVICE_MODELS
+from skaben.modules.core.persistence import upsert_devices
+from skaben.schemas.device import DEVICE_SCHEMAS
+
+FORMATS = ('csv', 'ndjson')
+# сколько строк проверяется и записывается одним запросом
+IMPORT_BATCH = 1000
+# сколько ошибок попадает в отчет, остальные только считаются
+MAX_ERRORS = 1000
+
+
+class DeviceImportSchema(BaseModel):
+    """Строка импорта устройства: общие поля DeviceMixin"""
+
+    device_addr: str
+    name: str = ''
+    ignored: bool = False
+
+    @validator('device_addr', pre=True)
+    def normalize_addr(cls, value):
+        """адрес в форме uid топиков MQ"""
+        return normalize_mac(value)
+
+
+@lru_cache()
+def import_schema(device_type: str) -> type[BaseModel]:
+    """schema of import row: common device fields and config of the device type"""
+    config = DEVICE_SCHEMAS[device_type]
+    return type(f'{config.__name__[:-len("Schema")]}ImportSchema', (DeviceImportSchema, config), {})
+
+
+async def read_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[tuple[int, str]]:
+    """(line number, line) of a byte stream, lines split between chunks are joined"""
+    tail = b''
+    number = 0
+    async for chunk in chunks:
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        for line in lines:
+            number += 1
+            yield number, line.decode('utf-8-sig' if number == 1 else 'utf-8').rstrip('\r')
+    if tail:
+        yield number + 1, tail.decode('utf-8-sig' if not number else 'utf-8').rstrip('\r')
+
+
+async def read_rows(chunks: AsyncIterable[bytes], fmt: str) -> AsyncIterator[tuple[int, dict | str]]:
+    """(line number, row) of CSV with header or NDJSON, unparsable line is returned as error message"""
+    header = None
+    async for number, line in read_lines(chunks):
+        if not line.strip():
+            continue
+        if fmt == 'ndjson':
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, f'invalid JSON: {e}'
+                continue
+            yield number, row if isinstance(row, dict) else 'JSON object expected'
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield number, f'expected {len(header)} columns, got {len(values)}'
+            continue
+        # пустая ячейка - значение по умолчанию
+        yield number, {name: value for name, value in zip(header, values) if value != ''}
+
+
+def format_errors(error: ValidationError) -> str:
+    return '; '.join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+
+
+class ImportReport:
+    """Result of bulk import: counters and errors by line number"""
+
+    def __init__(self):
+        self.total = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+
+    def error(self, line: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def dict(self) -> dict:
+        return {'total': self.total, 'imported': self.imported, 'failed': self.failed, 'errors': self.errors}
+
+
+class DeviceImporter:
+    """Validates device rows in batches and upserts them by device_addr
+
+       a batch is one multi-row INSERT .. ON CONFLICT statement (see persistence.upsert_devices).
+       if DB refuses the batch, its rows are written one by one, so a bad row
+       is reported with its line number and does not fail the others
+    """
+
+    def __init__(self, session, device_type: str, batch: int = IMPORT_BATCH, upsert=upsert_devices):
+        if device_type not in DEVICE_MODELS or device_type not in DEVICE_SCHEMAS:
+            raise ValueError(f'device type `{device_type}` can not be imported, '
+                             f'supported: {", ".join(sorted(DEVICE_MODELS))}')
+        self.session = session
+        self.device_type = device_type
+        self.model = DEVICE_MODELS[device_type]
+        self.schema = import_schema(device_type)
+        self.batch = batch
+        self.upsert = upsert
+        self.report = ImportReport()
+
+    def validate(self, line: int, row: dict) -> dict | None:
+        row = dict(row)
+        if 'device_addr' not in row and 'device_uid' in row:
+            row['device_addr'] = row.pop('device_uid')
+        device_type = row.pop('device_type', self.device_type)
+        if device_type != self.device_type:
+            self.report.error(line, f'device_type `{device_type}` in `{self.device_type}` import')
+            return None
+        try:
+            # только заданные колонки: неуказанные не затирают значения существующего устройства
+            validated = self.schema(**row).dict(exclude_unset=True)
+        except ValidationError as e:
+            self.report.error(line, format_errors(e))
+            return None
+        validated['device_type'] = self.device_type
+        return validated
+
+    async def write(self, batch: dict[str, tuple[int, dict]]):
+        """upsert batch of rows keyed by device_addr"""
+        if not batch:
+            return
+        try:
+            await self.upsert(self.session, self.model, [row for _, row in batch.values()])
+            self.report.imported += len(batch)
+            return
+        except OperationalError:
+            raise
+        except SQLAlchemyError:
+            await self.session.rollback()
+        for line, row in batch.values():
+            try:
+                await self.upsert(self.session, self.model, [row])
+                self.report.imported += 1
+            except SQLAlchemyError as e:
+                await self.session.rollback()
+                self.report.error(line, str(getattr(e, 'orig', e)).strip())
+
+    async def run(self, rows: AsyncIterable[tuple[int, dict | str]]) -> ImportReport:
+        """import rows of `read_rows`"""
+        batch: dict[str, tuple[int, dict]] = {}
+        async for line, row in rows:
+            self.report.total += 1
+            if isinstance(row, str):
+                self.report.error(line, row)
+                continue
+            validated = self.validate(line, row)
+            if validated is None:
+                continue
+            addr = validated['device_addr']
+            if addr in batch:
+                # одно устройство дважды в пачке - ON CONFLICT не может изменить строку дважды
+                self.report.error(batch[addr][0], f'device {addr} is redefined on line {line}')
+            batch[addr] = (line, validated)
+            if len(batch) >= self.batch:
+                await self.write(batch)
+                batch = {}
+        await self.write(batch)
+        return self.report
+
+
+async def import_devices(session, device_type: str, chunks: AsyncIterable[bytes], fmt: str,
+                         batch: int = IMPORT_BATCH) -> ImportReport:
+    """Импорт устройств из потока CSV или NDJSON, сбрасывает кэш конфигураций во всех процессах"""
+    from skaben.modules.state.cache import DEVICES, get_state_cache
+
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown format `{fmt}`, supported: {", ".join(FORMATS)}')
+    importer = DeviceImporter(session, device_type, batch)
+    report = await importer.run(read_rows(chunks, fmt))
+    if report.imported:
+        get_state_cache().invalidate(DEVICES)
+    return report
@@ -0,0 +1,69 @@
+import asyncio
+import uuid
+
+from kombu import Queue
+
+from skaben.modules.mq.broker import Delivery, KombuBroker
+from skaben.modules.mq.config import MQConfig
+from skaben.modules.mq.consumer import AsyncConsumer
+from skaben.modules.mq.interface import MQInterface
+from skaben.modules.state.cache import SCOPES, StateCache
+
+CACHE_ROUTING_KEY = 'cache'
+
+
+class CacheBroadcast(MQInterface):
+    """Cross-process invalidation of StateCache
+
+       every process (uvicorn worker, consumer) binds its own exclusive queue
+       to `internal` exchange, so invalidation sent by one process reaches all of them.
+       Invalidations sent while the queue was disconnected are lost, so the whole cache is dropped on (re)connect
+    """
+
+    def __init__(self, config: MQConfig, cache: StateCache):
+        super().__init__(config)
+        self.cache = cache
+        self.origin = uuid.uuid4().hex
+        if not config.exchanges.get('internal'):
+            config.init_internal_exchange()
+        self.exchange = config.exchanges['internal']
+        self.consumer: AsyncConsumer | None = None
+
+    def send(self, scopes: tuple):
+        self._publish({'origin': self.origin, 'scopes': list(scopes)},
+                      exchange=self.exchange,
+                      routing_key=CACHE_ROUTING_KEY)
+
+    async def handle(self, delivery: Delivery):
+        body = delivery.body
+        if body.get('origin') == self.origin:
+            return
+        self.cache.invalidate(*body.get('scopes', ()), broadcast=False)
+
+    def connected(self):
+        self.cache.invalidate(*SCOPES, broadcast=False)
+
+    async def start(self):
+        queue = Queue(f'{CACHE_ROUTING_KEY}.{self.origin}',
+                      exchange=self.exchange,
+                      routing_key=CACHE_ROUTING_KEY,
+                      durable=False,
+                      exclusive=True,
+                      auto_delete=True)
+        broker = KombuBroker(self.config.conn.clone(), on_connect=self.connected)
+        self.consumer = AsyncConsumer(broker, self.handle, [queue], prefetch=100, concurrency=1)
+        await self.consumer.start()
+        self.cache.broadcast = self.send
+
+    async def stop(self):
+        self.cache.broadcast = None
+        if self.consumer:
+            await self.consumer.stop()
+
+    async def run(self):
+        """listen for invalidations until cancelled"""
+        await self.start()
+        try:
+            await asyncio.Future()
+        finally:
+            await self.stop()
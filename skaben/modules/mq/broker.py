@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import queue
+import re
+import socket
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Iterable
+
+from kombu import Connection, Consumer, Queue
+from kombu.transport.virtual.exchange import TopicExchange
+
+
+class Delivery:
+    """Incoming message envelope, independent of broker implementation
+
+       exposes `delivery_info` the same way kombu Message does,
+       so MessageHandler.handle_message works with both
+    """
+
+    __slots__ = ('body', 'delivery_info', 'settled', 'deferred', '_settle')
+
+    def __init__(self, body: Any, routing_key: str, settle: Callable[[bool, bool], None], exchange: str = ''):
+        self.body = body
+        self.delivery_info = {'routing_key': routing_key, 'exchange': exchange}
+        self.settled = False
+        self.deferred = False
+        self._settle = settle
+
+    @property
+    def routing_key(self) -> str:
+        return self.delivery_info['routing_key']
+
+    def ack(self):
+        """confirm message processing"""
+        self._finish(True, False)
+
+    def reject(self, requeue: bool = False):
+        """reject message, optionally returning it to the queue"""
+        self._finish(False, requeue)
+
+    def defer(self):
+        """tell consumer that handler will settle the message by itself later"""
+        self.deferred = True
+
+    def _finish(self, ok: bool, requeue: bool):
+        if self.settled:
+            return
+        self.settled = True
+        self._settle(ok, requeue)
+
+    def __repr__(self):
+        return f'<Delivery {self.routing_key}>'
+
+
+class AsyncBroker:
+    """Broker interface for AsyncConsumer"""
+
+    async def start(self, queues: Iterable[Queue], prefetch: int):
+        raise NotImplementedError
+
+    async def get(self) -> Delivery:
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+
+@lru_cache(maxsize=1024)
+def _topic_pattern(binding_key: str):
+    return re.compile(TopicExchange(None).key_to_pattern(binding_key))
+
+
+class MemoryBroker(AsyncBroker):
+    """In-memory broker stand-in
+
+       routes messages with the same topic/direct rules RabbitMQ applies to queues
+       declared by MQConfig, used to measure consumer throughput without RabbitMQ
+    """
+
+    def __init__(self):
+        self.bindings = []
+        self.published = 0
+        self.acked = 0
+        self.rejected = 0
+        self._inbox: asyncio.Queue | None = None
+        self._slots: asyncio.Semaphore | None = None
+
+    async def start(self, queues: Iterable[Queue], prefetch: int):
+        self._inbox = asyncio.Queue()
+        self._slots = asyncio.Semaphore(prefetch)
+        for q in queues:
+            exchange = q.exchange.name if q.exchange else ''
+            self.bindings.append((exchange, q.exchange.type if q.exchange else 'direct', q.routing_key))
+
+    def publish(self, body: Any, exchange: str, routing_key: str) -> int:
+        """put message to every matching queue, returns number of queues matched"""
+        matched = 0
+        for bound_exchange, exchange_type, binding_key in self.bindings:
+            if bound_exchange != exchange:
+                continue
+            if exchange_type == 'topic':
+                if not _topic_pattern(binding_key).match(routing_key):
+                    continue
+            elif binding_key != routing_key:
+                continue
+            delivery = Delivery(body, routing_key, self._make_settle(body, exchange, routing_key), exchange)
+            self._inbox.put_nowait(delivery)
+            matched += 1
+        self.published += matched
+        return matched
+
+    def _make_settle(self, body: Any, exchange: str, routing_key: str):
+        def settle(ok: bool, requeue: bool):
+            self._slots.release()
+            if ok:
+                self.acked += 1
+                return
+            self.rejected += 1
+            if requeue:
+                self._inbox.put_nowait(Delivery(body, routing_key, self._make_settle(body, exchange, routing_key),
+                                                exchange))
+        return settle
+
+    async def get(self) -> Delivery:
+        await self._slots.acquire()
+        try:
+            return await self._inbox.get()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def pending(self) -> int:
+        return self._inbox.qsize() if self._inbox else 0
+
+    async def close(self):
+        self.bindings = []
+
+
+class KombuBroker(AsyncBroker):
+    """AMQP broker bridge
+
+       kombu is blocking, so the socket is drained in a dedicated thread,
+       while deliveries are handed to the event loop and handlers never leave it.
+       acks are sent back to the drain thread, since kombu channels are not thread safe
+    """
+
+    def __init__(self,
+                 connection: Connection,
+                 poll_interval: float = 0.05,
+                 on_connect: Callable[[], None] | None = None):
+        self.connection = connection
+        self.poll_interval = poll_interval
+        # вызывается в event loop каждый раз, когда потребитель (пере)подключился к очередям
+        self.on_connect = on_connect
+        self._inbox: asyncio.Queue | None = None
+        self._outbox: queue.SimpleQueue = queue.SimpleQueue()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def start(self, queues: Iterable[Queue], prefetch: int):
+        self._loop = asyncio.get_running_loop()
+        self._inbox = asyncio.Queue()
+        queues = list(queues)
+        self._thread = threading.Thread(target=self._drain, args=(queues, prefetch), name='mq-drain', daemon=True)
+        self._thread.start()
+
+    async def get(self) -> Delivery:
+        return await self._inbox.get()
+
+    def pending(self) -> int:
+        """messages received from broker and not taken by consumer yet"""
+        return self._inbox.qsize() if self._inbox else 0
+
+    async def close(self):
+        self._stopping.set()
+        if self._thread:
+            await self._loop.run_in_executor(None, self._thread.join)
+        self.connection.release()
+
+    def _on_message(self, body: Any, message):
+        info = message.delivery_info
+        delivery = Delivery(body, info.get('routing_key', ''), self._make_settle(message), info.get('exchange', ''))
+        self._loop.call_soon_threadsafe(self._inbox.put_nowait, delivery)
+
+    def _make_settle(self, message):
+        def settle(ok: bool, requeue: bool):
+            self._outbox.put((message, ok, requeue))
+        return settle
+
+    def _flush_outbox(self):
+        while True:
+            try:
+                message, ok, requeue = self._outbox.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if ok:
+                    message.ack()
+                else:
+                    message.reject(requeue=requeue)
+            except Exception as e:
+                # канал мог быть пересоздан после реконнекта - брокер сам вернет сообщение в очередь
+                logging.error(f'cannot settle message {message.delivery_info}: {e}')
+
+    def _drain(self, queues: list, prefetch: int):
+        while not self._stopping.is_set():
+            try:
+                self.connection.ensure_connection(max_retries=3)
+                channel = self.connection.channel()
+                consumer = Consumer(channel, queues=queues, accept=['json'], callbacks=[self._on_message])
+                consumer.qos(prefetch_count=prefetch)
+                with consumer:
+                    if self.on_connect:
+                        self._loop.call_soon_threadsafe(self.on_connect)
+                    while not self._stopping.is_set():
+                        self._flush_outbox()
+                        try:
+                            self.connection.drain_events(timeout=self.poll_interval)
+                        except socket.timeout:
+                            pass
+                    self._flush_outbox()
+            except self.connection.recoverable_connection_errors as e:
+                logging.error(f'mq connection lost, reconnecting: {e}')
+                self.connection.collect()
+            except Exception as e:
+                logging.error(f'mq drain loop failed: {e}')
+                self._stopping.wait(1)
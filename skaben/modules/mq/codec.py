@@ -0,0 +1,97 @@
+"""JSON codec of MQ layer
+
+   orjson is used when installed, else stdlib json (through kombu helpers,
+   so UUID/datetime/Decimal are encoded the same way as before).
+   `register` replaces kombu `json` serializer, so outgoing packets and
+   messages with `application/json` content type go through the same codec.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from kombu import serialization
+from kombu.utils import json as kombu_json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+if orjson:
+    BACKEND = 'orjson'
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=kombu_json.JSONEncoder().default, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+    DecodeError = orjson.JSONDecodeError
+else:  # pragma: no cover
+    BACKEND = 'json'
+    dumps = kombu_json.dumps
+    loads = kombu_json.loads
+    DecodeError = ValueError
+
+
+ASK_FIELDS = frozenset(('timestamp', 'task_id', 'hash', 'datahold'))
+
+
+@dataclass
+class AskPayload:
+    """Payload of ask.<type>.<uid>.<command> message"""
+
+    timestamp: int = 0
+    task_id: int | str = 0
+    hash: str = ''
+    datahold: dict | str | None = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Optional['AskPayload']:
+        """payload of expected shape or None"""
+        if data.keys() - ASK_FIELDS:
+            return None
+        payload = cls(**data)
+        if not (type(payload.timestamp) is int
+                and type(payload.task_id) in (int, str)
+                and isinstance(payload.hash, str)
+                and isinstance(payload.datahold, (dict, str, type(None)))):
+            return None
+        return payload
+
+
+def parse_json(json_data: Optional[str | bytes] = None) -> dict:
+    """get dict from json"""
+    try:
+        if isinstance(json_data, dict):
+            return json_data
+        if not json_data:
+            return {}
+        return loads(json_data)
+    except Exception as exc:
+        logging.error(f'cannot parse json: {json_data} {exc}')
+        return {}
+
+
+def decode_ask(body: Any) -> dict:
+    """decode device payload to dict with `timestamp`, `task_id`, `hash` and parsed `datahold`
+
+       payload of expected shape gets defaults for missing fields,
+       anything else is returned as parsed
+    """
+    data = parse_json(body)
+    if not data or not isinstance(data, dict):
+        return data
+    payload = AskPayload.from_dict(data)
+    if payload is not None:
+        # устройства присылают datahold строкой с JSON внутри
+        return {'timestamp': payload.timestamp,
+                'task_id': payload.task_id,
+                'hash': payload.hash,
+                'datahold': parse_json(payload.datahold)}
+    if 'datahold' in data and not isinstance(data['datahold'], dict):
+        data = {**data, 'datahold': parse_json(data['datahold'])}
+    return data
+
+
+def register(name: str = 'json'):
+    """replace kombu serializer `name` with this codec"""
+    serialization.register(name, dumps, loads, content_type='application/json', content_encoding='utf-8')
@@ -1,19 +1,32 @@
 import kombu
 import logging
+import time
 
+from contextlib import contextmanager
 from functools import lru_cache
 from kombu import Connection, Exchange, Queue
+from skaben import metrics
 from skaben.config import get_settings
+from skaben.modules.mq import codec
 
-settings = get_settings()
+codec.register('json')
 kombu.disable_insecure_serializers(allowed=['json'])
 
+# очереди ответов от устройств (ask.<type>.<uid>.<command>)
+TRANSPORT_QUEUES = ('cup', 'sup', 'info', 'ack', 'nack', 'pong')
+# внутренние очереди сервера
+INTERNAL_QUEUES = ('log', 'errors', 'save')
+# обменник очередей `mq workers`, ключ сообщения - <исходный ключ>.shard.<n>
+SHARD_EXCHANGE = 'shards'
+
+POOL_WAIT = metrics.histogram('skaben_mq_pool_acquire_seconds', 'time spent waiting for a channel from MQ pool')
+
 
 class MQFactory:
 
     @staticmethod
-    def create_queue(queue_name: str, exchange: Exchange, is_topic: bool = True, **kwargs) -> Queue:
-        routing_key = f'#.{queue_name}' if is_topic else queue_name
+    def create_queue(queue_name: str, exchange: Exchange, is_topic: bool = True, prefix: str = '', **kwargs) -> Queue:
+        routing_key = f'{prefix}#.{queue_name}' if is_topic else queue_name
         return Queue(
             queue_name,
             durable=False,
@@ -34,20 +47,33 @@ class MQConfig:
 
     exchanges: dict
     queues: dict
+    shard_queues: dict
 
-    def __init__(self):
+    def __init__(self, uri: str | None = None):
         self.exchanges = {}
         self.queues = {}
-        if not settings.amqp_uri:
+        self.shard_queues = {}
+        # префикс ключа очередей ответов, если ask-обменник совпадает с mqtt
+        self.ask_prefix = ''
+        self.uri = uri or get_settings().amqp_uri
+        if not self.uri:
             logging.error('AMQP settings is missing, exchanges will not be initialized')
             return
-        self.conn = Connection(settings.amqp_uri)
+        self.conn = Connection(self.uri)
         self.pool = self.conn.ChannelPool()
 
+    @contextmanager
+    def channel(self):
+        """channel from pool, released on exit"""
+        started = time.perf_counter()
+        with self.pool.acquire(timeout=get_settings().amqp.timeout) as channel:
+            POOL_WAIT.observe(time.perf_counter() - started)
+            yield channel
+
     def init_mqtt_exchange(self) -> dict:
         """Initialize MQTT exchange infrastructure"""
         logging.info('initializing mqtt exchange')
-        with self.pool.acquire(timeout=settings.amqp.timeout) as channel:
+        with self.channel() as channel:
             # main mqtt exchange, used for messaging out.
             # note that all replies from clients starts with 'ask.' routing key goes to ask exchange
             self.exchanges.update(mqtt=MQFactory.create_exchange(channel, 'mqtt'))
@@ -58,18 +84,24 @@ class MQConfig:
         if not self.exchanges.get('mqtt'):
             self.init_mqtt_exchange()
 
-        with self.pool.acquire(timeout=settings.amqp.timeout) as channel:
+        with self.channel() as channel:
             ask_exchange = MQFactory.create_exchange(channel, 'ask')
-            ask_exchange.bind_to(exchange=self.exchanges['mqtt'],
-                                 routing_key='ask.#',
-                                 channel=channel)
+            try:
+                ask_exchange.bind_to(exchange=self.exchanges['mqtt'],
+                                     routing_key='ask.#',
+                                     channel=channel)
+            except NotImplementedError:
+                # in-memory transport can't bind exchanges, replies are consumed from mqtt exchange directly
+                logging.warning('transport does not support exchange binding, using mqtt exchange for replies')
+                ask_exchange = self.exchanges['mqtt']
+                self.ask_prefix = 'ask.'
             self.exchanges.update(ask=ask_exchange)
         return self.exchanges
 
     def init_internal_exchange(self):
         """Initializing internal direct exchange"""
         logging.info('initializing internal exchange')
-        with self.pool.acquire(timeout=settings.amqp.timeout) as channel:
+        with self.channel() as channel:
             exchange = MQFactory.create_exchange(channel, 'internal', 'direct')
             self.exchanges.update(internal=exchange)
         return self.exchanges
@@ -77,43 +109,50 @@ class MQConfig:
     def init_transport_queues(self) -> dict:
         exchange = self.exchanges.get('ask')
         if not exchange:
-            self.init_ask_exchange()
-
-        q_names = [
-            'cup',
-            'sup',
-            'info',
-            'ack',
-            'nack',
-            'pong'
-        ]
-        queues = {name: MQFactory.create_queue(name, exchange) for name in q_names}
+            exchange = self.init_ask_exchange()['ask']
+
+        queues = {name: MQFactory.create_queue(name, exchange, prefix=self.ask_prefix) for name in TRANSPORT_QUEUES}
         self.queues.update(**queues)
         return self.queues
 
     def init_internal_queues(self) -> dict:
         exchange = self.exchanges.get('internal')
         if not exchange:
-            self.init_internal_exchange()
-
-        q_names = [
-            'log',
-            'errors',
-            'save'
-        ]
-        queues = {name: MQFactory.create_queue(name, exchange, is_topic=False) for name in q_names}
+            exchange = self.init_internal_exchange()['internal']
+
+        queues = {name: MQFactory.create_queue(name, exchange, is_topic=False) for name in INTERNAL_QUEUES}
         self.queues.update(**queues)
         return self.queues
 
+    def init_shard_queues(self, shards: int) -> dict:
+        """per-shard queues of `mq workers`
+
+           declared right away, so router never publishes to exchange without bound queues.
+           kept apart from `queues`, which are consumed by a single consumer
+        """
+        exchange = self.exchanges.get(SHARD_EXCHANGE)
+        if not exchange:
+            logging.info('initializing shards exchange')
+            with self.channel() as channel:
+                exchange = MQFactory.create_exchange(channel, SHARD_EXCHANGE)
+            self.exchanges.update({SHARD_EXCHANGE: exchange})
+
+        queues = {f'shard.{n}': MQFactory.create_queue(f'shard.{n}', exchange) for n in range(shards)}
+        with self.channel() as channel:
+            for queue in queues.values():
+                queue(channel).declare()
+        self.shard_queues = queues
+        return queues
+
     def __str__(self):
-        return f"<MQConfig connected to {settings.amqp_uri}>"
+        return f"<MQConfig connected to {self.uri}>"
 
 
 @lru_cache()
 def get_mq_config():
     config = MQConfig()
     config.init_mqtt_exchange()
-    if not settings.amqp.limited:
+    if not get_settings().amqp.limited:
         config.init_transport_queues()
         config.init_internal_queues()
     return config
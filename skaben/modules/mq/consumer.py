@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import signal
+from typing import Awaitable, Callable, Iterable
+
+from kombu import Queue
+
+from skaben.config import get_settings
+from skaben.modules.mq.broker import AsyncBroker, Delivery, KombuBroker
+from skaben.modules.mq.config import MQConfig
+
+Handler = Callable[[Delivery], Awaitable]
+
+
+class AsyncConsumer:
+    """asyncio MQ consumer
+
+       takes up to `prefetch` unacked messages from the broker and runs
+       at most `concurrency` handler tasks at once. Message is acked after
+       handler returns, rejected without requeue if handler fails.
+       Handler may call `delivery.defer()` to settle the message later by itself,
+       `drain_hooks` are awaited on stop before broker is closed, so deferred messages can be settled.
+    """
+
+    def __init__(self,
+                 broker: AsyncBroker,
+                 handler: Handler,
+                 queues: Iterable[Queue],
+                 prefetch: int | None = None,
+                 concurrency: int | None = None):
+        self.broker = broker
+        self.handler = handler
+        self.queues = list(queues)
+        settings = get_settings()
+        self.prefetch = prefetch or settings.amqp.prefetch
+        self.concurrency = concurrency or settings.amqp.concurrency
+        self.processed = 0
+        self.failed = 0
+        self.drain_hooks: list[Callable[[], Awaitable]] = []
+        self._slots: asyncio.Semaphore | None = None
+        self._tasks: set = set()
+        self._fetcher: asyncio.Task | None = None
+
+    async def start(self):
+        """start fetching messages in background"""
+        self._slots = asyncio.Semaphore(self.concurrency)
+        await self.broker.start(self.queues, self.prefetch)
+        self._fetcher = asyncio.create_task(self._fetch())
+
+    async def run(self):
+        """start and wait until consumer is stopped"""
+        await self.start()
+        try:
+            await self._fetcher
+        except asyncio.CancelledError:
+            pass
+
+    async def stop(self, timeout: float | None = None):
+        """stop fetching, wait for running handlers, then close broker"""
+        timeout = get_settings().amqp.drain_timeout if timeout is None else timeout
+        if self._fetcher:
+            self._fetcher.cancel()
+            try:
+                await self._fetcher
+            except asyncio.CancelledError:
+                pass
+        if self._tasks:
+            done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logging.error(f'{len(pending)} handlers were cancelled on shutdown')
+                await asyncio.wait(pending)
+        for hook in self.drain_hooks:
+            try:
+                await hook()
+            except Exception as e:
+                logging.error(f'drain hook {hook} failed: {e}')
+        await self.broker.close()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def _fetch(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                delivery = await self.broker.get()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._process(delivery))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, delivery: Delivery):
+        try:
+            await self.handler(delivery)
+        except asyncio.CancelledError:
+            delivery.reject(requeue=True)
+            raise
+        except Exception as e:
+            self.failed += 1
+            logging.error(f'cannot handle message {delivery}: {e}')
+            delivery.reject(requeue=False)
+        else:
+            self.processed += 1
+            if not delivery.deferred:
+                delivery.ack()
+        finally:
+            self._slots.release()
+
+
+def create_consumer(config: MQConfig, handler: Handler, **kwargs) -> AsyncConsumer:
+    """consumer for transport (ask.*) and internal queues declared by MQConfig"""
+    broker = KombuBroker(config.conn.clone())
+    return AsyncConsumer(broker, handler, config.queues.values(), **kwargs)
+
+
+async def serve(consumer: AsyncConsumer, *background: Awaitable, drain: Callable[[], Awaitable] | None = None):
+    """run consumer and background jobs until SIGINT/SIGTERM, then drain gracefully
+
+       `drain` is awaited after the signal while consumer still runs, e.g. to empty its queue
+    """
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+    await consumer.start()
+    tasks = [asyncio.create_task(job) for job in background]
+    await stopped.wait()
+    if drain:
+        await drain()
+    logging.info('stopping consumer, waiting for running handlers')
+    await consumer.stop()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,77 @@
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+from skaben import metrics
+from skaben.config import get_settings
+from skaben.modules.mq.dispatch import DeviceMessage
+
+DUPLICATES = metrics.counter('skaben_mq_duplicates', 'retransmitted device messages dropped', ('device_type',))
+
+
+class DedupCache:
+    """Keys seen during last `ttl` seconds, at most `max_size` of them
+
+       TTL is the same for every key, so insertion order is expiry order:
+       expired keys are popped from the head of OrderedDict, and the oldest
+       key is evicted when cache is full. Both are O(1) per key.
+    """
+
+    def __init__(self, ttl: float, max_size: int, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self._expires: OrderedDict[Hashable, float] = OrderedDict()
+
+    def seen(self, key: Hashable) -> bool:
+        """True if key was added less than `ttl` seconds ago, otherwise remember it"""
+        now = self.clock()
+        expires = self._expires.get(key)
+        if expires is not None and expires > now:
+            return True
+        self._expires[key] = now + self.ttl
+        self._expires.move_to_end(key)
+        self._evict(now)
+        return False
+
+    def _evict(self, now: float):
+        while self._expires:
+            key, expires = next(iter(self._expires.items()))
+            if expires > now and len(self._expires) <= self.max_size:
+                return
+            del self._expires[key]
+
+    def __len__(self):
+        return len(self._expires)
+
+
+class MessageFilter:
+    """Drops retransmitted smart device messages (QoS1 redelivery)
+
+       message is a duplicate if the same device sent the same command with the same
+       `task_id` and `hash` within ttl. Messages without task_id (simple devices) are never dropped
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.cache = DedupCache(ttl, max_size)
+
+    @staticmethod
+    def key(message: DeviceMessage) -> tuple | None:
+        if not message.task_id or not isinstance(message.task_id, (str, int)):
+            return None
+        return message.device_uid, message.command, message.task_id, message.hash
+
+    def is_duplicate(self, message: DeviceMessage) -> bool:
+        key = self.key(message)
+        if key is None or not self.cache.seen(key):
+            return False
+        DUPLICATES.labels(message.device_type).inc()
+        return True
+
+
+def create_filter() -> MessageFilter | None:
+    """filter with ttl and size from settings, None if disabled"""
+    settings = get_settings()
+    if settings.app.dedup_ttl <= 0:
+        return None
+    return MessageFilter(settings.app.dedup_ttl, settings.app.dedup_size)
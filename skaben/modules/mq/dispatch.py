@@ -0,0 +1,112 @@
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Iterable
+
+from skaben.modules.core.devices import DeviceEnum, SmartDeviceEnum
+from skaben.modules.mq.codec import decode_ask, parse_json  # noqa
+from skaben.modules.mq.config import TRANSPORT_QUEUES
+
+DeviceHandler = Callable[..., Awaitable]
+
+
+class DeviceMessage:
+    """Parsed message from device (ask.<type>.<uid>.<command>)"""
+
+    __slots__ = ('device_type', 'device_uid', 'command', 'timestamp', 'task_id', 'hash', 'datahold')
+
+    def __init__(self,
+                 device_type: str,
+                 device_uid: str,
+                 command: str,
+                 timestamp: int = 0,
+                 task_id: Any = 0,
+                 hash: str = '',
+                 datahold: Any = None):
+        self.device_type = device_type
+        self.device_uid = device_uid
+        self.command = command
+        self.timestamp = timestamp
+        self.task_id = task_id
+        self.hash = hash
+        self.datahold = {} if datahold is None else datahold
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        if not isinstance(other, DeviceMessage):
+            return NotImplemented
+        return self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return f'<DeviceMessage {self.device_type}.{self.device_uid}.{self.command}>'
+
+
+@lru_cache(maxsize=65536)
+def split_routing_key(routing_key: str) -> tuple:
+    """ask.<type>.<uid>.<command> -> (type, uid, command), cached since keys repeat for every device"""
+    prefix, device_type, device_uid, command = routing_key.split('.')
+    if prefix != 'ask':
+        raise ValueError(f'not a device message: {routing_key}')
+    return device_type, device_uid, command
+
+
+class DispatchTable:
+    """Maps (device_type, command) of incoming messages to handlers
+
+       built once from SmartDeviceEnum/DeviceEnum, so per-message work is a
+       cached routing key split and one dict lookup
+    """
+
+    def __init__(self, commands: Iterable[str] = TRANSPORT_QUEUES):
+        self.smart_types = frozenset(e.value for e in SmartDeviceEnum)
+        self.simple_types = frozenset(e.value for e in DeviceEnum)
+        self.commands = tuple(commands)
+        self.routes: dict[tuple, DeviceHandler | None] = {
+            (device_type, command): None
+            for device_type in self.smart_types | self.simple_types
+            for command in self.commands
+        }
+
+    def register(self, device_types: Iterable[str], commands: Iterable[str], handler: DeviceHandler):
+        """handler is awaited with (DeviceMessage, Delivery)"""
+        for device_type in device_types:
+            for command in commands:
+                self.routes[(device_type, command)] = handler
+
+    def route(self, device_types: Iterable[str], commands: Iterable[str]):
+        """decorator version of `register`"""
+        def decorator(handler: DeviceHandler):
+            self.register(device_types, commands, handler)
+            return handler
+        return decorator
+
+    def resolve(self, message: DeviceMessage) -> DeviceHandler | None:
+        return self.routes.get((message.device_type, message.command))
+
+    def parse(self, routing_key: str, body: Any) -> DeviceMessage:
+        device_type, device_uid, command = split_routing_key(routing_key)
+        data = decode_ask(body)
+        if device_type in self.smart_types:
+            if not isinstance(data, dict):
+                return DeviceMessage(device_type, device_uid, command, datahold=f'{data}')
+            return DeviceMessage(device_type,
+                                 device_uid,
+                                 command,
+                                 timestamp=int(data.get('timestamp', 0)),
+                                 task_id=data.get('task_id', 0),
+                                 hash=data.get('hash', ''),
+                                 datahold=data.get('datahold', {}))
+        datahold = data.get('datahold', {})
+        timestamp = data.get('timestamp') or datahold.get('timestamp', 1)
+        return DeviceMessage(device_type,
+                             device_uid,
+                             command,
+                             timestamp=timestamp,
+                             task_id=data.get('task_id', 0),
+                             hash=data.get('hash', ''),
+                             datahold=datahold)
+
+
+@lru_cache()
+def get_dispatch_table() -> DispatchTable:
+    return DispatchTable()
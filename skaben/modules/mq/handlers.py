@@ -1,246 +1,169 @@
 import time
-import json
 import logging
 
-from typing import Union, Optional
-from kombu.mixins import ConsumerProducerMixin
+from typing import Union
 from kombu.message import Message
+from skabenproto.packets import CUP
 
-from skaben.config import get_settings
+from skaben import metrics
+from skaben.modules.mq.broker import Delivery
 from skaben.modules.mq.config import MQConfig
+from skaben.modules.mq.dedup import MessageFilter
+from skaben.modules.mq.dispatch import DeviceMessage, DispatchTable, get_dispatch_table
+from skaben.modules.mq.ingress import Ingress
 from skaben.modules.mq.interface import MQInterface
+from skaben.modules.mq.simple import SimpleConfigBroadcast
+
+from skaben.helpers import new_task_id
+from skaben.models.device import DEVICE_MODELS
+from skaben.modules.core.configs import DeviceConfigCache
+from skaben.modules.core.persistence import WriteBehindSaver
+from skaben.modules.core.presence import PRESENCE_COMMANDS, PresenceIndex, presence_uid
+
+HANDLE_SECONDS = metrics.histogram('skaben_mq_handle_seconds', 'message parsing and handling time',
+                                   ('device_type', 'command'))
+HANDLE_ERRORS = metrics.counter('skaben_mq_handle_errors', 'messages failed to parse or handle',
+                                ('device_type', 'command'))
+# сообщения, которые не удалось разобрать, не дают метке вырасти до числа устройств
+UNPARSED = ('unknown', 'unknown')
+# отчеты устройства о своем состоянии, сохраняются в БД
+SAVE_COMMANDS = ('sup', 'info')
+
+
+class MessageHandler(MQInterface):
+    """MQ Message handler class
+
+       used as AsyncConsumer handler, so handlers can await DB work in the same event loop
+    """
+
+    def __init__(self,
+                 config: MQConfig,
+                 dispatch: DispatchTable | None = None,
+                 presence: PresenceIndex | None = None,
+                 saver: WriteBehindSaver | None = None,
+                 configs: DeviceConfigCache | None = None,
+                 simple: SimpleConfigBroadcast | None = None,
+                 dedup: MessageFilter | None = None,
+                 ingress: Ingress | None = None):
+        super().__init__(config)
+        self.dispatch = dispatch or get_dispatch_table()
+        self.presence = presence
+        self.saver = saver
+        self.configs = configs
+        self.simple = simple
+        self.dedup = dedup
+        self.ingress = ingress
+        if configs is not None:
+            self.dispatch.register(self.dispatch.smart_types, ['cup'], self.send_config)
+        if simple is not None:
+            self.dispatch.register(self.dispatch.simple_types, ['cup'], self.send_config_simple)
+        if saver is not None:
+            self.dispatch.register(DEVICE_MODELS, SAVE_COMMANDS, self.save_config)
+
+    async def handle(self, delivery: Delivery):
+        """AsyncConsumer entrypoint, passes parsed message to handler registered in dispatch table"""
+        started = time.perf_counter()
+        labels = UNPARSED
+        try:
+            parsed = self.handle_message(delivery.body, delivery)
+            if isinstance(parsed, DeviceMessage):
+                labels = (parsed.device_type, parsed.command)
+                if self.presence and parsed.command in PRESENCE_COMMANDS:
+                    self.touch(parsed)
+                if self.dedup and self.dedup.is_duplicate(parsed):
+                    return parsed
+                if self.ingress is not None and not self.ingress.admit(parsed, delivery):
+                    return parsed
+                return await self.forward(parsed, delivery)
+            labels = ('internal', delivery.routing_key)
+            if self.saver and delivery.routing_key == 'save':
+                return await self.saver.handle(parsed, delivery)
+            return parsed
+        except Exception:
+            HANDLE_ERRORS.labels(*labels).inc()
+            raise
+        finally:
+            HANDLE_SECONDS.labels(*labels).observe(time.perf_counter() - started)
+
+    def touch(self, parsed: DeviceMessage):
+        """record device in presence index, uid which is not a MAC address is not tracked"""
+        try:
+            device_uid = presence_uid(parsed.device_uid)
+        except ValueError:
+            logging.debug(f'{parsed} is not from a MAC-addressed device, presence is not tracked')
+            return
+        self.presence.touch(parsed.device_type, device_uid)
 
-from skaben.modules.core.devices import SmartDeviceEnum, DeviceEnum
-
-settings = get_settings()
-
+    async def forward(self, parsed: DeviceMessage, delivery: Delivery):
+        """pass device message to handler registered in dispatch table"""
+        handler = self.dispatch.resolve(parsed)
+        if handler:
+            return await handler(parsed, delivery)
+        return parsed
 
-class MessageHandler(ConsumerProducerMixin, MQInterface):
-    """MQ Message handler class"""
+    def background(self) -> list:
+        """coroutines to run next to consumer"""
+        return [self.ingress.run(self.forward)] if self.ingress is not None else []
 
-    def __init__(self, config: MQConfig):
-        super(MQInterface).__init__(config)
+    async def drain(self):
+        """forward coalesced reports still waiting for their window, consumer drain hook"""
+        if self.ingress is not None:
+            await self.ingress.flush(self.forward, everything=True)
 
-    def handle_message(self, body: Union[str, dict], message: Message) -> dict:
-        """parse MQTT message to dict or return untouched if it's already dict
+    def handle_message(self, body: Union[str, dict], message: Message | Delivery) -> DeviceMessage | dict:
+        """parse MQTT message to DeviceMessage or return untouched if it's already dict
            only messages which comes with 'ask.*' routing key should be parsed
         """
-        rk = message.delivery_info.get('routing_key').split('.')
-        if rk[0] == 'ask':
-            try:
-                rk = rk[1:]
-            except Exception as e:
-                raise Exception(f"cannot parse routing key `{rk}` >> {e}")
-
-            try:
-                parsed = self.parse_basic(rk)
-                data = self.parse_json(body)
-            except Exception as e:
-                raise Exception(f"cannot parse message payload `{body}` >> {e}")
-
-            if parsed.get("device_type") in [e.value for e in SmartDeviceEnum]:
-                parsed.update(self.parse_smart(data))
-            else:
-                parsed.update(**data)
-                if not parsed.get('timestamp'):
-                    parsed['timestamp'] = data.get('datahold', {}).get('timestamp', 1)
-            return parsed
-        else:
+        routing_key = message.delivery_info.get('routing_key')
+        if not routing_key.startswith('ask.'):
             return body  # just return already parsed message
 
-    @staticmethod
-    def parse_json(json_data: Optional[str] = None) -> dict:
-        """get dict from json"""
         try:
-            if isinstance(json_data, dict):
-                return json_data
-            if not json_data:
-                return {}
-            return json.loads(json_data)
-        except Exception as exc:
-            logging.error(f'cannot parse json: {json_data} {exc}')
-            return {}
-
-    @staticmethod
-    def parse_basic(routing_key: list) -> dict:
-        """get device parameters from topic name (routing key)"""
-        device_type, device_uid, command = routing_key
-        data = dict(device_type=device_type,
-                    device_uid=device_uid,
-                    command=command)
-        return data
-
-    def parse_smart(self, data: dict) -> dict:
-        """get additional data-fields from smart device"""
-        parsed = {'datahold': f'{data}'}
-        if isinstance(data, dict):
-            datahold = self.parse_json(data.get('datahold', {}))
-            parsed = dict(
-                timestamp=int(data.get('timestamp', 0)),
-                task_id=data.get('task_id', 0),
-                datahold=datahold,
-                hash=data.get('hash', '')
-            )
-        return parsed
+            return self.dispatch.parse(routing_key, body)
+        except Exception as e:
+            raise Exception(f"cannot parse message `{routing_key}` payload `{body}` >> {e}")
 
-    def update_timestamp_only(self, parsed: dict, timestamp: Union[str, int] = None):
-        timestamp = int(time.time()) if not timestamp else timestamp
-        parsed.update({
-            'timestamp': timestamp,
-            'datahold': {'timestamp': timestamp},
-            'command': 'sup',
-            'hash': parsed.get('hash', '')
-        })
-        self.save_device_config(parsed)
-
-    def push_device_config(self, parsed: dict):
+    async def send_config(self, parsed: DeviceMessage, delivery: Delivery | None = None):
+        """answer CUP of smart device with its config if device hash differs from server one
+
+           time of the request is already recorded by presence index
+        """
+        entry = await self.configs.get(parsed.device_type, parsed.device_uid)
+        if not entry or str(entry.hash) == str(parsed.hash):
+            return
+        logging.debug(f'sending config for {parsed.device_type} {parsed.device_uid}')
+        packet = CUP(topic=parsed.device_type,
+                     uid=parsed.device_uid,
+                     task_id=new_task_id(parsed.device_uid[-4:]),
+                     datahold=entry.datahold,
+                     timestamp=int(time.time()))
+        return self._publish(packet.payload,
+                             exchange=self.config.exchanges.get('mqtt'),
+                             routing_key=f"{parsed.device_type}.{parsed.device_uid}.cup")
+
+    async def send_config_simple(self, parsed: DeviceMessage, delivery: Delivery | None = None):
+        """answer CUP of simple device with config of the current alert state"""
+        return await self.simple.send(parsed.device_type, parsed.device_uid)
+
+    async def save_config(self, parsed: DeviceMessage, delivery: Delivery | None = None):
+        """buffer state reported by device for write-behind saver
+
+           delivery is settled after the batch is written, unless ingress already acked it
+        """
+        payload = {'device_type': parsed.device_type,
+                   'device_uid': parsed.device_uid,
+                   'timestamp': parsed.timestamp or int(time.time()),
+                   'datahold': parsed.datahold if isinstance(parsed.datahold, dict) else {}}
+        if delivery is not None and delivery.settled:
+            delivery = None
+        return await self.saver.handle(payload, delivery)
+
+    def push_device_config(self, parsed: DeviceMessage):
         """send config to device (emulates config request from device'"""
-        routing_key = f"{parsed['device_type']}.{parsed['device_uid']}.cup"
-        self._publish(parsed,
+        routing_key = f"{parsed.device_type}.{parsed.device_uid}.cup"
+        self._publish(parsed.as_dict(),
                       exchange=self.config.exchanges.get('ask'),
                       routing_key=routing_key)
 
-    def save_device_config(self, payload: dict):
-        """Сохранить конфигурацию устройства"""
-        payload.update({"timestamp": int(time.time())})
-        kwargs = {
-            "body": payload,
-            "exchange": self.config.exchanges.get('internal'),
-            "routing_key": 'save'
-        }
-        self._publish(**kwargs)
-
-    def get_consumers(self, consumer, channel):
-        """setup consumer and assign callback"""
-        _consumer = consumer(queues=self.config.queues.values(),
-                             accept=['json'],
-                             callbacks=[self.handle_message])
-        return [_consumer]
-
     def __str__(self):
         return f"{self.__class__.__name__}"
-
-
-'''
-class SaveConfigHandler(MessageHandler):
-    """Save handler"""
-
-    def device_not_found(self, device_type: str, device_uid: str):
-        """spawn notification about unregistered device"""
-        raise NotImplementedError
-
-    def handle_message(self, body: Union[str, dict], message: Message):
-        """handling server update message
-
-           save device state to database without sending update packet (CUP) back
-           serializer context {"no_send": True} do the trick
-        """
-        parsed = super().handle_message(body, message)
-        logging.debug(f'handling {body} {message}')
-        message.ack()
-
-        _type = parsed['device_type']
-        _uid = parsed['device_uid']
-        # include timestamp to load
-        parsed['datahold'].update({"timestamp": parsed.get('timestamp', int(time.time()))})
-        if _type not in [e.value for e in SmartDeviceEnum]:
-            logging.error(f'device type {_type} is not supported')
-            return
-        # TODO: сопоставление типа девайса с моделью и схемой, сохранение через них в БД
-
-
-class SendConfigHandler(MessageHandler):
-    """send config update to clients (CUP)"""
-
-    def handle_message(self, body: Union[str, dict], message: Message):
-        parsed = super().handle_message(body, message)
-        device_type = parsed.get('device_type')
-        device_uid = parsed.get('device_uid')
-        message.ack()
-
-        try:
-            if device_type in [e.value for e in DeviceEnum]:
-                return self.send_config_simple(device_type, device_uid)
-            # достаем из базы актуальный конфиг устройства
-            config = self.get_config(device_type, device_uid)
-            # проверяем разницу хэшей в пришедшем конфиге и серверном
-            if str(config.get('hash')) != str(parsed.get('hash', '')):
-                self.send_config(device_type, device_uid, config)
-            else:
-                # обновляем таймстемп в любом случае
-                self.update_timestamp_only(parsed)
-        except Exception as e:
-            raise Exception(f"{body} {message} {parsed} {e}")
-
-    def get_config(self, device_type: str, device_uid: str) -> dict:
-        device = self.smart.get(device_type)
-        if not device:
-            self.report_error(f"device not in smart list, but CUP received: {device_type}")
-            return {}
-
-        try:
-            device_instance = device['model'].objects.get(uid=device_uid)
-            serializer = device['serializer'](instance=device_instance)
-            return serializer.data
-        except Exception as e:  # DoesNotExist - fixme: make normal exception
-            self.report_error(f"[DB error] {device_type} {device_uid}: {e}")
-
-    def send_config(self, device_type: str, device_uid: str, config: dict):
-        logging.debug(f'sending config for {device_type} {device_uid}')
-        packet = CUP(
-            topic=device_type,
-            uid=device_uid,
-            task_id=get_task_id(device_uid[-4:]),
-            datahold=config,
-            timestamp=int(time.time())
-        )
-        self._publish(packet.payload,
-                      exchange=self.config.exchanges.get('mqtt'),
-                      routing_key=f"{device_type}.{device_uid}.cup")
-
-    @staticmethod
-    def get_scl_config():
-        borders = get_borders()
-        last_counter = get_last_counter()
-        if last_counter > borders[-1]:
-            last_counter = borders[-1]
-        elif last_counter < borders[0]:
-            last_counter = borders[0]
-
-        device_uid = 'all'
-        datahold = {
-            'borders': borders,
-            'level': last_counter,
-            'state': 'green'
-        }
-        return device_uid, datahold
-
-    def send_config_simple(self, device_type: str, device_uid: Optional[str] = None):
-        """Отправляем конфиг простым устройствам в соответствии с текущим уровнем тревоги"""
-        datahold = {}
-
-        if device_type != 'scl':
-            state_id = get_current_alert_state()
-            instance = SimpleConfig.objects.filter(dev_type=device_type, state__id=state_id).first()
-            if not device_uid or device_type in ('pwr', 'hold'):
-                device_uid = 'all'
-            if not instance or not instance.config:
-                return
-
-            datahold = instance.config
-
-        if device_type == 'scl':
-            device_uid, datahold = self.get_scl_config()
-
-        packet = CUP(
-            topic=device_type,
-            uid=device_uid,
-            datahold=datahold,
-            task_id='simple',
-            timestamp=int(time.time())
-        )
-
-        self.publish(packet.payload,
-                     exchange=self.exchanges.get('mqtt'),
-                     routing_key=f"{device_type}.{device_uid}.cup")
-'''
\ No newline at end of file
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from skaben import metrics
+from skaben.config import get_settings
+from skaben.modules.mq.broker import Delivery
+from skaben.modules.mq.dispatch import DeviceMessage
+
+THROTTLED = metrics.counter('skaben_mq_throttled', 'device messages dropped by per-device rate limit',
+                            ('device_type',))
+COALESCED = metrics.counter('skaben_mq_coalesced', 'state reports replaced by a newer one before forwarding',
+                            ('device_type',))
+
+# отчеты о состоянии: важен только последний
+COALESCE_COMMANDS = ('sup', 'info')
+
+Forward = Callable[[DeviceMessage, Delivery], Awaitable]
+
+
+class Ingress:
+    """Per-device rate limit and coalescing of state reports at consumer ingress
+
+       every device has a token bucket of `burst` tokens refilled at `rate` per second,
+       messages of a device with empty bucket are dropped. sup/info are forwarded at most
+       once per `window` for each device: reports coming in between replace each other and
+       the latest one is forwarded when window ends, so it is never lost to the rate limit.
+
+       device state is a list of 4 floats in LRU order, capped at `max_devices`:
+       evicted devices are the idle ones, they come back with a full bucket.
+       replaced reports are acked by consumer on arrival, pending ones live only in memory.
+    """
+
+    def __init__(self, rate: float, burst: float, window: float, max_devices: int = 65536, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.window = window
+        self.max_devices = max_devices
+        self.clock = clock
+        # (type, uid) -> [tokens, refilled_at, sup forwarded_at, info forwarded_at]
+        self._devices: OrderedDict[tuple, list] = OrderedDict()
+        self._pending: dict[tuple, tuple[float, DeviceMessage, Delivery]] = {}
+
+    def _device(self, key: tuple, now: float) -> list:
+        state = self._devices.get(key)
+        if state is None:
+            state = self._devices[key] = [self.burst, now, None, None]
+            if len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+            return state
+        self._devices.move_to_end(key)
+        if self.rate > 0:
+            state[0] = min(self.burst, state[0] + (now - state[1]) * self.rate)
+        state[1] = now
+        return state
+
+    def admit(self, message: DeviceMessage, delivery: Delivery) -> bool:
+        """True if message should be handled now, otherwise it is dropped or kept as pending"""
+        now = self.clock()
+        state = self._device((message.device_type, message.device_uid), now)
+        limited = self.rate > 0 and state[0] < 1
+        if self.window > 0 and message.command in COALESCE_COMMANDS:
+            slot = 2 + COALESCE_COMMANDS.index(message.command)
+            key = (message.device_type, message.device_uid, message.command)
+            forwarded_at = state[slot]
+            if key in self._pending:
+                COALESCED.labels(message.device_type).inc()
+                self._pending[key] = (self._pending[key][0], message, delivery)
+                return False
+            if limited or (forwarded_at is not None and now - forwarded_at < self.window):
+                due = now + self.window if forwarded_at is None else max(forwarded_at + self.window, now)
+                if limited:
+                    due = max(due, now + (1 - state[0]) / self.rate)
+                self._pending[key] = (due, message, delivery)
+                return False
+            state[slot] = now
+        elif limited:
+            THROTTLED.labels(message.device_type).inc()
+            return False
+        if self.rate > 0:
+            state[0] -= 1
+        return True
+
+    def due(self, everything: bool = False) -> list[tuple[DeviceMessage, Delivery]]:
+        """pending reports whose window has ended, removed from pending"""
+        now = self.clock()
+        ready = [key for key, (due, _, _) in self._pending.items() if everything or due <= now]
+        result = []
+        for key in ready:
+            _, message, delivery = self._pending.pop(key)
+            state = self._devices.get(key[:2])
+            if state is not None:
+                state[2 + COALESCE_COMMANDS.index(key[2])] = now
+            result.append((message, delivery))
+        return result
+
+    async def flush(self, forward: Forward, everything: bool = False):
+        for message, delivery in self.due(everything):
+            try:
+                await forward(message, delivery)
+            except Exception as e:
+                logging.error(f'cannot handle coalesced {message}: {e}')
+
+    async def run(self, forward: Forward):
+        """forward pending reports when their window ends"""
+        interval = max(self.window / 4, 0.01)
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush(forward)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def __len__(self):
+        return len(self._devices)
+
+
+def create_ingress() -> Ingress | None:
+    """ingress stage with limits from settings, None if both rate limit and coalescing are disabled"""
+    settings = get_settings()
+    if settings.app.ingress_rate <= 0 and settings.app.coalesce_window <= 0:
+        return None
+    return Ingress(settings.app.ingress_rate, settings.app.ingress_burst, settings.app.coalesce_window,
+                   settings.app.ingress_devices)
@@ -1,18 +1,29 @@
 import logging
+import time
 import traceback
 import skabenproto
-from typing import Union
+from concurrent.futures import Future
+from typing import Iterable, Union
 
-from skaben.config import get_settings
+from skaben import metrics
 from skaben.modules.mq.config import MQConfig
+from skaben.modules.mq.publisher import BatchPublisher, get_publisher
 
-settings = get_settings()
+PUBLISH_SECONDS = metrics.histogram('skaben_mq_publish_seconds', 'time from publish until broker confirmed message')
+PUBLISH_ERRORS = metrics.counter('skaben_mq_publish_errors', 'messages failed to publish or nacked by broker')
 
 
 class MQInterface(object):
 
-    def __init__(self, config: MQConfig):
+    def __init__(self, config: MQConfig, publisher: BatchPublisher | None = None):
         self.config = config
+        self._publisher = publisher
+
+    @property
+    def publisher(self) -> BatchPublisher:
+        if self._publisher is None:
+            self._publisher = get_publisher(self.config)
+        return self._publisher
 
     def send_mqtt_skaben(self, packet: skabenproto.BasePacket):
         """Отправить SKABEN пакет через MQTT"""
@@ -30,19 +41,31 @@ class MQInterface(object):
         except Exception:
             raise Exception(f"{traceback.format_exc()}")
 
-    def _publish(self, body: dict, exchange: str, routing_key: str):
+    def send_mqtt_many(self, packets: Iterable[skabenproto.BasePacket]) -> list[Future]:
+        """Отправить пачку SKABEN пакетов через MQTT"""
+        exchange = self.config.exchanges.get('mqtt')
+        return self.publisher.publish_many((packet.payload, exchange, packet.topic) for packet in packets)
+
+    def _publish(self, body: dict, exchange: str, routing_key: str) -> Future | None:
+        """put message to publisher batch, returned future is resolved when broker confirms delivery"""
+        started = time.perf_counter()
         try:
-            with self.config.pool.acquire() as channel:
-                prod = self.config.conn.Producer(channel)
-                prod.publish(
-                    body,
-                    exchange=exchange,
-                    routing_key=routing_key,
-                    retry=True
-                )
-            return True
+            future = self.publisher.publish(body, exchange=exchange, routing_key=routing_key)
         except Exception as e:
+            PUBLISH_ERRORS.inc()
             logging.error(f'exception occured when sending packet to {routing_key}: {e}')
+            return None
+        if future is not None:
+            future.add_done_callback(lambda done: self._observe_publish(done, started))
+        return future
+
+    @staticmethod
+    def _observe_publish(future: Future, started: float):
+        # вызывается из потока публикации, когда брокер подтвердил или отверг сообщение
+        if future.exception() is not None:
+            PUBLISH_ERRORS.inc()
+        else:
+            PUBLISH_SECONDS.observe(time.perf_counter() - started)
 
     def __str__(self):
         return f'<MQInterface ["config": {self.config}]>'
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""Fleet of virtual devices for load testing
+
+   devices publish `ask.<type>.<uid>.<command>` to mqtt exchange the same way
+   MQTT clients do, answer PING with pong and request configs with cup.
+   Latency is measured from cup request to CUP reply addressed to the device
+   (or to `<type>.all.cup` for simple devices)
+"""
+import asyncio
+import bisect
+import json
+import random
+import re
+import time
+import uuid
+from collections import Counter, defaultdict
+
+from kombu import Exchange, Queue, binding
+
+from skaben.modules.mq.broker import Delivery, KombuBroker
+from skaben.modules.mq.config import MQConfig
+from skaben.modules.mq.consumer import AsyncConsumer
+from skaben.modules.mq.dispatch import DeviceMessage, DispatchTable
+from skaben.modules.mq.publisher import BatchPublisher
+
+# границы корзин гистограммы задержек (мс)
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class LatencyHistogram:
+    """Latency histogram with fixed millisecond buckets and exact percentiles"""
+
+    def __init__(self, buckets: tuple = BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.samples: list[float] = []
+
+    def add(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds * 1000)] += 1
+        self.samples.append(seconds)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, q: float) -> float:
+        """q-th percentile (0..100) in milliseconds"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] * 1000
+
+    def render(self, width: int = 40) -> str:
+        peak = max(self.counts) or 1
+        labels = [f'<= {b} ms' for b in self.buckets] + [f'>  {self.buckets[-1]} ms']
+        return '\n'.join(f'{label:>12} {count:>9} {"#" * round(count / peak * width)}'
+                         for label, count in zip(labels, self.counts))
+
+
+def split_topic(routing_key: str) -> tuple[str, str, str]:
+    """`<type>.<uid>.<cmd>` (or with `/`) -> (type, uid, cmd), bare `<type>` is PING to all devices of type"""
+    parts = re.split(r'[./]', routing_key)
+    if len(parts) == 1:
+        return parts[0], 'all', 'ping'
+    return parts[0], parts[1], parts[-1]
+
+
+class VirtualFleet:
+    """Devices publishing traffic at given per-device rates (messages per second)"""
+
+    def __init__(self,
+                 connection,
+                 exchange: Exchange,
+                 devices: dict[str, list[str]],
+                 rates: dict[str, float],
+                 smart_types: frozenset = frozenset()):
+        self.connection = connection
+        self.exchange = exchange
+        self.devices = devices
+        self.rates = rates
+        self.smart_types = smart_types
+        self.publisher = BatchPublisher(connection.clone())
+        self.latency = LatencyHistogram()
+        self.sent = Counter()
+        self.received = Counter()
+        self.pending: dict[str, dict[str, float]] = defaultdict(dict)
+        self._all = [(device_type, uid) for device_type, uids in devices.items() for uid in uids]
+        self._queue = Queue(f'loadgen.{uuid.uuid4().hex[:8]}',
+                            bindings=[binding(exchange, routing_key=key) for key in self.reply_keys()],
+                            auto_delete=True,
+                            durable=False)
+        self._consumer = AsyncConsumer(KombuBroker(connection.clone(), poll_interval=0.005),
+                                       self.on_server_message, [self._queue], prefetch=1000, concurrency=64)
+
+    def reply_keys(self) -> list[str]:
+        """server -> device topics: configs and pings, bare `<type>` is PING without uid"""
+        return ['*.*.cup', '*.*.ping'] + list(self.devices)
+
+    def body(self, device_type: str, command: str) -> bytes:
+        datahold = {'timestamp': int(time.time())}
+        if device_type not in self.smart_types:
+            return json.dumps({'timestamp': datahold['timestamp'], 'datahold': datahold}).encode()
+        # пустой хэш - сервер всегда отвечает конфигурацией
+        return json.dumps({'timestamp': datahold['timestamp'], 'task_id': 0, 'hash': '',
+                           'datahold': json.dumps(datahold)}).encode()
+
+    def emit(self, device_type: str, uid: str, command: str):
+        if command == 'cup':
+            self.pending[device_type].setdefault(uid, time.perf_counter())
+        self.sent[command] += 1
+        return self.body(device_type, command), self.exchange, f'ask.{device_type}.{uid}.{command}'
+
+    async def on_server_message(self, delivery: Delivery):
+        device_type, uid, command = split_topic(delivery.routing_key)
+        if device_type not in self.devices:
+            return
+        self.received[command] += 1
+        if command == 'ping':
+            uids = self.devices[device_type] if uid == 'all' else [uid]
+            self.publisher.publish_many(self.emit(device_type, device_uid, 'pong') for device_uid in uids)
+        elif command == 'cup':
+            now = time.perf_counter()
+            pending = self.pending[device_type]
+            requested = list(pending.items()) if uid == 'all' else [(uid, pending.get(uid))]
+            for device_uid, sent_at in requested:
+                if sent_at is not None:
+                    self.latency.add(now - sent_at)
+                    pending.pop(device_uid, None)
+
+    async def run(self, duration: float, tick: float = 0.01):
+        """publish traffic for `duration` seconds"""
+        declare(self.connection, [self._queue])
+        await self._consumer.start()
+        carry = dict.fromkeys(self.rates, 0.0)
+        total = len(self._all)
+        started = last = time.perf_counter()
+        while (now := time.perf_counter()) - started < duration:
+            messages = []
+            for command, rate in self.rates.items():
+                carry[command] += rate * total * (now - last)
+                count, carry[command] = int(carry[command]), carry[command] % 1
+                messages.extend(self.emit(*random.choice(self._all), command) for _ in range(count))
+            if messages:
+                self.publisher.publish_many(messages)
+            last = now
+            await asyncio.sleep(tick)
+        return time.perf_counter() - started
+
+    async def stop(self, timeout: float):
+        """wait for replies still in flight, then stop"""
+        deadline = time.perf_counter() + timeout
+        while any(self.pending.values()) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        self.publisher.close()
+        await self._consumer.stop()
+
+    def unanswered(self) -> int:
+        return sum(len(pending) for pending in self.pending.values())
+
+
+def declare(connection, queues: list[Queue]):
+    """declare queues before traffic starts, consumers declare them only when their thread is up"""
+    with connection.clone() as conn:
+        channel = conn.default_channel
+        for queue in queues:
+            queue(channel).declare()
+
+
+def make_devices(count: int, device_types: list[str], seed: int = 0) -> dict[str, list[str]]:
+    """`count` devices spread evenly across types, uid is 12 hex digits like MAC address"""
+    rnd = random.Random(seed)
+    devices = defaultdict(list)
+    for i in range(count):
+        devices[device_types[i % len(device_types)]].append(f'{rnd.getrandbits(48):012x}')
+    return dict(devices)
+
+
+def loadgen_config(uri: str, embedded: bool) -> MQConfig:
+    """MQConfig for given broker, with queues of the server if it runs in this process"""
+    config = MQConfig(uri)
+    # memory:// опрашивает очереди раз в секунду по умолчанию
+    config.conn.transport_options.setdefault('polling_interval', 0.001)
+    config.init_mqtt_exchange()
+    if embedded:
+        config.init_transport_queues()
+        config.init_internal_queues()
+    return config
+
+
+def echo_dispatch(publisher: BatchPublisher, exchange: Exchange, datahold: dict | None = None) -> DispatchTable:
+    """server stand-in for embedded mode: answers every cup right away, without DB"""
+    table = DispatchTable()
+    datahold = datahold or {'loadgen': True}
+
+    async def echo_config(message: DeviceMessage, delivery: Delivery):
+        payload = {'timestamp': int(time.time()), 'task_id': 'loadgen', 'datahold': datahold}
+        publisher.publish(payload, exchange, f'{message.device_type}.{message.device_uid}.cup')
+
+    table.register(table.smart_types | table.simple_types, ['cup'], echo_config)
+    return table
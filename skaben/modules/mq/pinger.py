@@ -0,0 +1,100 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+from collections import deque
+
+from skabenproto.packets import PING
+
+from skaben.modules.mq.interface import MQInterface
+
+
+class DriftStats:
+    """Difference between intended and actual tick time"""
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, drift: float):
+        self.count += 1
+        self.total += drift
+        self.max = max(self.max, drift)
+        self.recent.append(drift)
+
+    def report(self) -> dict:
+        ordered = sorted(self.recent)
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] if ordered else 0.0
+        return {
+            'ticks': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'p99_ms': round(p99 * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+        }
+
+
+class PingScheduler:
+    """Sends PING to every topic on its own jittered interval
+
+       topics start at random phase, so devices of different types do not reply
+       at the same moment. Next tick is scheduled from the intended time, not from
+       the actual one, so drift does not accumulate.
+    """
+
+    def __init__(self,
+                 interface: MQInterface,
+                 intervals: dict[str, float],
+                 jitter: float = 0.1,
+                 report_interval: float = 60.0):
+        self.interface = interface
+        self.intervals = intervals
+        self.jitter = jitter
+        self.report_interval = report_interval
+        self.drift = {topic: DriftStats() for topic in intervals}
+        self._heap: list[tuple[float, str]] = []
+
+    def schedule(self, now: float):
+        self._heap = [(now + random.uniform(0, interval), topic) for topic, interval in self.intervals.items()]
+        heapq.heapify(self._heap)
+
+    def next_time(self, intended: float, topic: str, now: float) -> float:
+        interval = self.intervals[topic]
+        next_at = intended + interval * (1 + random.uniform(-self.jitter, self.jitter))
+        if next_at <= now:
+            # процесс стоял дольше интервала - пропущенные пинги не досылаем
+            next_at += interval * ((now - next_at) // interval + 1)
+        return next_at
+
+    def due(self, now: float) -> list[str]:
+        """pop topics which should be pinged now and reschedule them"""
+        topics = []
+        while self._heap and self._heap[0][0] <= now:
+            intended, topic = heapq.heappop(self._heap)
+            self.drift[topic].add(now - intended)
+            topics.append(topic)
+            heapq.heappush(self._heap, (self.next_time(intended, topic, now), topic))
+        return topics
+
+    def tick(self, now: float):
+        topics = self.due(now)
+        if topics:
+            timestamp = int(time.time())
+            self.interface.send_mqtt_many(PING(topic, timestamp=timestamp) for topic in topics)
+
+    def report(self) -> dict:
+        return {topic: stats.report() for topic, stats in self.drift.items()}
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.schedule(loop.time())
+        next_report = loop.time() + self.report_interval
+        while True:
+            await asyncio.sleep(max(0.0, self._heap[0][0] - loop.time()))
+            now = loop.time()
+            self.tick(now)
+            if now >= next_report:
+                next_report = now + self.report_interval
+                logging.info(f'pinger drift: {self.report()}')
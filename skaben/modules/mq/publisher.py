@@ -0,0 +1,190 @@
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Any, Iterable
+
+from kombu import Connection, Exchange, Producer
+
+from skaben.config import get_settings
+from skaben.modules.mq.config import MQConfig
+
+
+class MessageNacked(Exception):
+    """broker refused to accept the message"""
+
+
+class PublisherClosed(Exception):
+    """message was published after the publisher was closed"""
+
+
+class BatchPublisher:
+    """Long-lived batched publisher
+
+       messages are buffered and sent from a background thread when the batch
+       is full or `flush_interval` is over. One channel with publisher confirms is
+       kept for the whole batch, every publish returns a Future resolved when
+       broker confirms the message (or when it is written, if transport has no confirms).
+
+       delivery is at-least-once: if connection is lost, the batch is sent once more
+       without the confirmed messages, and those written but not confirmed yet may reach
+       the broker twice. Configs, pings and cache invalidations are safe to repeat.
+       After `close` messages are not accepted, their futures fail with PublisherClosed
+    """
+
+    def __init__(self,
+                 connection: Connection,
+                 max_batch: int | None = None,
+                 flush_interval: float | None = None,
+                 confirm_timeout: float | None = None):
+        self.connection = connection
+        settings = get_settings()
+        self.max_batch = max_batch or settings.amqp.publish_batch
+        self.flush_interval = flush_interval or settings.amqp.publish_interval
+        self.confirm_timeout = confirm_timeout or settings.amqp.timeout
+        self.confirms = getattr(connection.transport, 'driver_type', '') == 'amqp'
+        self._buffer: list = []
+        self._buffer_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._channel = None
+        self._producers: dict = {}
+        self._unconfirmed: dict[int, Future] = {}
+        self._next_tag = 1
+        self._thread = threading.Thread(target=self._run, name='mq-publisher', daemon=True)
+        self._thread.start()
+
+    def publish(self, body: Any, exchange: Exchange | str, routing_key: str) -> Future:
+        """add message to the batch"""
+        future = Future()
+        with self._buffer_lock:
+            if self._closed:
+                future.set_exception(PublisherClosed(f'cannot publish {routing_key}, publisher is closed'))
+                return future
+            self._buffer.append((body, exchange, routing_key, future))
+            full = len(self._buffer) >= self.max_batch
+        if full:
+            self._wakeup.set()
+        return future
+
+    def publish_many(self, messages: Iterable[tuple]) -> list[Future]:
+        """add (body, exchange, routing_key) messages to the batch at once"""
+        batch = [(body, exchange, routing_key, Future()) for body, exchange, routing_key in messages]
+        with self._buffer_lock:
+            if self._closed:
+                self._fail(batch, PublisherClosed(f'cannot publish {len(batch)} messages, publisher is closed'))
+                return [item[-1] for item in batch]
+            self._buffer.extend(batch)
+            full = len(self._buffer) >= self.max_batch
+        if full:
+            self._wakeup.set()
+        return [item[-1] for item in batch]
+
+    def flush(self):
+        """send everything buffered and wait for confirms in the calling thread"""
+        with self._buffer_lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            with self._io_lock:
+                self._send(batch)
+
+    def close(self):
+        with self._buffer_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=self.confirm_timeout)
+        self.flush()
+        self.connection.release()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f'publisher flush failed: {e}')
+
+    def _producer(self) -> Producer:
+        if self._channel is None:
+            self.connection.ensure_connection(max_retries=3)
+            self._channel = self.connection.channel()
+            self._next_tag = 1
+            if self.confirms:
+                self._channel.confirm_select()
+                self._channel.events['basic_ack'].add(self._on_ack)
+                self._channel.events['basic_nack'].add(self._on_nack)
+        key = id(self._channel)
+        if key not in self._producers:
+            self._producers = {key: Producer(self._channel, auto_declare=False)}
+        return self._producers[key]
+
+    def _send(self, batch: list, attempt: int = 0):
+        sent = 0
+        try:
+            producer = self._producer()
+            for body, exchange, routing_key, future in batch:
+                producer.publish(body, exchange=exchange, routing_key=routing_key)
+                sent += 1
+                if self.confirms:
+                    self._unconfirmed[self._next_tag] = future
+                    self._next_tag += 1
+                else:
+                    future.set_result(True)
+            self._wait_confirms()
+        except self.connection.recoverable_connection_errors + self.connection.recoverable_channel_errors as e:
+            self._reset()
+            if attempt < 1:
+                # неподтвержденные сообщения могли дойти до брокера - повтор может их продублировать
+                logging.error(f'connection lost while publishing, retrying batch of {len(batch)}: {e}')
+                return self._send([item for item in batch if not item[-1].done()], attempt + 1)
+            self._fail(batch, e)
+        except Exception as e:
+            logging.error(f'exception occured when sending batch of {len(batch)} ({sent} sent): {e}')
+            self._reset()
+            self._fail(batch, e)
+
+    def _wait_confirms(self):
+        deadline = time.monotonic() + self.confirm_timeout
+        while self._unconfirmed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'{len(self._unconfirmed)} messages were not confirmed by broker')
+            self.connection.drain_events(timeout=remaining)
+
+    def _on_ack(self, delivery_tag: int, multiple: bool):
+        for tag in self._settled_tags(delivery_tag, multiple):
+            self._unconfirmed.pop(tag).set_result(True)
+
+    def _on_nack(self, delivery_tag: int, multiple: bool):
+        for tag in self._settled_tags(delivery_tag, multiple):
+            self._unconfirmed.pop(tag).set_exception(MessageNacked(f'message {tag} was nacked by broker'))
+
+    def _settled_tags(self, delivery_tag: int, multiple: bool) -> list[int]:
+        if not multiple:
+            return [delivery_tag] if delivery_tag in self._unconfirmed else []
+        return [tag for tag in self._unconfirmed if tag <= delivery_tag]
+
+    def _reset(self):
+        self._channel = None
+        self._producers = {}
+        self._unconfirmed = {}
+        self.connection.collect()
+
+    @staticmethod
+    def _fail(batch: list, exc: Exception):
+        for *_, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+
+
+@lru_cache()
+def get_publisher(config: MQConfig) -> BatchPublisher:
+    publisher = BatchPublisher(config.conn.clone())
+    atexit.register(publisher.close)
+    return publisher
@@ -1,30 +1,159 @@
-import time
+import asyncio
+import os
 import typer
 import logging
 
-from skabenproto.packets import PING
+from typing import List
 
+from skaben import metrics
 from skaben.config import get_settings
-from skaben.modules.mq.interface import MQInterface
-from skaben.modules.mq.config import get_mq_config
 from skaben.modules.core.devices import DeviceEnum, SmartDeviceEnum
 
-settings = get_settings()
-mq_config = get_mq_config()
-
 mq_app = typer.Typer()
 
 
+def parse_intervals(items: List[str], topics: List[str], default: float) -> dict[str, float]:
+    """`topic=seconds` overrides of ping interval, only device topics and positive intervals"""
+    intervals = {topic: default for topic in topics}
+    for item in items:
+        topic, _, seconds = item.partition('=')
+        if topic not in intervals:
+            raise typer.BadParameter(f'unknown topic `{topic}`, expected one of: {", ".join(topics)}',
+                                     param_hint='--interval')
+        try:
+            intervals[topic] = float(seconds)
+        except ValueError:
+            raise typer.BadParameter(f'`{item}` is not `topic=seconds`', param_hint='--interval')
+        if not intervals[topic] > 0:
+            raise typer.BadParameter(f'interval of `{topic}` should be positive, got {seconds}',
+                                     param_hint='--interval')
+    return intervals
+
+
 @mq_app.command(name="ping")
-def ping_devices():
-    running = True
-    interface = MQInterface(mq_config)
+def ping_devices(interval: List[str] = typer.Option([], help="per-topic interval override, e.g. `lock=3`"),
+                 jitter: float = typer.Option(None, help="interval jitter, fraction, default from settings")):
+    """send PING to every device topic on its own jittered interval"""
+    from skaben.modules.mq.config import get_mq_config
+    from skaben.modules.mq.interface import MQInterface
+    from skaben.modules.mq.pinger import PingScheduler
+
+    settings = get_settings()
+    jitter = settings.app.ping_jitter if jitter is None else jitter
     topics = [e.value for e in DeviceEnum] + [e.value for e in SmartDeviceEnum]
-    message = f'[+] start pinger with interval {settings.amqp.timeout} for topics: {", ".join(topics)}'
+    intervals = parse_intervals(interval, topics, float(settings.amqp.timeout))
+    interface = MQInterface(get_mq_config())
+    message = f'[+] start pinger with intervals {intervals} and jitter {jitter}'
     typer.echo(message)
     logging.info(message)
-    while running:
-        for topic in topics:
-            packet = PING(topic, timestamp=int(time.time()))
-            interface.send_mqtt_skaben(packet)
-        time.sleep(settings.amqp.timeout)
+    scheduler = PingScheduler(interface, intervals, jitter=jitter)
+    try:
+        asyncio.run(scheduler.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        typer.echo(f'[+] pinger drift: {scheduler.report()}')
+
+
+@mq_app.command(name="loadgen")
+def loadgen(devices: int = typer.Option(1000, help="number of virtual devices of all types"),
+            duration: float = typer.Option(30.0, help="seconds to generate traffic"),
+            sup: float = typer.Option(0.2, help="sup messages per device per second"),
+            cup: float = typer.Option(0.02, help="config requests per device per second"),
+            info: float = typer.Option(0.0, help="info messages per device per second"),
+            uri: str = typer.Option(None, help="broker uri, e.g. memory://, default from settings"),
+            embedded: bool = typer.Option(False, help="run consumer answering cup in this process"),
+            ping: float = typer.Option(0.0, help="with --embedded: ping every device type each N seconds"),
+            timeout: float = typer.Option(5.0, help="seconds to wait for replies after traffic stops")):
+    """simulate a fleet of devices and measure server response latency"""
+    from skaben.modules.mq.consumer import create_consumer
+    from skaben.modules.mq.handlers import MessageHandler
+    from skaben.modules.mq.interface import MQInterface
+    from skaben.modules.mq.loadgen import VirtualFleet, declare, echo_dispatch, loadgen_config, make_devices
+    from skaben.modules.mq.pinger import PingScheduler
+    from skaben.modules.mq.publisher import BatchPublisher
+
+    uri = uri or get_settings().amqp_uri
+    if uri.startswith('memory') and not embedded:
+        raise typer.BadParameter('memory:// transport is process-local, use it with --embedded')
+    config = loadgen_config(uri, embedded)
+    smart = [e.value for e in SmartDeviceEnum]
+    fleet = VirtualFleet(config.conn,
+                         config.exchanges['mqtt'],
+                         make_devices(devices, smart + [e.value for e in DeviceEnum]),
+                         {command: rate for command, rate in (('sup', sup), ('cup', cup), ('info', info)) if rate},
+                         smart_types=frozenset(smart))
+
+    async def main():
+        background = []
+        if embedded:
+            publisher = BatchPublisher(config.conn.clone())
+            handler = MessageHandler(config, dispatch=echo_dispatch(publisher, config.exchanges['mqtt']))
+            server = create_consumer(config, handler.handle)
+            declare(config.conn, server.queues)
+            await server.start()
+            if ping:
+                scheduler = PingScheduler(MQInterface(config, publisher), dict.fromkeys(fleet.devices, ping))
+                background.append(asyncio.create_task(scheduler.run()))
+        elapsed = await fleet.run(duration)
+        await fleet.stop(timeout)
+        for task in background:
+            task.cancel()
+        if embedded:
+            await server.stop()
+            publisher.close()
+        return elapsed
+
+    typer.echo(f'[+] {devices} devices, {duration}s of traffic to {uri}{" (embedded consumer)" if embedded else ""}')
+    elapsed = asyncio.run(main())
+    sent, received = sum(fleet.sent.values()), sum(fleet.received.values())
+    typer.echo(f'[+] sent {sent} ({sent / elapsed:.1f}/s): {dict(fleet.sent)}')
+    typer.echo(f'[+] received {received} ({received / elapsed:.1f}/s): {dict(fleet.received)}')
+    latency = fleet.latency
+    typer.echo(f'[+] cup -> CUP latency: answered {len(latency)}, unanswered {fleet.unanswered()}, '
+               f'p50 {latency.percentile(50):.2f}ms p95 {latency.percentile(95):.2f}ms '
+               f'p99 {latency.percentile(99):.2f}ms')
+    typer.echo(latency.render())
+
+
+@mq_app.command(name="consume")
+def consume():
+    """run asyncio consumer for transport and internal queues"""
+    from skaben.modules.mq.config import get_mq_config
+    from skaben.modules.mq.consumer import serve
+    from skaben.modules.mq.workers import build_server
+
+    mq_config = get_mq_config()
+    consumer, background = build_server(mq_config, mq_config.queues.values())
+    port = get_settings().app.metrics_port
+    if port:
+        background.append(metrics.serve(port))
+    typer.echo(f'[+] start consumer with prefetch {consumer.prefetch} '
+               f'and concurrency {consumer.concurrency} for queues: {", ".join(mq_config.queues)}')
+    asyncio.run(serve(consumer, *background))
+
+
+@mq_app.command(name="workers")
+def workers(shards: int = typer.Option(None, help="worker processes, default from settings or number of CPUs")):
+    """route device messages by uid to per-shard consumer processes"""
+    from skaben.modules.mq.config import get_mq_config
+    from skaben.modules.mq.consumer import serve
+    from skaben.modules.mq.workers import ShardRouter, WorkerSupervisor
+
+    settings = get_settings()
+    shards = shards or settings.amqp.shards or os.cpu_count()
+    mq_config = get_mq_config()
+    router = ShardRouter(mq_config, shards)
+    consumer = router.create_consumer()
+    supervisor = WorkerSupervisor(shards)
+    typer.echo(f'[+] start router for queues {", ".join(q.name for q in consumer.queues)} and {shards} workers')
+    supervisor.start()
+    try:
+        jobs = [supervisor.watch()]
+        if settings.app.metrics_port:
+            jobs.append(metrics.serve(settings.app.metrics_port))
+        asyncio.run(serve(consumer, *jobs))
+    finally:
+        # роутер уже остановлен, обработчики дочитывают свои очереди
+        supervisor.stop(timeout=settings.amqp.drain_timeout * 3)
+        typer.echo(f'[+] workers stopped, restarts: {supervisor.restarts}')
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+
+from skabenproto.packets import CUP
+from sqlalchemy import select
+
+from skaben.models.device import SimpleConfig
+from skaben.modules.core.devices import DeviceEnum
+from skaben.modules.mq.config import MQConfig
+from skaben.modules.mq.interface import MQInterface
+from skaben.modules.state import methods
+from skaben.modules.state.cache import COUNTER, STATE, STATES, StateCache
+from skaben.modules.state.thresholds import ThresholdIndex
+
+SCALE = DeviceEnum.SCALE.value
+# типы, которые получают конфигурацию только через общий топик <type>.all.cup
+ALL_ONLY = frozenset((DeviceEnum.POWER.value, SCALE))
+
+
+def scale_config(index: ThresholdIndex, counter: int, state_name: str) -> dict:
+    """borders are thresholds of in-game states, level is counter clamped to them"""
+    borders = [state.threshold for state in index.ingame()]
+    level = min(max(counter, borders[0]), borders[-1]) if borders else counter
+    return {'borders': borders, 'level': level, 'state': state_name}
+
+
+class SimpleConfigBroadcast(MQInterface):
+    """CUP payloads of simple devices (pwr, rgb, scl) for the current alert state
+
+       payloads are built once per alert state or counter transition and sent
+       to `<type>.all.cup` topics in one batch, only for types whose config changed.
+       CUP requests of single devices are answered from the same snapshot.
+       With `broadcast=False` snapshot is only kept up to date, so several
+       worker processes don't send the same `all` payloads
+    """
+
+    def __init__(self, config: MQConfig, session_factory, broadcast: bool = True):
+        super().__init__(config)
+        self.session_factory = session_factory
+        self.broadcast = broadcast
+        self.device_types = tuple(e.value for e in DeviceEnum)
+        self.payloads: dict[str, dict] = {}
+        # datahold, из которого собран payload: формат payload задает CUP
+        self._dataholds: dict[str, dict] = {}
+        self.builds = 0
+        self._configs: dict[str, dict] = {}
+        self._pending: set = set()
+        self._task: asyncio.Task | None = None
+
+    def attach(self, state_cache: StateCache):
+        """rebuild snapshot on alert state and counter changes, including ones from other workers"""
+        state_cache.listeners.append(self.on_state_invalidated)
+
+    def on_state_invalidated(self, scopes: tuple):
+        scopes = {scope for scope in scopes if scope in (STATE, STATES, COUNTER)}
+        if not scopes:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._pending |= scopes
+        if not self._task or self._task.done():
+            self._task = loop.create_task(self._refresh_pending())
+
+    async def _refresh_pending(self):
+        # изменения, пришедшие во время сборки, собираются в одну следующую сборку
+        while self._pending:
+            scopes, self._pending = self._pending, set()
+            try:
+                await self.refresh(scopes)
+            except Exception as e:
+                logging.error(f'cannot broadcast simple device configs: {e}')
+
+    async def build(self, scopes=(STATE,)) -> dict[str, dict]:
+        """rebuild payloads, returns only changed ones
+
+           per-type configs are loaded from DB only when alert state is changed,
+           counter change rebuilds scale payload from cached counter and thresholds
+        """
+        async with self.session_factory() as session:
+            try:
+                current = await methods.get_current_state(session)
+            except ValueError:
+                logging.error('current alert state is not set, simple devices are not configured')
+                return {}
+            if STATE in scopes or STATES in scopes or not self.payloads:
+                result = await session.execute(select(SimpleConfig).where(SimpleConfig.state_id == current.uuid))
+                self._configs = {item.device_type: item.config for item in result.scalars()}
+            last_counter = await methods.get_last_counter(session)
+            index = await methods.get_threshold_index(session)
+
+        configs = dict(self._configs)
+        configs[SCALE] = scale_config(index, last_counter.value if last_counter else 0, current.name)
+        timestamp = int(time.time())
+        changed = {}
+        for device_type in self.device_types:
+            datahold = configs.get(device_type)
+            if not datahold:
+                self.payloads.pop(device_type, None)
+                self._dataholds.pop(device_type, None)
+                continue
+            if device_type in self.payloads and self._dataholds.get(device_type) == datahold:
+                continue
+            packet = CUP(topic=device_type, uid='all', datahold=datahold, task_id='simple', timestamp=timestamp)
+            changed[device_type] = self.payloads[device_type] = packet.payload
+            self._dataholds[device_type] = datahold
+        self.builds += 1
+        return changed
+
+    def publish(self, payloads: dict[str, dict]):
+        """send payloads to `all` topics as one batch"""
+        exchange = self.config.exchanges.get('mqtt')
+        return self.publisher.publish_many((payload, exchange, f'{device_type}.all.cup')
+                                           for device_type, payload in payloads.items())
+
+    async def refresh(self, scopes=(STATE,)):
+        changed = await self.build(scopes)
+        if changed and self.broadcast:
+            logging.info(f'broadcasting simple device configs: {", ".join(changed)}')
+            self.publish(changed)
+
+    async def send(self, device_type: str, device_uid: str):
+        """answer CUP of single simple device from snapshot"""
+        if not self.payloads:
+            await self.refresh()
+        payload = self.payloads.get(device_type)
+        if not payload:
+            return
+        device_uid = 'all' if device_type in ALL_ONLY else device_uid
+        return self._publish(payload,
+                             exchange=self.config.exchanges.get('mqtt'),
+                             routing_key=f'{device_type}.{device_uid}.cup')
@@ -0,0 +1,246 @@
+"""Device messages handled by several worker processes
+
+   router consumes transport queues and republishes every message to
+   `shards` exchange with `<routing key>.shard.<n>`, where n is picked by
+   consistent hashing of device uid. Worker n consumes `shard.<n>` queue only,
+   so all messages of a device are handled by one process in order they came.
+
+   on stop router is drained first, then workers empty their queues before
+   exit, so shard count can be changed between runs. Queues left by a previous
+   run with more shards are re-routed by the router on start.
+"""
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+from functools import lru_cache
+from typing import Iterable
+
+from kombu import Queue
+
+from skaben import metrics
+from skaben.config import get_settings
+from skaben.modules.mq.broker import Delivery, KombuBroker
+from skaben.modules.mq.config import INTERNAL_QUEUES, SHARD_EXCHANGE, TRANSPORT_QUEUES, MQConfig, MQFactory
+from skaben.modules.mq.consumer import AsyncConsumer, serve
+from skaben.modules.mq.dispatch import split_routing_key
+from skaben.modules.mq.interface import MQInterface
+
+SHARD_SEPARATOR = '.shard.'
+# точек на кольце для каждого шарда: чем больше, тем ровнее распределение
+REPLICAS = 128
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of keys to nodes
+
+       adding or removing a node moves only keys of that node (about 1/N of all keys)
+    """
+
+    def __init__(self, nodes: Iterable[int], replicas: int = REPLICAS):
+        points = sorted((_hash(f'{node}:{replica}'), node) for node in nodes for replica in range(replicas))
+        if not points:
+            raise ValueError('hash ring needs at least one node')
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+        self.nodes = sorted(set(self._nodes))
+        # uid устройств повторяются в каждом сообщении
+        self.get = lru_cache(maxsize=65536)(self._get)
+
+    def _get(self, key: str) -> int:
+        return self._nodes[bisect.bisect(self._points, _hash(key)) % len(self._points)]
+
+
+def shard_key(routing_key: str, shard: int) -> str:
+    return f'{routing_key}{SHARD_SEPARATOR}{shard}'
+
+
+def unshard(routing_key: str) -> str:
+    """original routing key of message republished by router"""
+    key, separator, _ = routing_key.rpartition(SHARD_SEPARATOR)
+    return key if separator else routing_key
+
+
+def unsharded(handle):
+    """wrap consumer handler, so it sees `ask.<type>.<uid>.<cmd>` routing keys"""
+    async def wrapper(delivery: Delivery):
+        delivery.delivery_info['routing_key'] = unshard(delivery.routing_key)
+        return await handle(delivery)
+    return wrapper
+
+
+class ShardRouter(MQInterface):
+    """Republishes device messages to shard queues by device uid
+
+       message is acked only after broker confirmed the copy, so it is
+       either in transport queue or in shard queue at any moment
+    """
+
+    def __init__(self, config: MQConfig, shards: int, publisher=None):
+        super().__init__(config, publisher)
+        self.shards = shards
+        self.ring = HashRing(range(shards))
+        if len(config.shard_queues) != shards:
+            config.init_shard_queues(shards)
+        self.exchange = config.exchanges[SHARD_EXCHANGE]
+
+    def shard_for(self, routing_key: str) -> int:
+        try:
+            device_uid = split_routing_key(routing_key)[1]
+        except ValueError:
+            device_uid = routing_key
+        return self.ring.get(device_uid)
+
+    async def handle(self, delivery: Delivery):
+        routing_key = unshard(delivery.routing_key)
+        body = delivery.body.encode() if isinstance(delivery.body, str) else delivery.body
+        future = self.publisher.publish(body, exchange=self.exchange,
+                                        routing_key=shard_key(routing_key, self.shard_for(routing_key)))
+        await asyncio.wrap_future(future)
+
+    def stale_queues(self) -> list[Queue]:
+        """shard queues beyond current shard count, left by previous run"""
+        found = []
+        shard = self.shards
+        while True:
+            queue = MQFactory.create_queue(f'shard.{shard}', self.exchange)
+            with self.config.conn.clone() as conn:
+                try:
+                    conn.default_channel.queue_declare(queue.name, passive=True)
+                except conn.channel_errors:
+                    return found
+            found.append(queue)
+            shard += 1
+
+    def create_consumer(self, **kwargs) -> AsyncConsumer:
+        queues = [self.config.queues[name] for name in TRANSPORT_QUEUES if name in self.config.queues]
+        stale = self.stale_queues()
+        if stale:
+            logging.warning(f're-routing queues left by previous run: {", ".join(q.name for q in stale)}')
+        return AsyncConsumer(KombuBroker(self.config.conn.clone()), self.handle, queues + stale, **kwargs)
+
+
+def queue_depth(config: MQConfig, queue: Queue) -> int:
+    with config.channel() as channel:
+        return queue(channel).queue_declare(passive=True).message_count
+
+
+async def wait_drained(config: MQConfig, queue: Queue, consumer: AsyncConsumer, timeout: float):
+    """keep consuming until shard queue is empty, router is stopped before workers"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        if not consumer.in_flight and not consumer.broker.pending():
+            if not await loop.run_in_executor(None, queue_depth, config, queue):
+                return
+        await asyncio.sleep(0.1)
+    logging.error(f'{queue.name} is not empty after {timeout}s, messages will be re-routed on next start')
+
+
+def build_server(config: MQConfig, queues: Iterable[Queue], wrap=None, broadcast: bool = True, cache_sync: bool = True):
+    """MessageHandler stack of a consumer process: (consumer, background jobs)
+
+       `cache_sync` - listen for StateCache invalidations, off if the process already does it
+    """
+    from skaben.database import async_session
+    from skaben.modules.core.configs import get_config_cache
+    from skaben.modules.core.persistence import WriteBehindSaver
+    from skaben.modules.core.presence import get_presence_index, run_presence
+    from skaben.modules.mq.broadcast import CacheBroadcast
+    from skaben.modules.mq.dedup import create_filter
+    from skaben.modules.mq.handlers import MessageHandler
+    from skaben.modules.mq.ingress import create_ingress
+    from skaben.modules.mq.simple import SimpleConfigBroadcast
+    from skaben.modules.state.cache import get_state_cache
+    from skaben.modules.state.retention import compaction_job
+
+    presence = get_presence_index()
+    configs = get_config_cache()
+    configs.attach(get_state_cache())
+    saver = WriteBehindSaver(async_session, configs=configs)
+    simple = SimpleConfigBroadcast(config, async_session, broadcast=broadcast)
+    simple.attach(get_state_cache())
+    handler = MessageHandler(config, presence=presence, saver=saver, configs=configs, simple=simple,
+                             dedup=create_filter(), ingress=create_ingress())
+    consumer = AsyncConsumer(KombuBroker(config.conn.clone()), wrap(handler.handle) if wrap else handler.handle, queues)
+    consumer.drain_hooks += [handler.drain, saver.flush]
+    background = [run_presence(presence, async_session, get_settings().app.presence_flush),
+                  saver.run(),
+                  # начальная рассылка конфигурации простым устройствам
+                  simple.refresh(),
+                  *handler.background()]
+    if cache_sync:
+        background.append(CacheBroadcast(config, get_state_cache()).run())
+    compaction = compaction_job(async_session) if broadcast else None
+    if compaction:
+        background.append(compaction)
+    return consumer, background
+
+
+def run_worker(shard: int, shards: int):
+    """worker process entry point, shard 0 also consumes internal queues and broadcasts simple configs"""
+    from skaben.modules.mq.config import get_mq_config
+
+    config = get_mq_config()
+    queue = config.init_shard_queues(shards)[f'shard.{shard}']
+    queues = [queue]
+    if shard == 0:
+        queues += [config.queues[name] for name in INTERNAL_QUEUES if name in config.queues]
+    consumer, background = build_server(config, queues, wrap=unsharded, broadcast=shard == 0)
+    port = get_settings().app.metrics_port
+    if port:
+        # роутер отдает метрики на APP_METRICS_PORT, обработчики - на следующих портах
+        background.append(metrics.serve(port + 1 + shard))
+    logging.info(f'worker {shard}/{shards} consumes {", ".join(q.name for q in queues)}')
+
+    async def drain():
+        await wait_drained(config, queue, consumer, get_settings().amqp.drain_timeout)
+
+    asyncio.run(serve(consumer, *background, drain=drain))
+
+
+class WorkerSupervisor:
+    """Starts a worker process per shard and restarts those that died"""
+
+    def __init__(self, shards: int, target=run_worker):
+        self.shards = shards
+        self.target = target
+        self.processes: dict[int, multiprocessing.Process] = {}
+        self.restarts = 0
+        # kombu и asyncio не переживают fork, процессы запускаются с чистым интерпретатором
+        self._context = multiprocessing.get_context('spawn')
+
+    def spawn(self, shard: int):
+        process = self._context.Process(target=self.target, args=(shard, self.shards), name=f'mq-worker-{shard}')
+        process.start()
+        self.processes[shard] = process
+
+    def start(self):
+        for shard in range(self.shards):
+            self.spawn(shard)
+
+    async def watch(self, interval: float = 1.0):
+        while True:
+            await asyncio.sleep(interval)
+            for shard, process in list(self.processes.items()):
+                if not process.is_alive():
+                    logging.error(f'worker {shard} exited with code {process.exitcode}, restarting')
+                    self.restarts += 1
+                    self.spawn(shard)
+
+    def stop(self, timeout: float):
+        """SIGTERM to workers: each drains its queue and exits, stragglers are killed after `timeout`"""
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for shard, process in self.processes.items():
+            process.join(timeout)
+            if process.is_alive():
+                logging.error(f'worker {shard} did not stop in {timeout}s, killing')
+                process.kill()
+                process.join()
@@ -0,0 +1,66 @@
+import logging
+import time
+from functools import lru_cache
+from typing import Awaitable, Callable
+
+from skaben.config import get_settings
+
+# области кэша, которые сбрасываются при изменениях
+STATE = 'state'
+COUNTER = 'counter'
+# индекс порогов всех состояний (ThresholdIndex)
+STATES = 'states'
+# конфигурации устройств изменены не потребителем (API, загрузка из файла)
+DEVICES = 'devices'
+SCOPES = (STATE, COUNTER, STATES, DEVICES)
+
+
+class StateCache:
+    """Кэш текущего состояния и последнего значения счетчика тревоги
+
+       значения загружаются из БД при первом обращении и сбрасываются при записи,
+       а если сброс не дошел - через `max_age` секунд (0 - без срока).
+       `broadcast` рассылает сброс остальным процессам (см. mq.broadcast),
+       `listeners` вызываются после любого сброса, в том числе пришедшего извне
+    """
+
+    def __init__(self, max_age: float = 0):
+        self.max_age = max_age
+        self._values: dict = {}
+        self._versions: dict = {}
+        self.broadcast: Callable[[tuple], None] | None = None
+        self.listeners: list[Callable[[tuple], None]] = []
+
+    async def get(self, scope: str, loader: Callable[[], Awaitable]):
+        """вернуть значение из кэша или загрузить его `loader`"""
+        cached = self._values.get(scope)
+        if cached is not None and (not self.max_age or time.monotonic() < cached[1]):
+            return cached[0]
+        version = self._versions.get(scope, 0)
+        value = await loader()
+        # пока шел запрос, значение могли изменить - такой результат не кэшируем
+        if version == self._versions.get(scope, 0) and value is not None:
+            self._values[scope] = (value, time.monotonic() + self.max_age)
+        return value
+
+    def invalidate(self, *scopes: str, broadcast: bool = True):
+        """сбросить `scopes`, без них - все области"""
+        scopes = scopes or SCOPES
+        for scope in scopes:
+            self._values.pop(scope, None)
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+        if broadcast and self.broadcast:
+            try:
+                self.broadcast(scopes)
+            except Exception as e:
+                logging.error(f'cannot broadcast cache invalidation {scopes}: {e}')
+        for listener in self.listeners:
+            try:
+                listener(scopes)
+            except Exception as e:
+                logging.error(f'cache listener {listener} failed: {e}')
+
+
+@lru_cache()
+def get_state_cache() -> StateCache:
+    return StateCache(max_age=get_settings().app.state_cache_ttl)
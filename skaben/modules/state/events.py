@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from functools import lru_cache
+from typing import Awaitable, Callable
+
+from skaben import metrics
+from skaben.config import get_settings
+from skaben.modules.state.cache import COUNTER, STATE, StateCache
+
+DROPPED = metrics.counter('skaben_events_dropped', 'alert events dropped for slow subscribers')
+SUBSCRIBERS = metrics.counter('skaben_events_subscriptions', 'subscriptions to alert events')
+
+# события и области кэша, при сбросе которых они отправляются
+EVENT_SCOPES = {'counter': COUNTER, 'state': STATE}
+
+Loader = Callable[[], Awaitable[dict | None]]
+
+
+class Subscription:
+    """Bounded event queue of one subscriber, oldest events are dropped when it is full"""
+
+    def __init__(self, size: int):
+        self.events: deque[tuple[str, dict]] = deque(maxlen=size)
+        self.dropped = 0
+        self._ready = asyncio.Event()
+
+    def put(self, event: str, data: dict):
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+            DROPPED.inc()
+        self.events.append((event, data))
+        self._ready.set()
+
+    async def get(self, timeout: float | None = None) -> list[tuple[str, dict]]:
+        """all queued events, empty list if none came in `timeout` seconds"""
+        if not self._ready.is_set():
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._ready.clear()
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+
+class EventHub:
+    """Fan-out of alert counter and state changes to subscribers of one process
+
+       listens to StateCache invalidations, local and broadcast by other processes, so
+       a change made anywhere is loaded once per process and put to every subscription.
+       invalidations coming while event is loaded are merged into one reload
+    """
+
+    def __init__(self, loaders: dict[str, Loader], buffer: int = 100):
+        self.loaders = loaders
+        self.buffer = buffer
+        self.subscriptions: set[Subscription] = set()
+        self.last: dict[str, dict] = {}
+        self._dirty: set[str] = set()
+        self._task: asyncio.Task | None = None
+
+    def attach(self, cache: StateCache):
+        cache.listeners.append(self.invalidated)
+
+    def invalidated(self, scopes: tuple):
+        events = {event for event, scope in EVENT_SCOPES.items() if scope in scopes and event in self.loaders}
+        if not self.subscriptions:
+            # без подписчиков состояние загрузится при первой подписке
+            for event in events:
+                self.last.pop(event, None)
+            return
+        if not events:
+            return
+        self._dirty |= events
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._reload())
+
+    async def _reload(self):
+        while self._dirty:
+            event = self._dirty.pop()
+            try:
+                data = await self.loaders[event]()
+            except Exception as e:
+                logging.error(f'cannot load {event} event: {e}')
+                continue
+            if data is None or data == self.last.get(event):
+                continue
+            self.last[event] = data
+            for subscription in self.subscriptions:
+                subscription.put(event, data)
+
+    async def subscribe(self) -> Subscription:
+        """new subscription with current counter and state already queued"""
+        SUBSCRIBERS.inc()
+        subscription = Subscription(self.buffer)
+        self.subscriptions.add(subscription)
+        for event, load in self.loaders.items():
+            if event not in self.last:
+                try:
+                    data = await load()
+                except Exception as e:
+                    logging.error(f'cannot load {event} event: {e}')
+                    continue
+                if data is not None:
+                    self.last[event] = data
+            if event in self.last:
+                subscription.put(event, self.last[event])
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+async def stream_events(hub: EventHub, keepalive: float):
+    """Server-Sent Events of one subscriber, comment line every `keepalive` seconds keeps proxies from closing it"""
+    subscription = await hub.subscribe()
+    try:
+        while True:
+            events = await subscription.get(keepalive)
+            if not events:
+                yield ': keepalive\n\n'
+                continue
+            yield ''.join(format_sse(event, data) for event, data in events)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+async def load_counter() -> dict | None:
+    from skaben.database import readonly_session
+    from skaben.modules.state import methods
+    from skaben.schema.state import AlertCounterSchema
+
+    async with readonly_session() as session:
+        counter = await methods.get_last_counter(session)
+    return {name: getattr(counter, name) for name in AlertCounterSchema.__fields__} if counter else None
+
+
+async def load_state() -> dict | None:
+    from skaben.database import readonly_session
+    from skaben.modules.state import methods
+    from skaben.schema.state import StateSchema
+
+    async with readonly_session() as session:
+        try:
+            state = await methods.get_current_state(session)
+        except ValueError:
+            return None
+    return {name: getattr(state, name) for name in StateSchema.__fields__}
+
+
+@lru_cache()
+def get_event_hub() -> EventHub:
+    from skaben.modules.state.cache import get_state_cache
+
+    hub = EventHub({'counter': load_counter, 'state': load_state}, get_settings().app.events_buffer)
+    hub.attach(get_state_cache())
+    return hub
@@ -1,27 +1,117 @@
-from sqlalchemy import select, update
+from datetime import datetime
+from uuid import uuid4
+
+from sqlalchemy import exists, func, insert, literal, or_, select, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.exc import NoResultFound
 from skaben.database import AsyncSession
-from skaben.models.state import State, AlertCounter
-from skaben.schema.state import StateUpdateSchema, AlertCounterSchema, AlertCounterRelativeSchema
+from skaben.models.state import State, AlertCounter, AlertCounterRollup
+from skaben.schema.state import (
+    StateUpdateSchema, StateSnapshotSchema, AlertCounterSchema, AlertCounterRelativeSchema, AlertCounterBucketSchema
+)
+from skaben.modules.state.cache import STATE, STATES, COUNTER, get_state_cache
+from skaben.modules.state.thresholds import ThresholdIndex
+
+# ключ pg_advisory_xact_lock, сериализующий изменения счетчика тревоги
+COUNTER_LOCK = 0x5ca8e9
+
+
+async def get_last_counter(session: AsyncSession) -> AlertCounterSchema | None:
+    """Возвращает последнее значение счетчика тревоги
 
+       в кэше хранятся снимки схем, а не ORM-объекты: они общие для всех запросов
+    """
+    async def load():
+        stmt = select(AlertCounter).order_by(AlertCounter.timestamp.desc())
+        res = await session.execute(stmt)
+        counter = res.scalars().first()
+        return AlertCounterSchema.from_orm(counter) if counter else None
+
+    return await get_state_cache().get(COUNTER, load)
 
-async def get_last_counter(session: AsyncSession):
-    """Возвращает последнее значение счетчика тревоги"""
-    stmt = select(AlertCounter).order_by(AlertCounter.timestamp.desc())
-    res = await session.execute(stmt)
-    return res.scalars().first()
 
+def counter_buckets_query(interval: int, since: datetime, until: datetime):
+    """min/max/последнее значение и число записей счетчика в интервалах по `interval` секунд
 
-async def get_current_state(session: AsyncSession):
+       номер интервала - целая часть epoch / interval, выборка идет по индексу timestamp
+    """
+    bucket = func.floor(func.extract('epoch', AlertCounter.timestamp) / interval).label('bucket')
+    last = func.array_agg(aggregate_order_by(AlertCounter.value,
+                                             AlertCounter.timestamp.desc(),
+                                             AlertCounter.uuid.desc()))[1]
+    return select(bucket,
+                  func.min(AlertCounter.value),
+                  func.max(AlertCounter.value),
+                  last,
+                  func.count())\
+        .where(AlertCounter.timestamp >= since, AlertCounter.timestamp < until)\
+        .group_by(bucket)\
+        .order_by(bucket)
+
+
+def rollup_buckets_query(interval: int, since: datetime, until: datetime):
+    """то же по сжатой истории (см. retention): интервалы rollup входят в интервал по своему началу"""
+    bucket = func.floor(func.extract('epoch', AlertCounterRollup.start) / interval).label('bucket')
+    last = func.array_agg(aggregate_order_by(AlertCounterRollup.last, AlertCounterRollup.last_timestamp.desc()))[1]
+    return select(bucket,
+                  func.min(AlertCounterRollup.min),
+                  func.max(AlertCounterRollup.max),
+                  last,
+                  func.sum(AlertCounterRollup.count))\
+        .where(AlertCounterRollup.start >= since, AlertCounterRollup.start < until)\
+        .group_by(bucket)\
+        .order_by(bucket)
+
+
+async def get_counter_buckets(session: AsyncSession, interval: int, since: datetime, until: datetime):
+    """Возвращает агрегаты счетчика тревоги по интервалам времени, пустые интервалы пропускаются
+
+       сжатая история старше горизонта хранения дополняется свежими строками,
+       в общем интервале последнее значение берется из свежих
+    """
+    buckets = {}
+    for query in (rollup_buckets_query, counter_buckets_query):
+        for bucket, min_value, max_value, last, count in await session.execute(query(interval, since, until)):
+            bucket = int(bucket)
+            if bucket in buckets:
+                previous = buckets[bucket]
+                min_value, max_value = min(min_value, previous.min), max(max_value, previous.max)
+                count += previous.count
+            buckets[bucket] = AlertCounterBucketSchema(start=datetime.utcfromtimestamp(bucket * interval),
+                                                       min=min_value, max=max_value, last=last, count=count)
+    return [buckets[bucket] for bucket in sorted(buckets)]
+
+
+async def get_current_state(session: AsyncSession) -> StateSnapshotSchema:
     """Возвращает текущий уровень тревоги"""
-    stmt = select(State).where(State.current == True)
-    res = await session.execute(stmt)
-    current = res.scalars().one_or_none()
+    async def load():
+        stmt = select(State).where(State.current == True)
+        res = await session.execute(stmt)
+        state = res.scalars().one_or_none()
+        return StateSnapshotSchema.from_orm(state) if state else None
+
+    current = await get_state_cache().get(STATE, load)
     if not current:
         raise ValueError('Current state is not set')
     return current
 
 
+async def get_threshold_index(session: AsyncSession) -> ThresholdIndex:
+    """Возвращает индекс порогов состояний"""
+    async def load():
+        res = await session.execute(select(State))
+        return ThresholdIndex(StateSnapshotSchema.from_orm(state) for state in res.scalars())
+
+    return await get_state_cache().get(STATES, load)
+
+
+async def get_state_by_counter(session: AsyncSession, value: int) -> StateSnapshotSchema | None:
+    """Возвращает состояние, соответствующее значению счетчика"""
+    index = await get_threshold_index(session)
+    return index.lookup(value)
+
+
 async def update_state(session: AsyncSession, name: str, data: dict | StateUpdateSchema, auto: bool = True):
     """Обновляет глобальное состояние уровня тревоги
 
@@ -46,28 +136,81 @@ async def update_state(session: AsyncSession, name: str, data: dict | StateUpdat
     if auto:
         await set_counter_by_state_lower_threshold(session, state_instance)
     await session.commit()
+    get_state_cache().invalidate(STATE, STATES)
     return state_instance
 
 
 async def create_counter(session: AsyncSession, data: dict | AlertCounterSchema, auto: bool = True):
-    """Создает новое значение счетчика уровня тревоги"""
+    """Создает новое значение счетчика уровня тревоги
+
+       под тем же advisory lock и с тем же источником времени, что и change_counter,
+       иначе параллельное изменение могло бы оказаться после этой записи
+    """
     schema = AlertCounterSchema(**data) if isinstance(data, dict) else data
-    counter_instance = AlertCounter(**schema.dict())
-    if auto:
-        await switch_state_by_counter(session, counter_instance)
-    await counter_instance.save(session)
-    return counter_instance
+    await session.execute(select(func.pg_advisory_xact_lock(COUNTER_LOCK)))
+    stmt = insert(AlertCounter)\
+        .values(uuid=uuid4(),
+                value=schema.value,
+                comment=schema.comment,
+                timestamp=schema.timestamp or func.clock_timestamp())\
+        .returning(AlertCounter.value, AlertCounter.comment, AlertCounter.timestamp)
+    row = (await session.execute(stmt)).one()
+    switched = auto and await switch_state_by_value(session, row.value)
+    await session.commit()
+    get_state_cache().invalidate(*((COUNTER, STATE, STATES) if switched else (COUNTER,)))
+    return AlertCounterSchema(value=row.value, comment=row.comment, timestamp=row.timestamp)
 
 
 async def change_counter(session: AsyncSession, counter: AlertCounterRelativeSchema):
-    """Создает новое значение счетчика уровня тревоги на основании предыдущих"""
-    last_counter = await get_last_counter(session)
-    new_value = last_counter.value + counter.value if counter.increase else last_counter.value - counter.value
-    payload = counter.dict()
-    payload.update(value=new_value)
-    new_counter = AlertCounterSchema(**payload)
-    await create_counter(session, new_counter)
-    return new_counter
+    """Создает новое значение счетчика уровня тревоги на основании предыдущих
+
+       значение вычисляется и вставляется одним запросом под advisory lock,
+       переключение состояния выполняется в той же транзакции
+    """
+    delta = counter.value if counter.increase else -counter.value
+    await session.execute(select(func.pg_advisory_xact_lock(COUNTER_LOCK)))
+    last_value = select(AlertCounter.value)\
+        .order_by(AlertCounter.timestamp.desc(), AlertCounter.uuid.desc())\
+        .limit(1)\
+        .scalar_subquery()
+    # clock_timestamp, а не now(): транзакция могла начаться раньше той, что держала lock,
+    # и с временем начала транзакции новая запись оказалась бы не последней
+    values = select(literal(uuid4(), postgresql.UUID(as_uuid=True)),
+                    func.coalesce(last_value, 0) + delta,
+                    literal(counter.comment),
+                    func.clock_timestamp())
+    stmt = insert(AlertCounter)\
+        .from_select(['uuid', 'value', 'comment', 'timestamp'], values)\
+        .returning(AlertCounter.value, AlertCounter.comment, AlertCounter.timestamp)
+    row = (await session.execute(stmt)).one()
+    switched = await switch_state_by_value(session, row.value)
+    await session.commit()
+    get_state_cache().invalidate(*((COUNTER, STATE, STATES) if switched else (COUNTER,)))
+    return AlertCounterSchema(value=row.value, comment=row.comment, timestamp=row.timestamp)
+
+
+async def switch_state_by_value(session: AsyncSession, value: int) -> bool:
+    """Переключает глобальное состояние по значению счетчика без предварительного чтения
+
+       целевое состояние берется из индекса порогов, проверка текущего состояния
+       выполняется в самом UPDATE. Не коммитит, возвращает True, если состояние изменилось,
+       ValueError, если текущее состояние не задано
+    """
+    target = await get_state_by_counter(session, value)
+    if not target:
+        return False
+    current = State.__table__.alias('current_state')
+    stmt = update(State)\
+        .where(or_(State.current, State.name == target.name))\
+        .where(exists().where(current.c.current, current.c.threshold >= 0))\
+        .where(~exists().where(current.c.current, current.c.name == target.name))\
+        .values(current=State.name == target.name)\
+        .execution_options(synchronize_session=False)
+    result = await session.execute(stmt)
+    if not result.rowcount:
+        # ничего не переключили - возможно, потому что текущего состояния нет
+        await get_current_state(session)
+    return result.rowcount > 0
 
 
 async def set_counter_by_state_lower_threshold(session: AsyncSession, state_instance: State):
@@ -75,21 +218,6 @@ async def set_counter_by_state_lower_threshold(session: AsyncSession, state_inst
 
        Работает только для состояний "в игре" - т.е. с нижним порогом >= 0
     """
-    if state_instance.is_ingame():
+    if state_instance.is_ingame:
         schema = AlertCounterSchema(value=state_instance.threshold, comment=f"Auto-set by state {state_instance.name}")
         return await create_counter(session, schema, auto=False)
-
-
-async def switch_state_by_counter(session: AsyncSession, counter: AlertCounter):
-    """Переключает глобальное состояние по счетчику"""
-    current = await get_current_state(session)
-    if not current.is_ingame:
-        return
-
-    stmt = select(State).where(State.threshold <= counter.value).order_by(State.threshold.desc())
-    res = await session.execute(stmt)
-    state = res.scalars().first()
-    if not state:
-        return
-    if not state.current:
-        await update_state(session, state.name, {'current': True}, auto=False)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, func, select, tuple_
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert
+
+from skaben import metrics
+from skaben.config import get_settings
+from skaben.models.state import AlertCounter, AlertCounterRollup
+
+COMPACTED = metrics.counter('skaben_counter_compacted', 'alert counter rows moved to rollup table')
+
+
+def utc_start(epoch):
+    """timestamp without time zone из секунд epoch, как хранятся метки счетчика"""
+    return func.timezone('UTC', func.to_timestamp(epoch))
+
+
+def compact_batch_query(horizon: datetime, newest: tuple, interval: int, batch: int):
+    """один запрос: удалить до `batch` старейших строк счетчика и слить их агрегаты в rollup
+
+       возвращает число перенесенных строк. Последняя запись (`newest`) не трогается никогда,
+       иначе последнее значение счетчика было бы потеряно
+    """
+    victims = select(AlertCounter.uuid)\
+        .where(AlertCounter.timestamp < horizon, tuple_(AlertCounter.timestamp, AlertCounter.uuid) < newest)\
+        .order_by(AlertCounter.timestamp)\
+        .limit(batch)
+    # ORM-сущности в DML теряют add_cte при компиляции, поэтому таблицы
+    counters = AlertCounter.__table__
+    moved = delete(counters)\
+        .where(counters.c.uuid.in_(victims.scalar_subquery()))\
+        .returning(counters.c.value, counters.c.timestamp, counters.c.uuid)\
+        .cte('moved')
+    bucket = func.floor(func.extract('epoch', moved.c.timestamp) / interval)
+    rows = select(func.gen_random_uuid(),
+                  utc_start(bucket * interval),
+                  func.min(moved.c.value),
+                  func.max(moved.c.value),
+                  func.array_agg(aggregate_order_by(moved.c.value, moved.c.timestamp.desc(), moved.c.uuid.desc()))[1],
+                  func.max(moved.c.timestamp),
+                  func.count())\
+        .group_by(bucket)
+    stmt = insert(AlertCounterRollup.__table__)\
+        .from_select(['uuid', 'start', 'min', 'max', 'last', 'last_timestamp', 'count'], rows)
+    # интервал мог быть частично перенесен предыдущей пачкой
+    stored, new = AlertCounterRollup.__table__.c, stmt.excluded
+    stmt = stmt.on_conflict_do_update(index_elements=['start'], set_={
+        'min': func.least(stored['min'], new['min']),
+        'max': func.greatest(stored['max'], new['max']),
+        'last': case((new['last_timestamp'] >= stored['last_timestamp'], new['last']), else_=stored['last']),
+        'last_timestamp': func.greatest(stored['last_timestamp'], new['last_timestamp']),
+        'count': stored['count'] + new['count'],
+    })
+    return select(func.count()).select_from(moved).add_cte(stmt.cte('rolled'))
+
+
+async def compact_counters(session_factory, horizon: datetime, interval: int, batch: int,
+                           pause: float = 0.0) -> int:
+    """Переносит историю счетчика старше `horizon` в rollup по интервалам `interval` секунд
+
+       каждая пачка - отдельная короткая транзакция, запись новых значений счетчика
+       (advisory lock в change_counter) ими не блокируется. Возвращает число перенесенных строк
+    """
+    async with session_factory() as session:
+        newest = (await session.execute(
+            select(AlertCounter.timestamp, AlertCounter.uuid)
+            .order_by(AlertCounter.timestamp.desc(), AlertCounter.uuid.desc())
+            .limit(1))).first()
+    if not newest:
+        return 0
+    total = 0
+    while True:
+        async with session_factory() as session:
+            moved = (await session.execute(compact_batch_query(horizon, tuple(newest), interval, batch))).scalar()
+            await session.commit()
+        total += moved
+        COMPACTED.inc(moved)
+        if moved < batch:
+            return total
+        await asyncio.sleep(pause)
+
+
+async def run_compaction(session_factory, retention: float, interval: int, batch: int, every: float):
+    """периодическое сжатие истории счетчика старше `retention` часов"""
+    while True:
+        try:
+            horizon = datetime.utcnow() - timedelta(hours=retention)
+            moved = await compact_counters(session_factory, horizon, interval, batch, pause=0.1)
+            if moved:
+                logging.info(f'{moved} alert counter rows older than {horizon} compacted')
+        except Exception as e:
+            logging.error(f'alert counter compaction failed: {e}')
+        await asyncio.sleep(every)
+
+
+def compaction_job(session_factory):
+    """coroutine of background compaction with settings, None if retention is not set"""
+    settings = get_settings().app
+    if settings.counter_retention <= 0:
+        return None
+    return run_compaction(session_factory, settings.counter_retention, settings.compact_interval,
+                          settings.compact_batch, settings.compact_every)
@@ -0,0 +1,31 @@
+from bisect import bisect_right
+from typing import Iterable
+
+from skaben.schema.state import StateSnapshotSchema
+
+
+class ThresholdIndex:
+    """Состояния тревоги, отсортированные по нижнему порогу
+
+       поиск состояния по значению счетчика - бинарный поиск по массиву порогов,
+       тот же результат, что у `threshold <= :value ORDER BY threshold DESC`.
+       принимает снимки состояний (StateSnapshotSchema) или ORM State
+    """
+
+    def __init__(self, states: Iterable[StateSnapshotSchema]):
+        # состояние без порога в SQL не совпадает ни с одним значением счетчика
+        ordered = sorted((state for state in states if state.threshold is not None), key=lambda state: state.threshold)
+        self.states = ordered
+        self.thresholds = [state.threshold for state in ordered]
+
+    def lookup(self, value: int) -> StateSnapshotSchema | None:
+        """состояние с наибольшим порогом, не превышающим значение счетчика"""
+        idx = bisect_right(self.thresholds, value)
+        return self.states[idx - 1] if idx else None
+
+    def ingame(self) -> list[StateSnapshotSchema]:
+        """состояния "в игре" - с порогом >= 0"""
+        return self.states[bisect_right(self.thresholds, -1):]
+
+    def __len__(self):
+        return len(self.states)
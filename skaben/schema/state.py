@@ -22,6 +22,34 @@ class AlertCounterSchema(BaseModel):
         }
 
 
+class AlertCounterBucketSchema(BaseModel):
+    """Значения счетчика тревоги за интервал времени"""
+
+    start: datetime
+    min: int
+    max: int
+    last: int
+    count: int
+
+
+class AlertCounterRelativeSchema(BaseModel):
+    """Относительное изменение уровня тревоги"""
+
+    value: int
+    increase: bool = True
+    comment: str | None = 'changed by system'
+
+    class Config:
+        orm_mode = True
+        schema_extra = {
+            "example": {
+                "value": 10,
+                "increase": True,
+                "comment": "изменен мастером игры"
+            }
+        }
+
+
 class StateSchema(BaseModel):
     """Глобальный уровень состояния системы"""
 
@@ -54,3 +82,9 @@ class ResponseStateSchema(StateSchema):
     """Схема состояния с uuid"""
 
     uuid: str | UUID
+
+
+class StateSnapshotSchema(ResponseStateSchema):
+    """Снимок состояния из БД для кэша, описание может быть пустым"""
+
+    info: str | None
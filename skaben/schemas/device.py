@@ -1,4 +1,63 @@
 from uuid import UUID
 from pydantic import BaseModel, Field
 
-pass
\ No newline at end of file
+from skaben.modules.core.devices import SmartDeviceEnum
+
+
+class DevicePresenceSchema(BaseModel):
+    """Устройства одного типа в сети и не в сети"""
+
+    online: list[str] = Field(default_factory=list)
+    offline: list[str] = Field(default_factory=list)
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "online": ["aabbccddeeff"],
+                "offline": ["a1b2c3d4e5f6"]
+            }
+        }
+
+
+class DeviceImportErrorSchema(BaseModel):
+    """Строка файла импорта, которую не удалось загрузить"""
+
+    line: int
+    error: str
+
+
+class DeviceImportReportSchema(BaseModel):
+    """Результат импорта устройств"""
+
+    total: int
+    imported: int
+    failed: int
+    errors: list[DeviceImportErrorSchema] = Field(default_factory=list)
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "total": 3,
+                "imported": 2,
+                "failed": 1,
+                "errors": [{"line": 3, "error": "device_addr: not a MAC address: 12345"}]
+            }
+        }
+
+
+class LockSchema(BaseModel):
+    """Конфигурация замка, отправляемая устройству (CUP)"""
+
+    closed: bool = True
+    blocked: bool = False
+    sound: bool = True
+    timer: int = 10
+
+    class Config:
+        orm_mode = True
+
+
+# схемы конфигурации устройств по типу из топика MQ
+DEVICE_SCHEMAS = {
+    SmartDeviceEnum.LOCK.value: LockSchema,
+}
@@ -3,7 +3,7 @@ import pytest_asyncio
 from httpx import AsyncClient
 
 from skaben.database import engine
-from skaben.main import skaben
+from skaben.main import app
 from skaben.models.base import Base
 
 
@@ -25,10 +25,21 @@ async def start_db():
     await engine.dispose()
 
 
+@pytest_asyncio.fixture
+async def db():
+    """clean schema, test is skipped when database is not available"""
+    try:
+        await start_db()
+    except (OSError, ConnectionError) as e:
+        pytest.skip(f'database is not available: {e}')
+    yield
+    await engine.dispose()
+
+
 @pytest_asyncio.fixture
 async def client() -> AsyncClient:
     async with AsyncClient(
-        skaben=skaben,
+        app=app,
         base_url="http://testserver/v1",
         headers={"Content-Type": "application/json"},
     ) as client:
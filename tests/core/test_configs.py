@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pytest
+
+from skaben.modules.core.configs import ConfigEntry, DeviceConfigCache, config_hash
+from skaben.modules.mq.dispatch import DispatchTable
+from skaben.modules.mq.handlers import MessageHandler
+from skaben.modules.state.cache import COUNTER, STATE, StateCache
+
+
+class CountingCache(DeviceConfigCache):
+    def __init__(self):
+        super().__init__(session_factory=None)
+        self.loads = []
+
+    async def load(self, device_type, device_uid):
+        self.loads.append((device_type, device_uid))
+        if device_uid == 'unknown':
+            return None
+        return ConfigEntry({'closed': True, 'timer': 10})
+
+
+class FakePublisher:
+    def __init__(self):
+        self.sent = []
+
+    def publish(self, body, exchange, routing_key):
+        self.sent.append((routing_key, body))
+
+
+def test_config_hash_ignores_key_order():
+    assert config_hash({'a': 1, 'b': 2}) == config_hash({'b': 2, 'a': 1})
+    assert ConfigEntry({'a': 1}).datahold == {'a': 1, 'hash': config_hash({'a': 1})}
+
+
+@pytest.mark.asyncio
+async def test_cache_loads_device_once_including_missing():
+    cache = CountingCache()
+    for _ in range(3):
+        await cache.get('lock', 'aa')
+        assert await cache.get('lock', 'unknown') is None
+    assert cache.loads == [('lock', 'aa'), ('lock', 'unknown')]
+    cache.invalidate(('lock', 'aa'))
+    await cache.get('lock', 'aa')
+    assert len(cache.loads) == 3
+
+
+@pytest.mark.asyncio
+async def test_cache_cleared_by_alert_state_change():
+    cache = CountingCache()
+    state_cache = StateCache()
+    cache.attach(state_cache)
+    await cache.get('lock', 'aa')
+    state_cache.invalidate(COUNTER)
+    assert len(cache) == 1
+    state_cache.invalidate(STATE, broadcast=False)
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_cup_answered_only_when_hash_differs():
+    cache = CountingCache()
+    publisher = FakePublisher()
+    config = SimpleNamespace(exchanges={'mqtt': 'mqtt'})
+    handler = MessageHandler(config, dispatch=DispatchTable(), configs=cache)
+    handler._publisher = publisher
+    server_hash = (await cache.get('lock', 'aa')).hash
+
+    await handler.handle(SimpleNamespace(body={'hash': server_hash}, delivery_info={'routing_key': 'ask.lock.aa.cup'}))
+    assert publisher.sent == []
+
+    await handler.handle(SimpleNamespace(body={'hash': 'old'}, delivery_info={'routing_key': 'ask.lock.aa.cup'}))
+    (routing_key, body), = publisher.sent
+    assert routing_key == 'lock.aa.cup'
+    assert body['datahold']['hash'] == server_hash
+    assert cache.loads == [('lock', 'aa')]
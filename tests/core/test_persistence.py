@@ -0,0 +1,174 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.exc import DataError, OperationalError
+
+from skaben.modules.core import persistence
+from skaben.modules.core.configs import DeviceConfigCache
+from skaben.modules.core.persistence import SaveBuffer, WriteBehindSaver
+from skaben.modules.mq.broker import Delivery, MemoryBroker
+from skaben.modules.mq.consumer import AsyncConsumer
+from skaben.modules.mq.dispatch import DispatchTable
+from skaben.modules.mq.handlers import MessageHandler
+from tests.mq.test_consumer import make_queues
+
+
+A, B, C = 'aabbccddee01', 'aabbccddee02', 'aabbccddee03'
+
+
+class FakeSession:
+    def __init__(self, factory):
+        self.factory = factory
+
+    async def rollback(self):
+        self.factory.rollbacks += 1
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSessionFactory:
+    def __init__(self):
+        self.batches = []
+        self.error = None
+        self.rollbacks = 0
+
+    def __call__(self):
+        return FakeSession(self)
+
+
+def make_delivery(settled: list) -> Delivery:
+    return Delivery({}, 'save', lambda ok, requeue: settled.append(ok))
+
+
+def save_message(uid: str, **datahold) -> dict:
+    return {'device_type': 'lock', 'device_uid': uid, 'timestamp': 100, 'datahold': datahold}
+
+
+@pytest.fixture
+def factory(monkeypatch):
+    factory = FakeSessionFactory()
+
+    async def upsert(session, model, rows):
+        if factory.error:
+            raise factory.error
+        # как integer в Postgres
+        if any(row.get('timer', 0) > 2 ** 31 - 1 for row in rows):
+            raise DataError('insert', {}, ValueError('value out of int32 range'))
+        factory.batches.append((model.__name__, rows))
+        return len(rows)
+
+    monkeypatch.setattr(persistence, 'upsert_devices', upsert)
+    return factory
+
+
+def test_buffer_merges_updates_of_same_device():
+    buffer = SaveBuffer()
+    buffer.add(save_message(A, closed=True, timer=5))
+    buffer.add(save_message(A, closed=False))
+    buffer.add(save_message(B, timestamp=1))
+    assert len(buffer) == 2
+    assert buffer.latest[('lock', A)]['datahold'] == {'closed': False, 'timer': 5}
+
+
+@pytest.mark.asyncio
+async def test_saver_writes_one_row_per_device_and_acks_after_commit(factory):
+    saver = WriteBehindSaver(factory, flush_interval=60, max_pending=100)
+    settled = []
+    for i in range(10):
+        await saver.handle(save_message(A, timer=i), make_delivery(settled))
+    await saver.handle(save_message(B, closed=True), make_delivery(settled))
+    await saver.handle({'device_type': 'rgb', 'device_uid': 'cc'}, make_delivery(settled))
+    assert settled == []
+    assert await saver.flush() == 2
+    (model, rows), = factory.batches
+    assert model == 'Lock'
+    assert sorted((row['device_addr'], row.get('timer')) for row in rows) == [(A, 9), (B, None)]
+    assert settled == [True] * 11
+
+
+@pytest.mark.asyncio
+async def test_saver_keeps_batch_on_connection_error(factory):
+    saver = WriteBehindSaver(factory, flush_interval=60, max_pending=100)
+    settled = []
+    await saver.handle(save_message(A, timer=1), make_delivery(settled))
+    factory.error = OperationalError('insert', {}, OSError('connection refused'))
+    assert await saver.flush() == 0
+    await saver.handle(save_message(A, closed=True), make_delivery(settled))
+    assert settled == []
+    factory.error = None
+    assert await saver.flush() == 1
+    assert factory.batches[0][1][0]['closed'] is True
+    assert factory.batches[0][1][0]['timer'] == 1
+    assert settled == [True, True]
+
+
+@pytest.mark.asyncio
+async def test_saver_rejects_malformed_messages_before_buffering(factory):
+    saver = WriteBehindSaver(factory, flush_interval=60, max_pending=100)
+    settled = []
+    await saver.handle(save_message('not a mac'), make_delivery(settled))
+    await saver.handle(save_message(A, timer='soon'), make_delivery(settled))
+    await saver.handle({**save_message(A), 'datahold': 'closed'}, make_delivery(settled))
+    await saver.handle({**save_message(A), 'timestamp': 10 ** 20}, make_delivery(settled))
+    assert settled == [False] * 4
+    assert len(saver.buffer) == 0
+
+
+@pytest.mark.asyncio
+async def test_saver_normalizes_uid_and_keeps_only_reported_fields(factory):
+    saver = WriteBehindSaver(factory, flush_interval=60, max_pending=100)
+    await saver.handle(save_message('AA:BB:CC:DD:EE:01', closed='false', hash='x'))
+    await saver.flush()
+    (_, rows), = factory.batches
+    assert rows == [{'closed': False, 'timestamp': rows[0]['timestamp'], 'device_type': 'lock', 'device_addr': A}]
+
+
+@pytest.mark.asyncio
+async def test_saver_rejects_only_rows_refused_by_db(factory):
+    saver = WriteBehindSaver(factory, flush_interval=60, max_pending=100)
+    settled = {}
+    for uid, timer in ((A, 1), (B, 2 ** 40), (C, 3)):
+        await saver.handle(save_message(uid, timer=timer), make_delivery(settled.setdefault(uid, [])))
+    assert await saver.flush() == 2
+    assert settled == {A: [True], B: [False], C: [True]}
+    assert sorted(rows[0]['device_addr'] for _, rows in factory.batches) == [A, C]
+    assert factory.rollbacks == 2
+
+
+@pytest.mark.asyncio
+async def test_saver_drops_cached_config_of_changed_devices(factory):
+    configs = DeviceConfigCache(session_factory=None)
+    configs.entries = {('lock', A): None, ('lock', B): None}
+    saver = WriteBehindSaver(factory, flush_interval=60, max_pending=100, configs=configs)
+    await saver.handle(save_message(A, closed=False))
+    await saver.handle(save_message(B, timestamp=100))
+    await saver.flush()
+    assert list(configs.entries) == [('lock', B)]
+
+
+@pytest.mark.asyncio
+async def test_device_report_is_saved_and_acked_after_flush(factory):
+    saver = WriteBehindSaver(factory, flush_interval=60, max_pending=100)
+    handler = MessageHandler(SimpleNamespace(exchanges={}), dispatch=DispatchTable(), saver=saver)
+    broker = MemoryBroker()
+    consumer = AsyncConsumer(broker, handler.handle, make_queues(), prefetch=8, concurrency=2)
+    await consumer.start()
+    broker.publish({'timestamp': 100, 'datahold': {'closed': False, 'hash': 'x'}}, 'ask', f'ask.lock.{A}.sup')
+    broker.publish({'timestamp': 101, 'datahold': {'blocked': True}}, 'ask', f'ask.lock.{A}.info')
+    broker.publish({'datahold': {'level': 1}}, 'ask', 'ask.rgb.ddeeff.sup')
+    while consumer.processed < 3:
+        await asyncio.sleep(0.01)
+    assert broker.acked == 1
+    assert await saver.flush() == 1
+    (model, rows), = factory.batches
+    assert model == 'Lock'
+    assert rows == [{'closed': False, 'blocked': True, 'timestamp': datetime(1970, 1, 1, 0, 1, 41),
+                     'device_type': 'lock', 'device_addr': A}]
+    assert broker.acked == 3
+    await consumer.stop()
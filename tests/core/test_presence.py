@@ -0,0 +1,126 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import DataError, OperationalError
+
+from skaben.modules.core.presence import PresenceIndex, flush_timestamps, presence_uid, save_presence
+
+
+def test_device_expires_after_ttl():
+    index = PresenceIndex(ttl=10)
+    index.touch('lock', 'aa', seen_at=100)
+    index.touch('rgb', 'bb', seen_at=100)
+    index.touch('lock', 'aa', seen_at=105)
+    assert index.expire(now=111) == [('rgb', 'bb')]
+    assert index.snapshot() == {'lock': {'online': ['aa'], 'offline': []},
+                                'rgb': {'online': [], 'offline': ['bb']}}
+    assert index.expire(now=116) == [('lock', 'aa')]
+    assert index.snapshot('lock') == {'lock': {'online': [], 'offline': ['aa']}}
+
+
+def test_device_comes_back_online():
+    index = PresenceIndex(ttl=10)
+    index.touch('lock', 'aa', seen_at=100)
+    index.expire(now=200)
+    index.touch('lock', 'aa', seen_at=201)
+    assert index.snapshot()['lock']['online'] == ['aa']
+    assert len(index._heap) == 1
+
+
+def test_dirty_timestamps_are_drained_once():
+    index = PresenceIndex(ttl=10)
+    index.touch('lock', 'aa', seen_at=100)
+    index.touch('lock', 'aa', seen_at=101)
+    dirty = index.drain_dirty()
+    assert dirty == {('lock', 'aa'): 101}
+    assert index.drain_dirty() == {}
+    index.touch('lock', 'aa', seen_at=102)
+    index.restore_dirty(dirty)
+    assert index.drain_dirty() == {('lock', 'aa'): 102}
+
+
+def test_offline_device_is_forgotten():
+    index = PresenceIndex(ttl=10, forget=100)
+    index.touch('lock', 'aa', seen_at=100)
+    index.touch('lock', 'bb', seen_at=100)
+    index.expire(now=111)
+    index.touch('lock', 'bb', seen_at=150)
+    index.expire(now=161)
+    assert index.expire(now=211) == []
+    assert list(index.last_seen) == [('lock', 'bb')]
+    assert index.snapshot() == {'lock': {'online': [], 'offline': ['bb']}}
+    index.expire(now=261)
+    assert index.last_seen == {}
+
+
+@pytest.mark.asyncio
+async def test_timestamps_are_flushed_in_utc():
+    class Session:
+        async def execute(self, stmt, rows):
+            self.rows = rows
+
+        async def commit(self):
+            pass
+
+    session = Session()
+    assert await flush_timestamps(session, {('lock', 'aa'): 0, ('rgb', 'bb'): 0}) == 1
+    assert session.rows == [{'b_addr': 'aa', 'b_ts': datetime(1970, 1, 1)}]
+
+
+class FakeSession:
+    """records flushed rows, refuses rows of `bad` address and fails on all rows when `down`"""
+
+    def __init__(self, bad: str | None = None, down: bool = False):
+        self.bad = bad
+        self.down = down
+        self.saved = []
+        self.rollbacks = 0
+
+    def __call__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, stmt, rows):
+        if self.down:
+            raise OperationalError('UPDATE', {}, OSError('connection refused'))
+        if any(row['b_addr'] == self.bad for row in rows):
+            raise DataError('UPDATE', {}, Exception('value out of range'))
+        self.saved += [row['b_addr'] for row in rows]
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.mark.asyncio
+async def test_refused_timestamp_does_not_block_others():
+    index = PresenceIndex(ttl=60)
+    for uid in ('aabbccddee01', 'aabbccddee02', 'aabbccddee03'):
+        index.touch('lock', uid, seen_at=100)
+    session = FakeSession(bad='aabbccddee02')
+    await save_presence(index, session)
+    assert session.saved == ['aabbccddee01', 'aabbccddee03']
+    assert session.rollbacks == 1
+    # отвергнутая запись не возвращается в следующий flush
+    assert index.drain_dirty() == {}
+
+
+@pytest.mark.asyncio
+async def test_timestamps_are_kept_while_db_is_down():
+    index = PresenceIndex(ttl=60)
+    index.touch('lock', 'aabbccddee01', seen_at=100)
+    await save_presence(index, FakeSession(down=True))
+    assert index.drain_dirty() == {('lock', 'aabbccddee01'): 100}
+
+
+def test_presence_uid_is_mac():
+    assert presence_uid('AA:BB:CC:DD:EE:01') == 'aabbccddee01'
+    with pytest.raises(ValueError):
+        presence_uid('all')
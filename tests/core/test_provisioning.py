@@ -0,0 +1,133 @@
+import json
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from skaben.database import async_session
+from skaben.main import app
+from skaben.models.device import Lock
+from skaben.modules.core.provisioning import DeviceImporter, import_devices, read_rows
+
+
+async def chunked(data: bytes, size: int = 7):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def collect(rows) -> list:
+    return [row async for row in rows]
+
+
+class FakeSession:
+    def __init__(self):
+        self.rollbacks = 0
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+class FakeUpsert:
+    """records written batches, refuses batches with `bad` device_addr"""
+
+    def __init__(self, bad: str | None = None):
+        self.bad = bad
+        self.batches = []
+
+    async def __call__(self, session, model, rows: list[dict]) -> int:
+        if any(row['device_addr'] == self.bad for row in rows):
+            raise IntegrityError('INSERT', {}, Exception('value out of range'))
+        self.batches.append([row['device_addr'] for row in rows])
+        return len(rows)
+
+
+@pytest.mark.asyncio
+async def test_csv_rows_split_between_chunks():
+    data = '﻿device_addr,name,closed\r\naa:bb:cc:dd:ee:01,door,false\r\n\r\naabbccddee02,,true\r\nbroken\n'
+    rows = await collect(read_rows(chunked(data.encode()), 'csv'))
+    assert rows == [(2, {'device_addr': 'aa:bb:cc:dd:ee:01', 'name': 'door', 'closed': 'false'}),
+                    (4, {'device_addr': 'aabbccddee02', 'closed': 'true'}),
+                    (5, 'expected 3 columns, got 1')]
+
+
+@pytest.mark.asyncio
+async def test_ndjson_rows():
+    data = json.dumps({'device_uid': 'aabbccddee01'}) + '\n[1]\n{oops\n' + json.dumps({'device_addr': 'x'})
+    rows = await collect(read_rows(chunked(data.encode()), 'ndjson'))
+    assert [line for line, _ in rows] == [1, 2, 3, 4]
+    assert rows[0][1] == {'device_uid': 'aabbccddee01'}
+    assert rows[1][1] == 'JSON object expected'
+    assert rows[2][1].startswith('invalid JSON')
+
+
+@pytest.mark.asyncio
+async def test_import_reports_bad_rows_and_keeps_the_rest():
+    lines = ['device_addr,device_type,timer']
+    lines += [f'aabbccdd{i:04x},lock,{i}' for i in range(10)]
+    lines += ['not-a-mac,lock,1', 'aabbccdd0003,terminal,1', 'aabbccdd0004,lock,late', 'aabbccdd0009,lock,99']
+    upsert = FakeUpsert(bad='aabbccdd0007')
+    importer = DeviceImporter(FakeSession(), 'lock', batch=4, upsert=upsert)
+    report = await importer.run(read_rows(chunked('\n'.join(lines).encode(), 64), 'csv'))
+
+    assert report.total == 14
+    assert report.imported == 9
+    assert report.failed == 5
+    assert [e['line'] for e in report.errors] == [9, 12, 13, 14, 11]
+    assert 'value out of range' in report.errors[0]['error']
+    assert 'device_addr' in report.errors[1]['error']
+    assert 'timer' in report.errors[3]['error']
+    assert 'redefined on line 15' in report.errors[4]['error']
+    # пачка с ошибкой записана построчно
+    assert upsert.batches == [[f'aabbccdd{i:04x}' for i in range(4)],
+                              ['aabbccdd0004'], ['aabbccdd0005'], ['aabbccdd0006'],
+                              ['aabbccdd0008', 'aabbccdd0009']]
+    assert importer.session.rollbacks == 2
+
+
+def test_validate_keeps_only_given_columns():
+    importer = DeviceImporter(FakeSession(), 'lock')
+    row = importer.validate(2, {'device_addr': 'AA:BB:CC:DD:EE:FF', 'closed': 'false'})
+    assert row == {'device_addr': 'aabbccddeeff', 'closed': False, 'device_type': 'lock'}
+
+
+def test_unknown_device_type():
+    with pytest.raises(ValueError):
+        DeviceImporter(FakeSession(), 'rgb')
+
+
+@pytest.mark.asyncio
+async def test_api_rejects_unknown_device_type():
+    async with AsyncClient(app=app, base_url='http://testserver') as client:
+        response = await client.post('/device/import/rgb', content=b'device_addr\naabbccddeeff\n',
+                                     headers={'Content-Type': 'text/csv'})
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_import_upserts_by_device_addr(db):
+    rows = [f'aa:bb:cc:dd:{i // 256:02x}:{i % 256:02x},door {i},10' for i in range(1500)]
+    first = '\n'.join(['device_addr,name,timer'] + rows)
+    second = '\n'.join(['device_addr,name,timer', 'aabbccdd0001,renamed,30', 'aabbccdd0002,bad,99999999999'])
+    async with async_session() as session:
+        report = await import_devices(session, 'lock', chunked(first.encode(), 4096), 'csv')
+        assert (report.imported, report.failed) == (1500, 0)
+        report = await import_devices(session, 'lock', chunked(second.encode()), 'csv')
+        assert (report.imported, report.failed) == (1, 1)
+        assert report.errors[0]['line'] == 3
+        locks = (await session.execute(select(Lock))).scalars().all()
+    assert len(locks) == 1500
+    renamed = [lock for lock in locks if lock.name == 'renamed']
+    assert len(renamed) == 1 and renamed[0].timer == 30
+
+
+@pytest.mark.asyncio
+async def test_partial_import_keeps_other_columns(db):
+    full = 'device_addr,name,closed,blocked,sound,timer\naabbccddeeff,door,true,true,false,42\n'
+    partial = 'device_addr,closed\naabbccddeeff,false\n'
+    async with async_session() as session:
+        await import_devices(session, 'lock', chunked(full.encode()), 'csv')
+        report = await import_devices(session, 'lock', chunked(partial.encode()), 'csv')
+        assert (report.imported, report.failed) == (1, 0)
+        lock = (await session.execute(select(Lock))).scalars().one()
+    assert (lock.name, lock.closed, lock.blocked, lock.sound, lock.timer) == ('door', False, True, False, 42)
@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+
+from skaben.modules.mq.broadcast import CacheBroadcast
+from skaben.modules.mq.loadgen import loadgen_config
+from skaben.modules.state.cache import COUNTER, STATE, StateCache
+
+
+@pytest.mark.asyncio
+async def test_cache_is_dropped_on_connect():
+    cache = StateCache()
+
+    async def load():
+        return 'stale'
+
+    await cache.get(STATE, load)
+    await cache.get(COUNTER, load)
+    broadcast = CacheBroadcast(loadgen_config('memory://', embedded=True), cache)
+    await broadcast.start()
+    try:
+        for _ in range(100):
+            if not cache._values:
+                break
+            await asyncio.sleep(0.01)
+        # сбросы, разосланные пока очереди не было, потеряны - кэш сброшен целиком
+        assert cache._values == {}
+        assert cache.broadcast == broadcast.send
+    finally:
+        await broadcast.stop()
@@ -0,0 +1,64 @@
+import json
+import uuid
+
+import pytest
+from kombu import serialization
+
+from skaben.modules.mq import codec
+
+
+@pytest.fixture
+def registered():
+    # кодек уже зарегистрирован при импорте mq.config - возвращаем ту регистрацию, что была
+    registry = serialization.registry
+    encoder, decoder = registry._encoders.get('json'), registry._decoders.get('application/json')
+    codec.register()
+    yield
+    registry._encoders['json'], registry._decoders['application/json'] = encoder, decoder
+
+
+def test_kombu_json_goes_through_codec(registered):
+    device_id = uuid.uuid4()
+    content_type, encoding, body = serialization.dumps({'uuid': device_id, 'level': 1}, 'json')
+    assert content_type == 'application/json'
+    assert serialization.loads(body, content_type, encoding) == {'uuid': str(device_id), 'level': 1}
+
+
+@pytest.mark.parametrize('body', [
+    json.dumps({'timestamp': 100, 'task_id': 'lock-1', 'hash': 'abc', 'datahold': json.dumps({'closed': True})}),
+    json.dumps({'timestamp': 100, 'task_id': 'lock-1', 'hash': 'abc', 'datahold': {'closed': True}}).encode(),
+    {'timestamp': 100, 'task_id': 'lock-1', 'hash': 'abc', 'datahold': {'closed': True}},
+])
+def test_decode_ask_payload_shapes(body):
+    data = codec.decode_ask(body)
+    assert data['timestamp'] == 100
+    assert data['hash'] == 'abc'
+    assert data['datahold'] == {'closed': True}
+
+
+def test_decode_ask_falls_back_on_unexpected_types():
+    data = codec.decode_ask(json.dumps({'timestamp': '100', 'extra': 1}))
+    assert data == {'timestamp': '100', 'extra': 1}
+
+
+def test_decode_ask_broken_json_is_empty():
+    assert codec.decode_ask('{not a json') == {}
+    assert codec.parse_json(b'') == {}
+
+
+def test_decode_ask_fills_defaults_of_typed_payload():
+    assert codec.decode_ask(b'{"timestamp": 100}') == {'timestamp': 100, 'task_id': 0, 'hash': '', 'datahold': {}}
+    data = codec.decode_ask(json.dumps({'timestamp': 100, 'task_id': 7, 'datahold': '{"closed": false}'}))
+    assert data == {'timestamp': 100, 'task_id': 7, 'hash': '', 'datahold': {'closed': False}}
+
+
+@pytest.mark.parametrize('data', [
+    {'timestamp': '100'},
+    {'timestamp': True},
+    {'timestamp': 100, 'hash': None},
+    {'timestamp': 100, 'task_id': [1]},
+    {'timestamp': 100, 'datahold': 1},
+    {'timestamp': 100, 'extra': 1},
+])
+def test_ask_payload_rejects_unexpected_shape(data):
+    assert codec.AskPayload.from_dict(data) is None
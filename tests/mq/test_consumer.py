@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from kombu import Exchange
+
+from skaben.modules.mq.broker import MemoryBroker
+from skaben.modules.mq.config import INTERNAL_QUEUES, TRANSPORT_QUEUES, MQFactory
+from skaben.modules.mq.consumer import AsyncConsumer
+
+
+def make_queues():
+    ask = Exchange('ask', type='topic')
+    internal = Exchange('internal', type='direct')
+    return ([MQFactory.create_queue(name, ask) for name in TRANSPORT_QUEUES]
+            + [MQFactory.create_queue(name, internal, is_topic=False) for name in INTERNAL_QUEUES])
+
+
+@pytest.mark.asyncio
+async def test_memory_broker_routes_like_mq_config():
+    broker = MemoryBroker()
+    await broker.start(make_queues(), prefetch=10)
+    assert broker.publish({}, 'ask', 'ask.lock.aabbcc.sup') == 1
+    assert broker.publish({}, 'internal', 'save') == 1
+    assert broker.publish({}, 'ask', 'ask.lock.aabbcc.unknown') == 0
+    assert broker.publish({}, 'internal', 'ask.lock.aabbcc.sup') == 0
+
+
+@pytest.mark.asyncio
+async def test_consumer_bounds_concurrency_and_acks():
+    broker = MemoryBroker()
+    running = 0
+    peak = 0
+
+    async def handler(delivery):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+
+    consumer = AsyncConsumer(broker, handler, make_queues(), prefetch=8, concurrency=3)
+    await consumer.start()
+    for i in range(50):
+        broker.publish({'i': i}, 'ask', f'ask.rgb.{i}.pong')
+    while broker.acked < 50:
+        await asyncio.sleep(0.01)
+    await consumer.stop()
+    assert peak == 3
+    assert consumer.processed == 50
+
+
+@pytest.mark.asyncio
+async def test_consumer_rejects_failed_and_drains_on_stop():
+    broker = MemoryBroker()
+    release = asyncio.Event()
+
+    async def handler(delivery):
+        if delivery.body.get('fail'):
+            raise ValueError('broken payload')
+        await release.wait()
+
+    consumer = AsyncConsumer(broker, handler, make_queues(), prefetch=4, concurrency=4)
+    await consumer.start()
+    broker.publish({'fail': True}, 'ask', 'ask.lock.1.sup')
+    broker.publish({}, 'ask', 'ask.lock.2.sup')
+    await asyncio.sleep(0.01)
+    assert broker.rejected == 1
+    assert consumer.in_flight == 1
+
+    stopping = asyncio.create_task(consumer.stop(timeout=1))
+    await asyncio.sleep(0.01)
+    release.set()
+    await stopping
+    assert broker.acked == 1
+    assert consumer.failed == 1
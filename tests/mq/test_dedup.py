@@ -0,0 +1,70 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from skaben.modules.mq.broker import Delivery
+from skaben.modules.mq.dedup import DUPLICATES, DedupCache, MessageFilter
+from skaben.modules.mq.dispatch import DispatchTable
+from skaben.modules.mq.handlers import MessageHandler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_keys_expire_after_ttl():
+    clock = Clock()
+    cache = DedupCache(ttl=10, max_size=100, clock=clock)
+    assert not cache.seen('a')
+    clock.now = 5
+    assert cache.seen('a')
+    assert not cache.seen('b')
+    clock.now = 11
+    assert not cache.seen('a')
+    # 'a' с истекшим сроком вытеснен при добавлении, 'b' еще жив
+    assert len(cache) == 2
+    clock.now = 16
+    assert not cache.seen('c')
+    assert len(cache) == 2
+
+
+def test_size_is_capped():
+    cache = DedupCache(ttl=60, max_size=3, clock=Clock())
+    for key in 'abcd':
+        cache.seen(key)
+    assert len(cache) == 3
+    assert not cache.seen('a')
+    assert cache.seen('d')
+
+
+def delivery(command: str, task_id, hash: str = 'h1', device_type: str = 'lock') -> Delivery:
+    body = json.dumps({'timestamp': 1, 'task_id': task_id, 'hash': hash, 'datahold': '{}'})
+    return Delivery(body, f'ask.{device_type}.0a1b2c3d4e5f.{command}', lambda ok, requeue: None)
+
+
+@pytest.mark.asyncio
+async def test_handler_drops_retransmitted_messages():
+    handled = []
+    dispatch = DispatchTable()
+
+    async def record(message, delivery):
+        handled.append((message.command, message.task_id, message.hash))
+
+    dispatch.register(['lock', 'rgb'], ['sup', 'cup'], record)
+    dedup = MessageFilter(ttl=60, max_size=100)
+    handler = MessageHandler(SimpleNamespace(exchanges={}), dispatch=dispatch, dedup=dedup)
+    before = DUPLICATES.labels('lock').value
+
+    for item in (delivery('sup', 't1'), delivery('sup', 't1'), delivery('cup', 't1'),
+                 delivery('sup', 't1', hash='h2'), delivery('sup', 't2'), delivery('sup', 't2'),
+                 delivery('sup', 0, device_type='rgb'), delivery('sup', 0, device_type='rgb')):
+        await handler.handle(item)
+
+    assert handled == [('sup', 't1', 'h1'), ('cup', 't1', 'h1'), ('sup', 't1', 'h2'), ('sup', 't2', 'h1'),
+                       ('sup', 0, 'h1'), ('sup', 0, 'h1')]
+    assert DUPLICATES.labels('lock').value == before + 2
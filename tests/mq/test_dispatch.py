@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from skaben.modules.mq.dispatch import DeviceMessage, DispatchTable
+
+
+def test_parse_smart_device_message():
+    table = DispatchTable()
+    body = json.dumps({'timestamp': '100', 'task_id': 'lock-1', 'hash': 'abc',
+                       'datahold': json.dumps({'closed': True})})
+    message = table.parse('ask.lock.aabbccddeeff.sup', body)
+    assert message == DeviceMessage('lock', 'aabbccddeeff', 'sup', timestamp=100, task_id='lock-1',
+                                    hash='abc', datahold={'closed': True})
+
+
+def test_parse_simple_device_message_takes_timestamp_from_datahold():
+    table = DispatchTable()
+    message = table.parse('ask.rgb.all.pong', {'datahold': {'timestamp': 42}})
+    assert message.timestamp == 42
+    assert message.datahold == {'timestamp': 42}
+
+
+@pytest.mark.parametrize('routing_key', ['ask.lock.sup', 'mqtt.lock.aabb.sup'])
+def test_parse_rejects_malformed_routing_key(routing_key):
+    with pytest.raises(ValueError):
+        DispatchTable().parse(routing_key, {})
+
+
+def test_resolve_registered_handler():
+    table = DispatchTable()
+
+    @table.route(['lock', 'terminal'], ['cup'])
+    async def on_cup(message, delivery):
+        pass
+
+    assert table.resolve(table.parse('ask.terminal.1.cup', {})) is on_cup
+    assert table.resolve(table.parse('ask.terminal.1.sup', {})) is None
+    assert table.resolve(table.parse('ask.unknown.1.cup', {})) is None
@@ -0,0 +1,97 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from skaben.modules.mq.broker import Delivery
+from skaben.modules.mq.dispatch import DeviceMessage, DispatchTable
+from skaben.modules.mq.handlers import MessageHandler
+from skaben.modules.mq.ingress import COALESCED, THROTTLED, Ingress
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def message(command: str, uid: str = '0a1b2c3d4e5f', seq: int = 0) -> DeviceMessage:
+    return DeviceMessage('lock', uid, command, timestamp=seq)
+
+
+def test_token_bucket_drops_flood_of_one_device_only():
+    clock = Clock()
+    ingress = Ingress(rate=10, burst=5, window=0, clock=clock)
+    before = THROTTLED.labels('lock').value
+    admitted = [ingress.admit(message('cup'), None) for _ in range(20)]
+    assert admitted.count(True) == 5
+    assert ingress.admit(message('cup', uid='ffffffffffff'), None)
+    clock.now = 0.3
+    assert [ingress.admit(message('cup'), None) for _ in range(5)].count(True) == 3
+    assert THROTTLED.labels('lock').value == before + 17
+
+
+def test_reports_are_coalesced_to_latest():
+    clock = Clock()
+    ingress = Ingress(rate=0, burst=1, window=1.0, clock=clock)
+    before = COALESCED.labels('lock').value
+    assert ingress.admit(message('sup', seq=0), None)
+    assert not any(ingress.admit(message('sup', seq=seq), None) for seq in range(1, 10))
+    assert ingress.admit(message('info'), None)
+    assert ingress.pending == 1
+    clock.now = 0.5
+    assert ingress.due() == []
+    clock.now = 1.0
+    assert [m.timestamp for m, _ in ingress.due()] == [9]
+    assert COALESCED.labels('lock').value == before + 8
+    # окно отсчитывается от пересылки накопленного отчета
+    clock.now = 1.5
+    assert not ingress.admit(message('sup', seq=10), None)
+    clock.now = 2.0
+    assert [m.timestamp for m, _ in ingress.due()] == [10]
+
+
+def test_rate_limited_report_waits_for_token():
+    clock = Clock()
+    ingress = Ingress(rate=2, burst=1, window=0.1, clock=clock)
+    assert ingress.admit(message('cup'), None)
+    assert not ingress.admit(message('sup', seq=1), None)
+    clock.now = 0.2
+    assert ingress.due() == []
+    clock.now = 0.5
+    assert [m.timestamp for m, _ in ingress.due()] == [1]
+
+
+def test_device_state_is_capped():
+    ingress = Ingress(rate=1, burst=1, window=1.0, max_devices=100, clock=Clock())
+    for i in range(1000):
+        ingress.admit(message('sup', uid=f'{i:012x}'), None)
+    assert len(ingress) == 100
+    # вытесненное устройство возвращается с полным запасом
+    assert ingress.admit(message('cup', uid=f'{0:012x}'), None)
+
+
+def delivery(command: str, seq: int) -> Delivery:
+    body = json.dumps({'timestamp': seq, 'task_id': f't{seq}', 'hash': 'h', 'datahold': '{}'})
+    return Delivery(body, f'ask.lock.0a1b2c3d4e5f.{command}', lambda ok, requeue: None)
+
+
+@pytest.mark.asyncio
+async def test_handler_forwards_latest_report_on_drain():
+    handled = []
+    dispatch = DispatchTable()
+
+    async def record(parsed, delivery):
+        handled.append((parsed.command, parsed.timestamp))
+
+    dispatch.register(['lock'], ['sup', 'cup'], record)
+    handler = MessageHandler(SimpleNamespace(exchanges={}), dispatch=dispatch,
+                             ingress=Ingress(rate=100, burst=100, window=60))
+    for seq in range(5):
+        await handler.handle(delivery('sup', seq))
+    await handler.handle(delivery('cup', 5))
+    assert handled == [('sup', 0), ('cup', 5)]
+    await handler.drain()
+    assert handled == [('sup', 0), ('cup', 5), ('sup', 4)]
@@ -0,0 +1,48 @@
+import pytest
+
+from skaben.modules.mq.consumer import create_consumer
+from skaben.modules.mq.handlers import MessageHandler
+from skaben.modules.mq.loadgen import (
+    LatencyHistogram, VirtualFleet, declare, echo_dispatch, loadgen_config, make_devices, split_topic
+)
+from skaben.modules.mq.publisher import BatchPublisher
+
+
+def test_histogram_buckets_and_percentiles():
+    histogram = LatencyHistogram(buckets=(1, 10))
+    for ms in (0.5, 5, 5, 50):
+        histogram.add(ms / 1000)
+    assert histogram.counts == [1, 2, 1]
+    assert histogram.percentile(50) == pytest.approx(5)
+    assert len(histogram.render().splitlines()) == 3
+
+
+@pytest.mark.parametrize('routing_key, expected', [
+    ('lock.aabbcc.cup', ('lock', 'aabbcc', 'cup')),
+    ('rgb/all/ping', ('rgb', 'all', 'ping')),
+    ('pwr', ('pwr', 'all', 'ping')),
+])
+def test_split_topic(routing_key, expected):
+    assert split_topic(routing_key) == expected
+
+
+@pytest.mark.asyncio
+async def test_fleet_gets_replies_from_embedded_consumer():
+    config = loadgen_config('memory://', embedded=True)
+    publisher = BatchPublisher(config.conn.clone())
+    handler = MessageHandler(config, dispatch=echo_dispatch(publisher, config.exchanges['mqtt']))
+    server = create_consumer(config, handler.handle)
+    declare(config.conn, server.queues)
+    await server.start()
+
+    devices = make_devices(20, ['lock', 'rgb'])
+    fleet = VirtualFleet(config.conn, config.exchanges['mqtt'], devices, {'cup': 5.0}, smart_types=frozenset(['lock']))
+    await fleet.run(0.3)
+    await fleet.stop(timeout=5)
+    await server.stop()
+    publisher.close()
+
+    assert fleet.sent['cup'] > 0
+    # повторный cup до ответа на первый получает второй ответ без замера
+    assert 0 < len(fleet.latency) <= fleet.received['cup']
+    assert fleet.unanswered() == 0
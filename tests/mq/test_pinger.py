@@ -0,0 +1,48 @@
+from collections import Counter
+
+import pytest
+import typer
+
+from skaben.modules.mq.pinger import PingScheduler
+from skaben.modules.mq.recurrent import parse_intervals
+
+
+class FakeInterface:
+
+    def __init__(self):
+        self.sent = Counter()
+
+    def send_mqtt_many(self, packets):
+        for packet in packets:
+            self.sent[packet.topic] += 1
+
+
+def test_scheduler_keeps_per_topic_intervals():
+    interface = FakeInterface()
+    scheduler = PingScheduler(interface, {'lock': 1.0, 'rgb': 2.0}, jitter=0.1)
+    scheduler.schedule(0.0)
+    now = 0.0
+    while now < 100:
+        scheduler.tick(now)
+        now += 0.01
+    assert 95 <= interface.sent['lock'] <= 105
+    assert 47 <= interface.sent['rgb'] <= 53
+    assert scheduler.report()['lock']['max_ms'] <= 10.5
+
+
+def test_scheduler_skips_missed_ticks_after_pause():
+    interface = FakeInterface()
+    scheduler = PingScheduler(interface, {'lock': 1.0}, jitter=0)
+    scheduler.schedule(0.0)
+    scheduler.tick(1.0)
+    scheduler.tick(50.0)
+    assert interface.sent['lock'] == 2
+    assert scheduler.due(50.0) == []
+    assert len(scheduler.due(51.0)) == 1
+
+
+def test_interval_overrides_are_validated():
+    assert parse_intervals(['lock=2.5'], ['lock', 'rgb'], 10.0) == {'lock': 2.5, 'rgb': 10.0}
+    for item in ('door=1', 'lock=fast', 'lock', 'lock=0', 'lock=-1', 'lock=nan'):
+        with pytest.raises(typer.BadParameter):
+            parse_intervals([item], ['lock', 'rgb'], 10.0)
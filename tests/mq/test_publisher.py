@@ -0,0 +1,39 @@
+from concurrent.futures import wait
+
+import pytest
+from kombu import Connection
+
+from skaben.modules.mq.publisher import BatchPublisher, PublisherClosed
+
+
+def test_publisher_flushes_full_batch():
+    publisher = BatchPublisher(Connection('memory://'), max_batch=10, flush_interval=60)
+    futures = publisher.publish_many(({'i': i}, '', 'test') for i in range(10))
+    done, pending = wait(futures, timeout=2)
+    publisher.close()
+    assert not pending
+    assert all(f.result() for f in done)
+
+
+def test_publisher_flushes_by_interval():
+    publisher = BatchPublisher(Connection('memory://'), max_batch=100, flush_interval=0.01)
+    future = publisher.publish({'i': 1}, '', 'test')
+    assert future.result(timeout=2)
+    publisher.close()
+
+
+def test_publisher_flush_on_close():
+    publisher = BatchPublisher(Connection('memory://'), max_batch=100, flush_interval=60)
+    future = publisher.publish({'i': 1}, '', 'test')
+    publisher.close()
+    assert future.done()
+
+
+def test_publish_after_close_fails():
+    publisher = BatchPublisher(Connection('memory://'), max_batch=100, flush_interval=60)
+    publisher.close()
+    with pytest.raises(PublisherClosed):
+        publisher.publish({'i': 1}, '', 'test').result(timeout=0)
+    futures = publisher.publish_many([({'i': 2}, '', 'test')])
+    assert isinstance(futures[0].exception(timeout=0), PublisherClosed)
+    assert publisher._buffer == []
@@ -0,0 +1,113 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from skaben.models.state import State
+from skaben.modules.mq import simple
+from skaben.modules.mq.simple import SimpleConfigBroadcast
+from skaben.modules.state.cache import COUNTER, STATE
+from skaben.modules.state.thresholds import ThresholdIndex
+
+
+class FakeSession:
+    def __init__(self, game):
+        self.game = game
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt):
+        self.game.queries += 1
+        configs = self.game.configs[self.game.current.name]
+        return SimpleNamespace(scalars=lambda: [SimpleNamespace(device_type=t, config=c) for t, c in configs.items()])
+
+
+class FakePublisher:
+    def __init__(self):
+        self.sent = []
+
+    def publish(self, body, exchange, routing_key):
+        self.sent.append((routing_key, body))
+
+    def publish_many(self, messages):
+        self.sent.extend((routing_key, body) for body, _, routing_key in messages)
+
+
+@pytest.fixture
+def game(monkeypatch):
+    states = [State(name='green', order=1, threshold=0, uuid=1),
+              State(name='red', order=2, threshold=500, uuid=2)]
+    game = SimpleNamespace(current=states[0], counter=100, queries=0, configs={
+        'green': {'rgb': {'color': 'green'}, 'pwr': {'power': True}},
+        'red': {'rgb': {'color': 'red'}, 'pwr': {'power': True}},
+    })
+
+    async def get_current_state(session):
+        return game.current
+
+    async def get_last_counter(session):
+        return SimpleNamespace(value=game.counter)
+
+    async def get_threshold_index(session):
+        return ThresholdIndex(states)
+
+    monkeypatch.setattr(simple.methods, 'get_current_state', get_current_state)
+    monkeypatch.setattr(simple.methods, 'get_last_counter', get_last_counter)
+    monkeypatch.setattr(simple.methods, 'get_threshold_index', get_threshold_index)
+    game.states = states
+    return game
+
+
+def make_broadcast(game) -> tuple[SimpleConfigBroadcast, FakePublisher]:
+    broadcast = SimpleConfigBroadcast(SimpleNamespace(exchanges={'mqtt': 'mqtt'}), lambda: FakeSession(game))
+    publisher = broadcast._publisher = FakePublisher()
+    return broadcast, publisher
+
+
+@pytest.mark.asyncio
+async def test_transitions_publish_only_changed_payloads(game):
+    broadcast, publisher = make_broadcast(game)
+    await broadcast.refresh()
+    assert sorted(key for key, _ in publisher.sent) == ['pwr.all.cup', 'rgb.all.cup', 'scl.all.cup']
+    assert broadcast.payloads['scl']['datahold'] == {'borders': [0, 500], 'level': 100, 'state': 'green'}
+
+    publisher.sent.clear()
+    game.counter = 900
+    await broadcast.refresh((COUNTER,))
+    assert [key for key, _ in publisher.sent] == ['scl.all.cup']
+    assert publisher.sent[0][1]['datahold']['level'] == 500
+    assert game.queries == 1
+
+    publisher.sent.clear()
+    game.current = game.states[1]
+    await broadcast.refresh((STATE, COUNTER))
+    assert sorted(key for key, _ in publisher.sent) == ['rgb.all.cup', 'scl.all.cup']
+    assert game.queries == 2
+
+
+@pytest.mark.asyncio
+async def test_device_request_served_from_snapshot(game):
+    broadcast, publisher = make_broadcast(game)
+    await broadcast.send('rgb', 'aabbcc')
+    await broadcast.send('pwr', 'aabbcc')
+    assert [key for key, _ in publisher.sent][-2:] == ['rgb.aabbcc.cup', 'pwr.all.cup']
+    assert game.queries == 1
+
+
+@pytest.mark.asyncio
+async def test_unchanged_config_is_not_resent_whatever_payload_format(game, monkeypatch):
+    class SerializedCUP:
+        def __init__(self, datahold, **kwargs):
+            self.payload = {'datahold': json.dumps(datahold), **kwargs}
+
+    monkeypatch.setattr(simple, 'CUP', SerializedCUP)
+    broadcast, publisher = make_broadcast(game)
+    await broadcast.refresh()
+    assert len(publisher.sent) == 3
+    publisher.sent.clear()
+    await broadcast.refresh((COUNTER,))
+    assert publisher.sent == []
@@ -0,0 +1,97 @@
+import asyncio
+from collections import defaultdict
+
+import pytest
+
+from skaben.modules.mq.broker import KombuBroker
+from skaben.modules.mq.consumer import AsyncConsumer
+from skaben.modules.mq.loadgen import declare, loadgen_config, make_devices
+from skaben.modules.mq.publisher import BatchPublisher
+from skaben.modules.mq.workers import HashRing, ShardRouter, shard_key, unshard, unsharded
+
+
+def test_ring_moves_only_keys_of_added_node():
+    keys = [f'{i:012x}' for i in range(5000)]
+    before = HashRing(range(4))
+    after = HashRing(range(5))
+    counts = defaultdict(int)
+    moved = 0
+    for key in keys:
+        counts[before.get(key)] += 1
+        if before.get(key) != after.get(key):
+            moved += 1
+            assert after.get(key) == 4
+    assert 0.1 < moved / len(keys) < 0.3
+    assert min(counts.values()) > len(keys) / 4 * 0.7
+
+
+def test_unshard():
+    assert unshard(shard_key('ask.lock.aabb.sup', 3)) == 'ask.lock.aabb.sup'
+    assert unshard('save') == 'save'
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, 'timed out'
+        await asyncio.sleep(0.01)
+
+
+def worker(config, shard: int, received: dict) -> AsyncConsumer:
+    async def handle(delivery):
+        received[shard].append((delivery.routing_key, delivery.body['seq']))
+
+    broker = KombuBroker(config.conn.clone(), poll_interval=0.005)
+    return AsyncConsumer(broker, unsharded(handle), [config.shard_queues[f'shard.{shard}']], concurrency=1)
+
+
+@pytest.mark.asyncio
+async def test_router_keeps_device_on_one_shard_in_order():
+    config = loadgen_config('memory://', embedded=True)
+    router = ShardRouter(config, 2, publisher=BatchPublisher(config.conn.clone(), flush_interval=0.001))
+    routing = router.create_consumer()
+    declare(config.conn, routing.queues)
+    received = defaultdict(list)
+    workers = [worker(config, shard, received) for shard in range(2)]
+    for consumer in [routing] + workers:
+        await consumer.start()
+
+    uids = make_devices(20, ['lock'])['lock']
+    publisher = BatchPublisher(config.conn.clone(), flush_interval=0.001)
+    messages = [({'seq': seq}, config.exchanges['mqtt'], f'ask.lock.{uid}.sup') for seq in range(10) for uid in uids]
+    publisher.publish_many(messages)
+    await wait_for(lambda: sum(map(len, received.values())) == len(messages))
+    for consumer in [routing] + workers:
+        await consumer.stop()
+    publisher.close()
+    router.publisher.close()
+
+    assert set(received) == {0, 1}
+    for shard, items in received.items():
+        by_device = defaultdict(list)
+        for routing_key, seq in items:
+            by_device[routing_key].append(seq)
+            assert router.shard_for(routing_key) == shard
+        assert all(seqs == list(range(10)) for seqs in by_device.values())
+
+
+@pytest.mark.asyncio
+async def test_queues_of_removed_shards_are_rerouted():
+    config = loadgen_config('memory://', embedded=True)
+    config.init_shard_queues(3)
+    publisher = BatchPublisher(config.conn.clone(), flush_interval=0.001)
+    publisher.publish({'seq': 1}, config.exchanges['shards'], shard_key('ask.lock.0a0b0c0d0e0f.sup', 2)).result(5)
+
+    router = ShardRouter(config, 2, publisher=publisher)
+    routing = router.create_consumer()
+    assert 'shard.2' in [q.name for q in routing.queues]
+    received = defaultdict(list)
+    workers = [worker(config, shard, received) for shard in range(2)]
+    for consumer in [routing] + workers:
+        await consumer.start()
+    await wait_for(lambda: received)
+    for consumer in [routing] + workers:
+        await consumer.stop()
+    publisher.close()
+
+    assert dict(received) == {router.shard_for('ask.lock.0a0b0c0d0e0f.sup'): [('ask.lock.0a0b0c0d0e0f.sup', 1)]}
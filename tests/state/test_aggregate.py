@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient
+
+from skaben.database import async_session
+from skaben.main import app
+from skaben.models.state import AlertCounter
+from skaben.modules.state import methods
+
+START = datetime(2022, 7, 1, 12, 0)
+
+
+@pytest_asyncio.fixture
+async def counters(db):
+    async with async_session() as session:
+        # по записи каждые 10 секунд, значение растет до 50 и падает
+        session.add_all(AlertCounter(value=50 - abs(50 - i), timestamp=START + timedelta(seconds=10 * i))
+                        for i in range(100))
+        await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_counter_buckets(counters):
+    async with async_session() as session:
+        buckets = await methods.get_counter_buckets(session, 300, START, START + timedelta(hours=1))
+    assert [b.start for b in buckets] == [START + timedelta(minutes=5 * i) for i in range(4)]
+    assert [b.count for b in buckets] == [30, 30, 30, 10]
+    assert (buckets[0].min, buckets[0].max, buckets[0].last) == (0, 29, 29)
+    assert (buckets[1].min, buckets[1].max, buckets[1].last) == (30, 50, 41)
+    assert (buckets[3].min, buckets[3].max, buckets[3].last) == (1, 10, 1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('params', (
+    {'interval': 0},
+    {'interval': 1, 'since': '2022-07-01T00:00:00', 'until': '2022-07-02T00:00:00'},
+    {'since': '2022-07-02T00:00:00', 'until': '2022-07-01T00:00:00'},
+))
+async def test_aggregate_rejects_bad_ranges(params):
+    async with AsyncClient(app=app, base_url='http://testserver') as client:
+        response = await client.get('/alert/counter/aggregate', params=params)
+    assert response.status_code in (400, 422)
+
+
+@pytest.mark.asyncio
+async def test_aggregate_accepts_time_zone(monkeypatch):
+    calls = []
+
+    async def buckets(session, interval, since, until):
+        calls.append((since, until))
+        return []
+
+    monkeypatch.setattr(methods, 'get_counter_buckets', buckets)
+    async with AsyncClient(app=app, base_url='http://testserver') as client:
+        response = await client.get('/alert/counter/aggregate',
+                                    params={'since': '2022-07-01T15:00:00+03:00', 'until': '2022-07-01T14:00:00Z'})
+    assert response.status_code == 200
+    assert calls == [(START, START + timedelta(hours=2))]
+    # без `until` сравнивается с текущим временем
+    since = datetime.utcnow() - timedelta(hours=1)
+    async with AsyncClient(app=app, base_url='http://testserver') as client:
+        response = await client.get('/alert/counter/aggregate', params={'since': f'{since.isoformat()}Z'})
+    assert response.status_code == 200
+    assert calls[-1][0] == since
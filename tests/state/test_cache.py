@@ -0,0 +1,123 @@
+import pytest
+
+from skaben.models.state import AlertCounter, State
+from skaben.modules.state import methods
+from skaben.modules.state import cache as state_cache
+from skaben.modules.state.cache import COUNTER, STATE, StateCache
+from skaben.schema.state import AlertCounterSchema, StateSnapshotSchema
+
+
+class Result:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalars(self):
+        return self
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+    def one_or_none(self):
+        return self.first()
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeSession:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def execute(self, stmt):
+        return Result(self.rows)
+
+
+@pytest.mark.asyncio
+async def test_cache_loads_once_until_invalidated():
+    cache = StateCache()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        return len(calls)
+
+    assert await cache.get(STATE, load) == 1
+    assert await cache.get(STATE, load) == 1
+    cache.invalidate(STATE)
+    assert await cache.get(STATE, load) == 2
+
+
+@pytest.mark.asyncio
+async def test_cache_skips_value_loaded_during_invalidation():
+    cache = StateCache()
+
+    async def stale_load():
+        cache.invalidate(COUNTER)
+        return 'stale'
+
+    assert await cache.get(COUNTER, stale_load) == 'stale'
+
+    async def fresh_load():
+        return 'fresh'
+
+    assert await cache.get(COUNTER, fresh_load) == 'fresh'
+
+
+@pytest.mark.asyncio
+async def test_cached_value_expires_after_max_age(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(state_cache.time, 'monotonic', lambda: now[0])
+    cache = StateCache(max_age=5)
+    loads = []
+
+    async def load():
+        loads.append(now[0])
+        return len(loads)
+
+    assert await cache.get(STATE, load) == 1
+    now[0] = 104.9
+    assert await cache.get(STATE, load) == 1
+    # сброс не дошел - значение все равно перечитывается
+    now[0] = 105
+    assert await cache.get(STATE, load) == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidate_without_scopes_drops_everything():
+    cache = StateCache()
+
+    async def load():
+        return 'value'
+
+    await cache.get(STATE, load)
+    await cache.get(COUNTER, load)
+    cache.invalidate(broadcast=False)
+    assert cache._values == {}
+
+
+def test_invalidate_broadcasts_only_local_changes():
+    cache = StateCache()
+    sent, heard = [], []
+    cache.broadcast = sent.append
+    cache.listeners.append(heard.append)
+    cache.invalidate(STATE, COUNTER)
+    cache.invalidate(STATE, broadcast=False)
+    assert sent == [(STATE, COUNTER)]
+    assert heard == [(STATE, COUNTER), (STATE,)]
+
+
+@pytest.mark.asyncio
+async def test_cache_keeps_snapshots_not_orm_objects(monkeypatch):
+    cache = StateCache()
+    monkeypatch.setattr(methods, 'get_state_cache', lambda: cache)
+    counter = AlertCounter(value=10, comment='test')
+    assert await methods.get_last_counter(FakeSession([counter])) == AlertCounterSchema(value=10, comment='test')
+    counter.value = 20
+    assert (await methods.get_last_counter(FakeSession([]))).value == 10
+
+    state = State(uuid='c0ffee00-0000-0000-0000-000000000000', name='green', order=1, threshold=0, current=True)
+    current = await methods.get_current_state(FakeSession([state]))
+    assert isinstance(current, StateSnapshotSchema)
+    assert (current.name, current.info) == ('green', None)
+    index = await methods.get_threshold_index(FakeSession([state]))
+    assert isinstance(index.lookup(5), StateSnapshotSchema)
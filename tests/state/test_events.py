@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import pytest
+
+from skaben.modules.state.cache import COUNTER, STATE, StateCache
+from skaben.modules.state.events import DROPPED, EventHub, stream_events
+
+
+class Source:
+    def __init__(self):
+        self.values = {'counter': {'value': 0}, 'state': {'name': 'green'}}
+        self.loads = []
+
+    def loaders(self) -> dict:
+        def loader(event):
+            async def load():
+                self.loads.append(event)
+                return self.values[event]
+            return load
+        return {event: loader(event) for event in self.values}
+
+
+def hub_with_cache(source: Source, buffer: int = 100) -> tuple[EventHub, StateCache]:
+    cache = StateCache()
+    hub = EventHub(source.loaders(), buffer)
+    hub.attach(cache)
+    return hub, cache
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_change_is_loaded_once_for_all_subscribers():
+    source = Source()
+    hub, cache = hub_with_cache(source)
+    subscriptions = [await hub.subscribe() for _ in range(10)]
+    assert source.loads == ['counter', 'state']
+    for subscription in subscriptions:
+        assert await subscription.get(0) == [('counter', {'value': 0}), ('state', {'name': 'green'})]
+
+    source.values['counter'] = {'value': 10}
+    cache.invalidate(COUNTER)
+    # сброс, пришедший от другого процесса, до загрузки сливается с первым
+    cache.invalidate(COUNTER, broadcast=False)
+    await settle()
+    assert source.loads == ['counter', 'state', 'counter']
+    for subscription in subscriptions:
+        assert await subscription.get(1) == [('counter', {'value': 10})]
+
+    # состояние не изменилось - события нет
+    cache.invalidate(STATE)
+    await settle()
+    assert await subscriptions[0].get(0.01) == []
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_drops_oldest_events():
+    source = Source()
+    hub, cache = hub_with_cache(source, buffer=3)
+    slow = await hub.subscribe()
+    before = DROPPED.value
+    for value in range(1, 6):
+        source.values['counter'] = {'value': value}
+        cache.invalidate(COUNTER)
+        await settle()
+    assert [data['value'] for _, data in await slow.get(0)] == [3, 4, 5]
+    assert slow.dropped == 4
+    assert DROPPED.value == before + 4
+
+
+@pytest.mark.asyncio
+async def test_stream_sends_snapshot_and_keepalive():
+    source = Source()
+    hub, cache = hub_with_cache(source)
+    stream = stream_events(hub, keepalive=0.01)
+    chunk = await stream.__anext__()
+    assert chunk == ('event: counter\ndata: {"value": 0}\n\n'
+                     'event: state\ndata: {"name": "green"}\n\n')
+    assert await stream.__anext__() == ': keepalive\n\n'
+    source.values['state'] = {'name': 'red'}
+    cache.invalidate(STATE)
+    chunk = await stream.__anext__()
+    assert json.loads(chunk.split('data: ')[1]) == {'name': 'red'}
+    await stream.aclose()
+    assert not hub.subscriptions
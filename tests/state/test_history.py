@@ -0,0 +1,46 @@
+import json
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from skaben.api.alert import counters_query, decode_cursor, encode_cursor, stream_counters
+from skaben.models.state import AlertCounter
+
+
+class StreamResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def partitions(self, size):
+        for i in range(0, len(self.rows), size):
+            yield self.rows[i:i + size]
+
+
+class FakeSession:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def stream(self, stmt):
+        return StreamResult(self.rows)
+
+
+def test_cursor_of_counter_without_timestamp():
+    uuid = uuid4()
+    stamp = datetime(2022, 7, 1, 12, 0)
+    assert decode_cursor(encode_cursor(stamp, uuid)) == (stamp, uuid)
+    assert decode_cursor(encode_cursor(None, uuid)) == (None, uuid)
+    sql = str(counters_query(encode_cursor(None, uuid), None, None, AlertCounter)
+              .compile(dialect=postgresql.dialect()))
+    assert 'alertcounter.timestamp IS NOT NULL OR alertcounter.uuid <' in sql
+
+
+@pytest.mark.asyncio
+async def test_stream_rows_carry_uuid():
+    uuid = uuid4()
+    session = FakeSession([(uuid, 10, 'test', datetime(2022, 7, 1, 12, 0)), (uuid, 5, None, None)])
+    lines = ''.join([chunk async for chunk in stream_counters(session, counters_query(None, None, None))])
+    rows = [json.loads(line) for line in lines.splitlines()]
+    assert rows == [{'uuid': str(uuid), 'value': 10, 'comment': 'test', 'timestamp': '2022-07-01T12:00:00'},
+                    {'uuid': str(uuid), 'value': 5, 'comment': None, 'timestamp': None}]
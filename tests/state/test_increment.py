@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from skaben.database import async_session
+from skaben.models.state import AlertCounter, State
+from skaben.modules.state import methods
+from skaben.modules.state.cache import get_state_cache
+from skaben.schema.state import AlertCounterRelativeSchema, AlertCounterSchema
+
+CONCURRENCY = 50
+
+
+@pytest_asyncio.fixture
+async def states(db):
+    async with async_session() as session:
+        session.add_all([
+            State(name='green', order=1, threshold=0, current=True),
+            State(name='blue', order=2, threshold=100),
+            AlertCounter(value=0),
+        ])
+        await session.commit()
+    get_state_cache().invalidate(broadcast=False)
+
+
+async def increment(value: int):
+    async with async_session() as session:
+        return await methods.change_counter(session, AlertCounterRelativeSchema(value=value))
+
+
+@pytest.mark.asyncio
+async def test_concurrent_increments_are_not_lost(states):
+    results = await asyncio.gather(*(increment(1) for _ in range(CONCURRENCY)))
+    assert sorted(r.value for r in results) == list(range(1, CONCURRENCY + 1))
+    async with async_session() as session:
+        get_state_cache().invalidate(broadcast=False)
+        last = await methods.get_last_counter(session)
+    assert last.value == CONCURRENCY
+
+
+@pytest.mark.asyncio
+async def test_increment_switches_state_in_same_transaction(states):
+    await asyncio.gather(*(increment(30) for _ in range(4)))
+    async with async_session() as session:
+        current = await methods.get_current_state(session)
+    assert current.name == 'blue'
+
+
+@pytest.mark.asyncio
+async def test_created_counter_is_ordered_with_increments(states):
+    async def create():
+        async with async_session() as session:
+            return await methods.create_counter(session, AlertCounterSchema(value=1000), auto=False)
+
+    half = CONCURRENCY // 2
+    results = await asyncio.gather(*(increment(1) for _ in range(half)), create(),
+                                   *(increment(1) for _ in range(half)))
+    values = sorted(r.value for r in results)
+    before = [v for v in values if v < 1000]
+    # каждое изменение видит либо цепочку до записи 1000, либо после нее
+    assert values == before + [1000] + list(range(1001, 1001 + CONCURRENCY - len(before)))
+    assert before == list(range(1, len(before) + 1))
+    async with async_session() as session:
+        get_state_cache().invalidate(broadcast=False)
+        last = await methods.get_last_counter(session)
+    assert last.value == values[-1]
+
+
+class NoStateResult:
+    rowcount = 0
+
+    def scalars(self):
+        return self
+
+    def one_or_none(self):
+        return None
+
+
+class NoStateSession:
+    async def execute(self, stmt):
+        return NoStateResult()
+
+
+@pytest.mark.asyncio
+async def test_switch_without_current_state_fails(monkeypatch):
+    async def blue(session, value):
+        return State(name='blue', order=2, threshold=100)
+
+    monkeypatch.setattr(methods, 'get_state_by_counter', blue)
+    get_state_cache().invalidate(broadcast=False)
+    with pytest.raises(ValueError, match='Current state is not set'):
+        await methods.switch_state_by_value(NoStateSession(), 120)
+    get_state_cache().invalidate(broadcast=False)
@@ -0,0 +1,54 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql
+
+from skaben.database import async_session
+from skaben.models.state import AlertCounter, AlertCounterRollup
+from skaben.modules.state import methods
+from skaben.modules.state.cache import get_state_cache
+from skaben.modules.state.retention import compact_batch_query, compact_counters
+
+START = datetime(2022, 7, 1, 12, 0)
+ROWS = 100
+
+
+def test_batch_is_one_statement():
+    stmt = compact_batch_query(START, (START, uuid.uuid4()), 60, 1000)
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert 'moved AS' in sql and 'rolled AS' in sql
+    assert 'ON CONFLICT (start) DO UPDATE' in sql
+
+
+@pytest_asyncio.fixture
+async def counters(db):
+    async with async_session() as session:
+        session.add_all(AlertCounter(value=i % 37, timestamp=START + timedelta(seconds=10 * i)) for i in range(ROWS))
+        await session.commit()
+    get_state_cache().invalidate(broadcast=False)
+
+
+async def buckets(interval: int) -> list:
+    async with async_session() as session:
+        return await methods.get_counter_buckets(session, interval, START, START + timedelta(hours=1))
+
+
+@pytest.mark.asyncio
+async def test_compaction_keeps_aggregates_and_newest_row(counters):
+    before = await buckets(300)
+    # горизонт позже всех строк: последняя строка все равно остается
+    moved = await compact_counters(async_session, START + timedelta(days=1), interval=60, batch=7)
+    assert moved == ROWS - 1
+
+    async with async_session() as session:
+        counters = (await session.execute(select(AlertCounter))).scalars().all()
+        rollups = (await session.execute(select(func.sum(AlertCounterRollup.count)))).scalar()
+        last = await methods.get_last_counter(session)
+    assert [c.timestamp for c in counters] == [START + timedelta(seconds=10 * (ROWS - 1))]
+    assert last.value == (ROWS - 1) % 37
+    assert rollups == ROWS - 1
+    assert await buckets(300) == before
+    assert await compact_counters(async_session, START + timedelta(days=1), interval=60, batch=7) == 0
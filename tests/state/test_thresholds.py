@@ -0,0 +1,31 @@
+from skaben.models.state import State
+from skaben.modules.state.thresholds import ThresholdIndex
+
+
+def make_index():
+    return ThresholdIndex([
+        State(name='red', order=3, threshold=500),
+        State(name='white', order=0, threshold=-1),
+        State(name='green', order=1, threshold=0),
+        State(name='yellow', order=2, threshold=150),
+    ])
+
+
+def test_lookup_picks_highest_threshold_below_value():
+    index = make_index()
+    assert index.lookup(0).name == 'green'
+    assert index.lookup(149).name == 'green'
+    assert index.lookup(150).name == 'yellow'
+    assert index.lookup(10000).name == 'red'
+    assert index.lookup(-1).name == 'white'
+    assert index.lookup(-2) is None
+
+
+def test_ingame_states():
+    assert [state.name for state in make_index().ingame()] == ['green', 'yellow', 'red']
+
+
+def test_states_without_threshold_are_skipped():
+    index = ThresholdIndex([State(name='green', order=1, threshold=0), State(name='draft', order=2, threshold=None)])
+    assert len(index) == 1
+    assert index.lookup(10).name == 'green'
@@ -0,0 +1,36 @@
+import pytest
+
+from skaben import config, database
+
+
+def test_engine_options_from_settings():
+    options = database.engine_options(config.DBSettings(pool_size=3, max_overflow=0, statement_cache_size=0))
+    assert options['pool_size'] == 3
+    assert options['max_overflow'] == 0
+    assert options['connect_args'] == {'prepared_statement_cache_size': 0, 'statement_cache_size': 0}
+
+
+def test_readonly_engines_share_settings():
+    assert database.readonly_engine.get_execution_options()['postgresql_readonly'] is True
+    assert database.replica_engine.get_execution_options()['postgresql_readonly'] is True
+    assert database.readonly_engine.sync_engine.pool is database.engine.sync_engine.pool
+
+
+@pytest.mark.asyncio
+async def test_readonly_session_is_not_committed(monkeypatch):
+    calls = []
+
+    class FakeSession:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            calls.append('close')
+
+        async def commit(self):
+            calls.append('commit')
+
+    monkeypatch.setattr(database, 'readonly_session', FakeSession)
+    async for session in database.get_db_readonly():
+        assert isinstance(session, FakeSession)
+    assert calls == ['close']
@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import create_engine, text
+
+from skaben import metrics
+from skaben.database import QUERY_SECONDS, query_operation, track_queries
+from skaben.main import app
+from skaben.modules.mq import handlers
+from skaben.modules.mq.broker import Delivery
+from skaben.modules.mq.handlers import MessageHandler
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = metrics.Registry()
+    latency = registry.register(metrics.Histogram('test_seconds', 'test', ('kind',), buckets=(0.1, 1)))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.labels('a"b').observe(value)
+
+    rendered = registry.render()
+    assert '# TYPE test_seconds histogram' in rendered
+    assert 'test_seconds_bucket{kind="a\\"b",le="0.1"} 2' in rendered
+    assert 'test_seconds_bucket{kind="a\\"b",le="1.0"} 3' in rendered
+    assert 'test_seconds_bucket{kind="a\\"b",le="+Inf"} 4' in rendered
+    assert 'test_seconds_count{kind="a\\"b"} 4' in rendered
+
+
+def test_counter_and_registry():
+    registry = metrics.Registry()
+    errors = registry.register(metrics.Counter('test_errors', 'test'))
+    errors.inc()
+    errors.inc(2)
+    assert registry.register(metrics.Counter('test_errors', 'again')) is errors
+    assert 'test_errors_total 3.0' in registry.render()
+    with pytest.raises(ValueError):
+        registry.register(metrics.Histogram('test_errors', 'test'))
+    with pytest.raises(ValueError):
+        registry.register(metrics.Counter('test_labelled', 'test', ('a',))).inc()
+
+
+@pytest.mark.parametrize('statement, operation', (
+    ('SELECT 1', 'SELECT'),
+    ('\n  insert into lock values (1)', 'INSERT'),
+    ('WITH last AS (SELECT 1) SELECT * FROM last', 'WITH'),
+    ('SELECT pg_advisory_xact_lock(1)', 'SELECT'),
+    ('BEGIN', 'OTHER'),
+    ('', 'OTHER'),
+))
+def test_query_operation(statement, operation):
+    assert query_operation(statement) == operation
+
+
+def test_engine_events_observe_queries():
+    engine = create_engine('sqlite://')
+    track_queries(engine)
+    before = QUERY_SECONDS.labels('SELECT').count
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+        with pytest.raises(Exception):
+            conn.execute(text('SELECT * FROM missing'))
+        assert not conn.info['query_started']
+    assert QUERY_SECONDS.labels('SELECT').count == before + 1
+
+
+@pytest.mark.asyncio
+async def test_handle_is_observed_per_device_type_and_command():
+    handler = MessageHandler(config=SimpleNamespace(exchanges={}))
+    before = handlers.HANDLE_SECONDS.labels('lock', 'sup').count
+    await handler.handle(Delivery('{"timestamp": 1, "datahold": "{}"}', 'ask.lock.0a1b2c3d4e5f.sup', lambda *a: None))
+    assert handlers.HANDLE_SECONDS.labels('lock', 'sup').count == before + 1
+
+    errors = handlers.HANDLE_ERRORS.labels(*handlers.UNPARSED).value
+    with pytest.raises(Exception):
+        await handler.handle(Delivery('{}', 'ask.broken', lambda *a: None))
+    assert handlers.HANDLE_ERRORS.labels(*handlers.UNPARSED).value == errors + 1
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_reports_route_templates():
+    async with AsyncClient(app=app, base_url='http://testserver') as client:
+        await client.get('/no/such/path')
+        response = await client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain; version=0.0.4')
+    assert 'skaben_http_request_seconds_count{method="GET",route="<unmatched>",status="404"}' in response.text
+    assert '# TYPE skaben_mq_handle_seconds histogram' in response.text
+
+    async with AsyncClient(app=app, base_url='http://testserver') as client:
+        response = await client.get('/metrics')
+    assert 'skaben_http_request_seconds_count{method="GET",route="/metrics",status="200"}' in response.text
+
+
+@pytest.mark.asyncio
+async def test_metrics_listener_of_consumer_process():
+    server = await metrics.start_server(0, host='127.0.0.1')
+    port = server.sockets[0].getsockname()[1]
+    try:
+        async with AsyncClient(base_url=f'http://127.0.0.1:{port}') as client:
+            response = await client.get('/metrics')
+            assert response.status_code == 200
+            assert response.headers['content-type'].startswith(metrics.CONTENT_TYPE)
+            assert '# TYPE skaben_mq_handle_seconds histogram' in response.text
+            assert (await client.get('/')).status_code == 404
+    finally:
+        server.close()
+        await server.wait_closed()
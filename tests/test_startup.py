@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+CHECK = '''
+import skaben.cli, skaben.main
+from skaben.config import get_settings
+from skaben.database import get_engine
+from skaben.modules.mq.config import get_mq_config
+assert not get_settings.cache_info().currsize, 'settings loaded on import'
+assert not get_engine.cache_info().currsize, 'engine created on import'
+assert not get_mq_config.cache_info().currsize, 'broker connected on import'
+'''
+
+
+def run(args: list[str]) -> subprocess.CompletedProcess:
+    # брокер и БД на закрытых портах
+    env = dict(os.environ, AMQP_HOST='127.0.0.1', AMQP_PORT='1', DB_HOST='127.0.0.1')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(ROOT), os.environ.get('PYTHONPATH')]))
+    return subprocess.run([sys.executable, *args], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60)
+
+
+def test_imports_do_not_touch_settings_db_or_broker():
+    result = run(['-c', CHECK])
+    assert result.returncode == 0, result.stderr
+
+
+def test_cli_show_without_broker():
+    result = run(['skaben/cli.py', 'show'])
+    assert result.returncode == 0, result.stderr
+    assert 'amqp_uri' in result.stdout